@@ -0,0 +1,68 @@
+"""Gunicorn server profile, configured with MSP_* environment variables"""
+
+import os
+
+
+def get_cores() -> int:
+    """Number of usable cores, respects the CPU affinity of the container"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+def get_workers() -> int:
+    """Number of worker processes, 'auto' sizes them to the cores"""
+    Workers = os.getenv("MSP_WORKERS", "auto")
+
+    if Workers.lower() == "auto":
+        return get_cores() * 2 + 1
+
+    return max(1, int(Workers))
+
+
+bind = os.getenv("MSP_BIND", "0.0.0.0:8000")
+workers = get_workers()
+# module process pools of all workers share the cores
+os.environ["MSP_WORKER_PROCESSES"] = str(workers)
+# sync | gthread | uvicorn.workers.UvicornWorker
+worker_class = os.getenv("MSP_WORKER_CLASS", "gthread")
+threads = int(os.getenv("MSP_THREADS", "4"))
+keepalive = int(os.getenv("MSP_KEEPALIVE", "5"))
+timeout = int(os.getenv("MSP_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("MSP_GRACEFUL_TIMEOUT", "30"))
+max_requests = int(os.getenv("MSP_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("MSP_MAX_REQUESTS_JITTER", "0"))
+# load keys and modules once in the master, workers share them copy-on-write
+preload_app = os.getenv("MSP_PRELOAD", "true").lower() in ["1", "true", "yes"]
+# watcher threads of the master could be forked while holding a lock,
+# every worker starts its own in post_worker_init
+os.environ["MSP_DEFER_WATCHERS"] = "true"
+
+# uvicorn workers need the ASGI app
+if "uvicorn" in worker_class.lower():
+    wsgi_app = "mini_share_point:create_asgi_app()"
+
+else:
+    wsgi_app = "mini_share_point:create_app()"
+
+
+def on_starting(server):
+    """Single log writer for all workers, also without preloading the app"""
+    import mini_share_point
+
+    mini_share_point.setup_logging()
+
+
+def post_worker_init(worker):
+    """Per worker state, started after the app is loaded, also without preloading"""
+    import mini_share_point
+
+    mini_share_point.start_watchers()
+
+
+def worker_exit(server, worker):
+    """Keep the metrics of stopped workers"""
+    from mini_share_point import metrics
+
+    metrics.flush()
@@ -1,47 +1,264 @@
 from flask import Flask
+import dataclasses
 import logging
-import logging.handlers
 import os
+import threading
+import time
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from . import config, data, function_factory, sec_client, sec_server
+from . import (
+    asgi,
+    config,
+    data,
+    function_factory,
+    keystore,
+    logs,
+    metrics,
+    sec_client,
+    sec_server,
+    watcher,
+)
 
 __logLevel = os.getenv("MSP_LOGLEVEL", "INFO")
 __maxLogs = int(os.getenv("MSP_MAXLOGS", "5"))
 __configPath = os.getenv("MSP_CONFIG_PATH", "config/config.ini")
 __moduleConfig = os.getenv("MSP_MODCONF_PATH", "config/modules.ini")
 __logPath = os.getenv("MSP_LOGFILE_PATH", "log")
+"""Records per message and 10 seconds, repeated messages are suppressed"""
+__logRate = int(os.getenv("MSP_LOGRATE", "10"))
+__logQueue = None
+"""Watchers are started by the server after forking, e.g. in gunicorn workers"""
+__deferWatchers = os.getenv("MSP_DEFER_WATCHERS", "").lower() in ["1", "true", "yes"]
+__watchers: dict[str, threading.Thread] = {}
+"""Settings captured at startup, changes only apply after a restart"""
+__restartSettings = (
+    "ServerKeypath",
+    "ConfigWatchInterval",
+    "ClientWatchInterval",
+    "ReplayCacheSize",
+    "ReplayStore",
+    "RateStore",
+    "ModuleWatchInterval",
+    "MetricsEnabled",
+    "MetricsAllow",
+    "MetricsDir",
+    "MetricsInterval",
+    "ForwardFor",
+    "ForwardHost",
+    "ForwardPort",
+    "ForwardPrefix",
+    "ForwardProto",
+)
 
 
-def setup_server(instance: Flask) -> bool:
-    """Basic setup for all server functions"""
+def reload_clients(Settings: config.Settings) -> bool:
+    """Load the clients of the given settings, clients are kept on errors"""
+    # clients of keyfiles and register are migrated on first use
+    if Settings.ClientKeystore != "" and not keystore.open_keystore(
+        Settings.ClientKeystore, Settings.ClientRegister, Settings.ClientKeypath
+    ):
+        return False
+
+    # client secrets and public keys, mapped from the snapshot if set
+    return sec_client.reload_clients(
+        Settings.ClientRegister,
+        Settings.ClientKeypath,
+        Settings.ClientKeystore,
+        Settings.ClientSnapshot,
+    )
+
+
+def start_client_watcher(Settings: config.Settings) -> threading.Thread:
+    """Watch the client keyfiles and register file and reload clients on changes"""
+
+    # paths follow a reload of the config
+    def get_files() -> list[str]:
+        Settings = config.get_settings()
+
+        return sec_client.get_client_files(
+            Settings.ClientRegister, Settings.ClientKeypath, Settings.ClientKeystore
+        )
+
+    def on_change(Changed: set[str]):
+        if reload_clients(config.get_settings()):
+            sec_server.clear_box_cache()
+
+    return watcher.start_watcher(
+        "clients", get_files, on_change, Settings.ClientWatchInterval
+    )
+
+
+def start_module_watcher(Settings: config.Settings) -> threading.Thread:
+    """Watch the module config and module files and reload modules on changes"""
+
+    def get_files() -> list[str]:
+        return function_factory.get_module_files(__moduleConfig)
+
+    def on_change(Changed: set[str]):
+        # changed modules are imported again, failed ones keep their old version
+        function_factory.load_mods(__moduleConfig, Reload=True)
+
+    return watcher.start_watcher(
+        "modules", get_files, on_change, Settings.ModuleWatchInterval
+    )
+
+
+def check_rate_limit_proxy(Settings: config.Settings):
+    """Warn if the rate limit would put all clients behind a proxy into one bucket"""
+    if Settings.RateLimit > 0 and Settings.ForwardFor == 0:
+        logging.getLogger(__name__).warning(
+            "Rate limit is on but [Proxy] ForwardFor is 0! Behind a reverse proxy all clients share one token bucket"
+        )
+
+
+def apply_settings(Old: config.Settings, New: config.Settings):
+    """Apply reloaded settings, most others are read on every use"""
+    if New.KeyCacheSize != Old.KeyCacheSize:
+        sec_server.setup_box_cache(New.KeyCacheSize)
+
+    if New.RateLimit > 0 and Old.RateLimit == 0:
+        check_rate_limit_proxy(New)
+
+    if (
+        New.ClientRegister != Old.ClientRegister
+        or New.ClientKeypath != Old.ClientKeypath
+        or New.ClientKeystore != Old.ClientKeystore
+        or New.ClientSnapshot != Old.ClientSnapshot
+    ) and reload_clients(New):
+        sec_server.clear_box_cache()
+
+    Fixed = [
+        Field.name
+        for Field in dataclasses.fields(New)
+        if Field.name in __restartSettings
+        and getattr(New, Field.name) != getattr(Old, Field.name)
+    ]
+
+    if len(Fixed) > 0:
+        logging.getLogger(__name__).warning(
+            "Changed settings only apply after a restart: %s", ", ".join(Fixed)
+        )
+
+
+def start_config_watcher(Settings: config.Settings) -> threading.Thread:
+    """Watch the config file and apply changed settings"""
+
+    def get_files() -> list[str]:
+        return [__configPath]
+
+    def on_change(Changed: set[str]):
+        Old = config.get_settings()
+
+        # invalid config keeps the old settings
+        if config.reload_config():
+            apply_settings(Old, config.get_settings())
+            logging.getLogger(__name__).info("Reloaded config <%s>", __configPath)
+
+    return watcher.start_watcher(
+        "config", get_files, on_change, Settings.ConfigWatchInterval
+    )
+
+
+def start_watchers():
+    """Start watchers not running in this process, threads do not survive a fork"""
+    Settings = config.get_settings()
+
+    # apply changes of the config file
+    if Settings.ConfigWatchInterval > 0 and not (
+        "config" in __watchers and __watchers["config"].is_alive()
+    ):
+        __watchers["config"] = start_config_watcher(Settings)
+
+    # reload clients if keys or secrets change
+    if Settings.ClientWatchInterval > 0 and not (
+        "clients" in __watchers and __watchers["clients"].is_alive()
+    ):
+        __watchers["clients"] = start_client_watcher(Settings)
+
+    # reload modules if their files or the module config change
+    if Settings.ModuleWatchInterval > 0 and not (
+        "modules" in __watchers and __watchers["modules"].is_alive()
+    ):
+        __watchers["modules"] = start_module_watcher(Settings)
+
+    # metrics of every worker are merged through the shared directory
+    if (
+        Settings.MetricsEnabled
+        and Settings.MetricsDir != ""
+        and not ("metrics" in __watchers and __watchers["metrics"].is_alive())
+    ):
+        __watchers["metrics"] = metrics.start_flusher(Settings.MetricsInterval)
+
+
+def setup_backend() -> bool:
+    """Setup of modules and keys, shared by the WSGI and ASGI server"""
     logging.getLogger(__name__).debug("Configuring server")
+    Settings = config.get_settings()
     # load all module extensions for the server to use
     if not function_factory.load_mods(__moduleConfig):
         logging.getLogger(__name__).critical("Could not setup module extensions!")
         return False
     logging.getLogger(__name__).debug("Modules loaded")
 
-    # registering data endpoint
-    instance.register_blueprint(data.Datapoint)
-    logging.getLogger(__name__).debug("Registered endpoint")
+    # client secrets and public keys, mapped from the snapshot if set
+    if not reload_clients(Settings):
+        return False
+    logging.getLogger(__name__).debug("Clients loaded")
+
+    # precomputed shared keys for clients
+    sec_server.setup_box_cache(Settings.KeyCacheSize)
+    logging.getLogger(__name__).debug("Client key cache set up")
 
-    # loading client secrets
-    if not sec_client.load_client_secret(
-        config.read_config("Clients", "Register", "sec/clients.dev")
+    # nonces of accepted requests, rejects replayed requests
+    if not sec_server.setup_replay_cache(
+        Settings.ReplayCacheSize, Settings.ReplayStore
     ):
         return False
-    logging.getLogger(__name__).debug("Client secrets loaded")
+    logging.getLogger(__name__).debug("Replay cache set up")
+
+    # token buckets of the rate limit, shared by all workers if set
+    if not data.setup_rate_limit(Settings.RateStore):
+        return False
+    check_rate_limit_proxy(Settings)
+    logging.getLogger(__name__).debug("Rate limit set up")
+
+    # request pipeline metrics
+    metrics.setup_metrics(
+        Settings.MetricsEnabled,
+        Settings.MetricsDir,
+        Settings.MetricsAllow,
+        Settings.MetricsInterval,
+    )
+    logging.getLogger(__name__).debug("Metrics set up")
 
-    # load client public keys
-    sec_client.load_client_keys(config.read_config("Clients", "Keypath", "sec"))
-    logging.getLogger(__name__).debug("Public keys for clients loaded")
+    # background reloading of changed files
+    if not __deferWatchers:
+        start_watchers()
 
     # load server private key
-    if not sec_server.load_server_key(config.read_config("Server", "Keypath", "sec")):
+    if not sec_server.load_server_key(Settings.ServerKeypath):
         return False
     logging.getLogger(__name__).debug("Server keys loaded")
 
+    return True
+
+
+def setup_server(instance: Flask) -> bool:
+    """Basic setup for all server functions"""
+    if not setup_backend():
+        return False
+
+    Settings = config.get_settings()
+
+    # registering data endpoints
+    instance.register_blueprint(data.Datapoint)
+    instance.register_blueprint(data.DatapointV2)
+    logging.getLogger(__name__).debug("Registered endpoint")
+
+    if Settings.MetricsEnabled:
+        instance.register_blueprint(metrics.Metricpoint)
+        logging.getLogger(__name__).debug("Registered metrics endpoint")
+
     # Proxy headers; sets number of:
     # X-Forwarded-For
     # X-Forwarded-Host
@@ -50,19 +267,25 @@ def setup_server(instance: Flask) -> bool:
     # X-Forwarded-Proto
     instance.wsgi_app = ProxyFix(
         instance.wsgi_app,
-        x_for=int(config.read_config("Proxy", "ForwardFor", "0")),
-        x_host=int(config.read_config("Proxy", "ForwardHost", "0")),
-        x_port=int(config.read_config("Proxy", "ForwardPort", "0")),
-        x_prefix=int(config.read_config("Proxy", "ForwardPrefix", "0")),
-        x_proto=int(config.read_config("Proxy", "ForwardProto", "0")),
+        x_for=Settings.ForwardFor,
+        x_host=Settings.ForwardHost,
+        x_port=Settings.ForwardPort,
+        x_prefix=Settings.ForwardPrefix,
+        x_proto=Settings.ForwardProto,
     )
     logging.getLogger(__name__).debug("Applied proxy settings")
     logging.getLogger(__name__).debug("Configuration of server done")
     return True
 
 
-def create_app():
-    # logging setup
+def setup_logging():
+    """Log to the console and a rotating logfile, written by a separate process"""
+    global __logQueue
+
+    # forked workers share the writer of the server process
+    if __logQueue is not None:
+        return
+
     logLevel: int
 
     if __logLevel.upper() == "DEBUG":
@@ -83,20 +306,29 @@ def create_app():
     else:
         logLevel = logging.WARNING
 
-    LogFileHandler = logging.handlers.RotatingFileHandler(
-        (__logPath + "/latest.log"),
-        maxBytes=(1024 * 1024 * 10),
-        backupCount=__maxLogs,
-        encoding="utf-8",
-    )
-    logging.basicConfig(
-        format="[%(asctime)s][MINI-SEC-POINT] %(levelname)s in %(filename)s: %(message)s",
-        handlers=[LogFileHandler, logging.StreamHandler()],
+    # requests only put records into the queue, file I/O and rotation is done by
+    # one writer process for all workers
+    __logQueue = logs.start_log_writer(
+        __logPath + "/latest.log",
+        __maxLogs,
+        "[%(asctime)s][MINI-SEC-POINT] %(levelname)s in %(filename)s: %(message)s",
     )
+    LogQueueHandler = logs.DropQueueHandler(__logQueue)
+    # only the message is sent, the writer adds time, level and file
+    LogQueueHandler.setFormatter(logging.Formatter("%(message)s"))
+    LogQueueHandler.addFilter(logs.RateLimitFilter(__logRate, 10.0))
+    logging.basicConfig(handlers=[LogQueueHandler])
+
+    logging.getLogger(__name__).setLevel(logLevel)
+
+
+def create_app():
+    Start = time.perf_counter()
+    # logging setup
+    setup_logging()
 
     App = Flask(__name__)
     App.logger.info("Starting up mini-share-point!")
-    App.logger.setLevel(logLevel)
     logging.getLogger(__name__).debug("Log setup complete")
 
     # configuration init
@@ -110,4 +342,33 @@ def create_app():
         logging.getLogger(__name__).critical("Server setup error!")
         exit(1)
 
+    logging.getLogger(__name__).info(
+        "Server set up in %.1f ms", (time.perf_counter() - Start) * 1000
+    )
+
     return App
+
+
+def create_asgi_app():
+    """ASGI entry point, e.g. for uvicorn. Modules may use an async entry call"""
+    Start = time.perf_counter()
+    # logging setup
+    setup_logging()
+    logging.getLogger(__name__).info("Starting up mini-share-point! (ASGI)")
+
+    # configuration init
+    logging.getLogger(__name__).debug("Loading config file")
+    if not config.load_config(__configPath):
+        logging.getLogger(__name__).critical("Configuration setup error!")
+        exit(1)
+
+    # setup server
+    if not setup_backend():
+        logging.getLogger(__name__).critical("Server setup error!")
+        exit(1)
+
+    logging.getLogger(__name__).info(
+        "Server set up in %.1f ms", (time.perf_counter() - Start) * 1000
+    )
+
+    return asgi.app
@@ -1,9 +1,14 @@
+import base64
+import binascii
 import configparser
 from glob import glob
 import logging
 import os
+import sqlite3
 import sys
 
+import keystore
+
 
 __config = configparser.ConfigParser()
 __configPath = os.getenv("MSP_CONFIG_PATH", "config/config.ini")
@@ -42,11 +47,15 @@ def append_client(ClientPublicKey: str, ClientRegFile: str, ClientKeyPath: str)
     Keyfiles = glob(f"{ClientKeyPath}/client_*.pub")
     NextKey = 1
 
-    if len(Keyfiles) > 0:
-        Keyfiles = sorted(Keyfiles)
-        LastKey = Keyfiles[-1]
-        LastKey: str = os.path.basename(LastKey)
-        NextKey = int(LastKey.split(".")[0].split("_")[-1]) + 1
+    # client IDs have to be compared as numbers (client_10 > client_9)
+    for Keyfile in Keyfiles:
+        KeyName: str = os.path.basename(Keyfile)
+
+        try:
+            NextKey = max(NextKey, int(KeyName.split(".")[0].split("_")[-1]) + 1)
+
+        except ValueError:
+            continue
 
     with open(f"{ClientKeyPath}/client_{NextKey}.pub", "w") as File:
         File.write(ClientPublicKey)
@@ -62,6 +71,41 @@ def append_client(ClientPublicKey: str, ClientRegFile: str, ClientKeyPath: str)
     return StrClientSecret
 
 
+def append_client_keystore(
+    ClientPublicKey: str, ClientKeystore: str, ClientRegFile: str, ClientKeyPath: str
+) -> str:
+    """Add a client public key to the keystore file. Generates the client secret hex"""
+    try:
+        PKBytes = base64.b64decode(ClientPublicKey, validate=True)
+
+    except binascii.Error:
+        logging.critical("Client public key is not a base64-string!")
+        return "NO_APPEND"
+
+    # clients of the old layout keep their IDs
+    if not keystore.open_keystore(ClientKeystore, ClientRegFile, ClientKeyPath):
+        return "NO_APPEND"
+
+    try:
+        ClientID, StrClientSecret = keystore.add_client(ClientKeystore, PKBytes)
+
+    except ValueError as e:
+        logging.critical("%s!", e)
+        return "NO_APPEND"
+
+    except sqlite3.IntegrityError:
+        logging.critical("Client public key is already registered!")
+        return "NO_APPEND"
+
+    except sqlite3.Error as e:
+        logging.critical("Client keystore <%s> not writable: %s", ClientKeystore, e)
+        return "NO_APPEND"
+
+    logging.info("Client ID: %d", ClientID)
+
+    return StrClientSecret
+
+
 if __name__ == "__main__":
     logging.basicConfig(
         format="[%(asctime)s] %(levelname)s: %(message)s", level=logging.INFO
@@ -69,6 +113,7 @@ if __name__ == "__main__":
     load_config()
     ClientRegFile = read_config("Clients", "Register", "sec/clients.dev")
     ClientKeyStore = read_config("Clients", "Keypath", "sec")
+    ClientKeystore = read_config("Clients", "Keystore", "")
 
     if len(sys.argv) != 2:
         print("Usage: append_client <CLIENT_PUB_KEY>\n")
@@ -76,7 +121,13 @@ if __name__ == "__main__":
         print("\t\t- client public key, formatted as base64-string")
         exit(1)
 
-    ClientStr = append_client(sys.argv[1], ClientRegFile, ClientKeyStore)
+    if ClientKeystore != "":
+        ClientStr = append_client_keystore(
+            sys.argv[1], ClientKeystore, ClientRegFile, ClientKeyStore
+        )
+
+    else:
+        ClientStr = append_client(sys.argv[1], ClientRegFile, ClientKeyStore)
 
     if ClientStr == "NO_APPEND":
         logging.critical("Error while appending client!")
@@ -0,0 +1,455 @@
+"""ASGI variant of the data endpoints, crypto runs in threads to keep the loop free"""
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from . import config, data, function_factory, metrics, sec_server
+
+"""Largest accepted request body"""
+MAX_BODY_SIZE = 1024 * 1024
+ENDPOINTS = ["/v1/", "/v2/"]
+METRICS_ENDPOINT = "/metrics"
+
+Send = Callable[[dict], Awaitable[None]]
+
+
+async def read_body(Receive) -> bytes | None:
+    """Read the full request body. Returns None if too large or disconnected"""
+    Body = b""
+    MoreBody = True
+
+    while MoreBody:
+        Message = await Receive()
+
+        if Message["type"] == "http.disconnect":
+            return None
+
+        Body += Message.get("body", b"")
+        MoreBody = Message.get("more_body", False)
+
+        if len(Body) > MAX_BODY_SIZE:
+            return None
+
+    return Body
+
+
+def get_header(Scope: dict, Name: bytes) -> str:
+    """Return a request header, empty if not set"""
+    for Key, Val in Scope["headers"]:
+        if Key.lower() == Name:
+            return Val.decode("latin-1")
+
+    return ""
+
+
+def get_remote_addr(Scope: dict) -> str:
+    """Client address, honors the X-Forwarded-For proxy setting like ProxyFix"""
+    Client = Scope.get("client")
+    RemoteAddr = Client[0] if Client else ""
+    ForwardFor = config.get_settings().ForwardFor
+
+    if ForwardFor > 0:
+        Forwarded = [
+            IP.strip()
+            for IP in get_header(Scope, b"x-forwarded-for").split(",")
+            if IP.strip() != ""
+        ]
+
+        if len(Forwarded) >= ForwardFor:
+            RemoteAddr = Forwarded[-ForwardFor]
+
+    return RemoteAddr
+
+
+def accepts_binary(Scope: dict) -> bool:
+    """Check if the client wants binary frames instead of JSON responses"""
+    Accept = parse_accept_header(get_header(Scope, b"accept"), MIMEAccept)
+    BestMatch = Accept.best_match(["application/json", sec_server.FRAME_MIMETYPE])
+
+    return BestMatch == sec_server.FRAME_MIMETYPE
+
+
+async def send_response(
+    SendFunc: Send,
+    Status: int,
+    Body: bytes = b"",
+    ContentType: str = "text/plain",
+    Headers: tuple[tuple[bytes, bytes], ...] = (),
+):
+    """Send a complete response"""
+    await SendFunc(
+        {
+            "type": "http.response.start",
+            "status": Status,
+            "headers": [
+                (b"content-type", ContentType.encode("latin-1")),
+                (b"content-length", str(len(Body)).encode("latin-1")),
+                *Headers,
+            ],
+        }
+    )
+    await SendFunc({"type": "http.response.body", "body": Body})
+
+
+async def send_message(
+    SendFunc: Send, ClientKey, Message: str | bytes, Status: int, Binary: bool
+):
+    """Encrypt a message and send it as JSON or as binary frame"""
+    if Binary:
+        MsgEncrypt = await asyncio.to_thread(
+            sec_server.encrypt_message_bytes, ClientKey, Message
+        )
+        await send_response(
+            SendFunc,
+            Status,
+            sec_server.pack_frame(MsgEncrypt),
+            sec_server.FRAME_MIMETYPE,
+        )
+        return
+
+    ResponseEncrypt = await asyncio.to_thread(
+        sec_server.encrypt_message, ClientKey, Message
+    )
+    await send_response(
+        SendFunc,
+        Status,
+        json.dumps({"value": ResponseEncrypt}).encode("utf-8"),
+        "application/json",
+    )
+
+
+async def iterate_chunks(Chunks) -> AsyncIterator[str | bytes]:
+    """Iterate over sync or async module chunks without blocking the loop"""
+    if inspect.isasyncgen(Chunks):
+        async for Chunk in Chunks:
+            yield Chunk
+
+        return
+
+    ChunkIter = iter(Chunks)
+    Done = object()
+
+    while True:
+        Chunk = await asyncio.to_thread(next, ChunkIter, Done)
+
+        if Chunk is Done:
+            return
+
+        yield Chunk
+
+
+async def start_chunks(Chunks) -> AsyncIterator[str | bytes]:
+    """Take the first chunk, errors before it are answered like single messages"""
+    ChunkIter = iterate_chunks(Chunks)
+    Done = object()
+    First = await anext(ChunkIter, Done)
+
+    async def resume_chunks() -> AsyncIterator[str | bytes]:
+        if First is Done:
+            return
+
+        yield First
+
+        async for Chunk in ChunkIter:
+            yield Chunk
+
+    return resume_chunks()
+
+
+async def send_stream(
+    SendFunc: Send, ClientKey, Chunks: AsyncIterator[str | bytes], Binary: bool
+):
+    """Encrypt and send module chunks one by one, same format as the WSGI stream"""
+    await SendFunc(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (
+                    b"content-type",
+                    (
+                        sec_server.FRAME_STREAM_MIMETYPE
+                        if Binary
+                        else sec_server.STREAM_MIMETYPE
+                    ).encode("latin-1"),
+                )
+            ],
+        }
+    )
+
+    MsgBox = sec_server.get_client_box(ClientKey)
+    # frames of different streams can not be mixed
+    StreamID = os.urandom(16)
+    Seq = 0
+
+    try:
+        async for Chunk in Chunks:
+            if isinstance(Chunk, str):
+                Chunk = Chunk.encode("utf-8")
+
+            Frame = await asyncio.to_thread(
+                sec_server.encrypt_frame, MsgBox, StreamID, Seq, False, Chunk, Binary
+            )
+            await SendFunc(
+                {"type": "http.response.body", "body": Frame, "more_body": True}
+            )
+            Seq += 1
+
+    except function_factory.ModuleTimeout as e:
+        logging.getLogger(__name__).warning("%s", e)
+        # missing final frame shows the client a truncated stream
+        await SendFunc({"type": "http.response.body", "body": b""})
+        return
+
+    # missing final frame shows the client a truncated stream
+    Frame = sec_server.encrypt_frame(MsgBox, StreamID, Seq, True, b"", Binary)
+    await SendFunc({"type": "http.response.body", "body": Frame})
+
+
+async def send_redirect(SendFunc: Send, Scope: dict):
+    """Redirect to the endpoint with the trailing slash, keeps method and body"""
+    Location = Scope.get("root_path", "") + Scope["path"] + "/"
+    Query = Scope.get("query_string", b"").decode("latin-1")
+
+    if Query != "":
+        Location += "?" + Query
+
+    await send_response(
+        SendFunc, 308, Headers=((b"location", Location.encode("latin-1")),)
+    )
+
+
+async def send_metrics(SendFunc: Send, RemoteAddr: str):
+    """Send the metrics, only to allowed addresses and inside the rate limit"""
+    # module names and client counts are not shown to other addresses
+    if not metrics.check_scraper(RemoteAddr):
+        await send_response(SendFunc, 404)
+        return
+
+    # the shared store is written in a thread, not on the loop
+    RetryAfter = await asyncio.to_thread(data.check_rate_limit, RemoteAddr)
+
+    if RetryAfter > 0:
+        await send_response(
+            SendFunc,
+            429,
+            Headers=((b"retry-after", str(RetryAfter).encode("latin-1")),),
+        )
+        return
+
+    Metrics = await asyncio.to_thread(metrics.render_cached)
+    await send_response(
+        SendFunc, 200, Metrics.encode("utf-8"), metrics.METRICS_CONTENT_TYPE
+    )
+
+
+async def call_remote_module(
+    DecryptResponse: sec_server.DecryptedMessage,
+) -> tuple[int, str | bytes | AsyncIterator[str | bytes]]:
+    """Async version of data.call_remote_module"""
+    try:
+        if len(DecryptResponse.FunctionBatch) > 0:
+            BatchVal = await function_factory.call_modules_async(
+                DecryptResponse.FunctionBatch
+            )
+            return 200, json.dumps(BatchVal)
+
+        FunctionVal = await function_factory.call_module_async(
+            DecryptResponse.FunctionCall
+        )
+
+        # checked before the response starts, a stream can not be turned into an error
+        if not isinstance(FunctionVal, (str, bytes)):
+            return 200, await start_chunks(FunctionVal)
+
+        return 200, FunctionVal
+
+    except (function_factory.ModuleTimeout, function_factory.ModuleValueError) as e:
+        return data.get_module_error(e)
+
+
+async def respond_remote_call(
+    SendFunc: Send,
+    RemoteAddr: str,
+    DecryptResponse: sec_server.DecryptedMessage,
+    Binary: bool,
+):
+    """Check a decrypted request and send the encrypted module response"""
+    if not data.check_remote_call(DecryptResponse, RemoteAddr):
+        await send_response(SendFunc, 401)
+        return
+
+    Status, FunctionVal = await call_remote_module(DecryptResponse)
+
+    if Status == 200:
+        data.check_request_ip(RemoteAddr)
+
+    # module returned chunks -> stream them encrypted one by one
+    if not isinstance(FunctionVal, (str, bytes)):
+        logging.getLogger(__name__).debug("Streaming function value")
+        await send_stream(SendFunc, DecryptResponse.ClientKey, FunctionVal, Binary)
+        return
+
+    logging.getLogger(__name__).debug("Returned function value: %s", FunctionVal)
+    await send_message(SendFunc, DecryptResponse.ClientKey, FunctionVal, Status, Binary)
+
+
+async def decrypt_request(
+    Path: str, ContentType: str, Body: bytes, RemoteAddr: str
+) -> sec_server.DecryptedMessage | None:
+    """Decrypt a v1 or v2 request body. Returns None if malformed"""
+    # binary request: raw envelope without base64 and JSON
+    if Path == "/v2/" and ContentType == sec_server.FRAME_MIMETYPE:
+        Frame = sec_server.unpack_request_frame(Body)
+
+        if Frame is None:
+            logging.getLogger(__name__).info("Malformed frame from: %s", RemoteAddr)
+            metrics.inc("msp_unauthorized_total", reason="malformed")
+            return None
+
+        return await asyncio.to_thread(
+            sec_server.decrypt_envelope_bytes, Frame[0], Frame[1]
+        )
+
+    PostJson = None
+
+    if ContentType == "application/json" or ContentType.endswith("+json"):
+        try:
+            with metrics.timed("msp_stage_seconds", stage="json_parse"):
+                PostJson = json.loads(Body)
+
+        except ValueError:
+            PostJson = None
+
+    if not isinstance(PostJson, dict):
+        logging.getLogger(__name__).info("Malformed JSON from: %s", RemoteAddr)
+        metrics.inc("msp_unauthorized_total", reason="malformed")
+        return None
+
+    # optional fingerprint of the client key
+    KeyIDSent = PostJson.get("kid", "")
+
+    if Path == "/v1/" and all(
+        Field in PostJson for Field in ["id", "check", "ts", "entry"]
+    ):
+        return await asyncio.to_thread(
+            sec_server.decrypt_remote_call,
+            PostJson["id"],
+            PostJson["check"],
+            PostJson["ts"],
+            PostJson["entry"],
+            KeyIDSent,
+        )
+
+    if Path == "/v2/" and isinstance(PostJson.get("msg"), str):
+        return await asyncio.to_thread(
+            sec_server.decrypt_envelope, PostJson["msg"], KeyIDSent
+        )
+
+    logging.getLogger(__name__).info("Malformed request from: %s", RemoteAddr)
+    metrics.inc("msp_unauthorized_total", reason="malformed")
+    return None
+
+
+async def handle_lifespan(Receive, SendFunc: Send):
+    """Startup is already done when the app is created"""
+    while True:
+        Message = await Receive()
+
+        if Message["type"] == "lifespan.startup":
+            await SendFunc({"type": "lifespan.startup.complete"})
+
+        elif Message["type"] == "lifespan.shutdown":
+            await SendFunc({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(Scope: dict, Receive, SendFunc: Send):
+    """ASGI application serving the v1 and v2 data endpoints"""
+    if Scope["type"] == "lifespan":
+        await handle_lifespan(Receive, SendFunc)
+        return
+
+    if Scope["type"] != "http":
+        return
+
+    if Scope["path"] == METRICS_ENDPOINT and config.get_settings().MetricsEnabled:
+        await send_metrics(SendFunc, get_remote_addr(Scope))
+        return
+
+    # same redirect as Flask for endpoints without the trailing slash
+    if Scope["path"] + "/" in ENDPOINTS and Scope["method"] == "POST":
+        await send_redirect(SendFunc, Scope)
+        return
+
+    if Scope["path"] not in ENDPOINTS:
+        await send_response(SendFunc, 404)
+        return
+
+    if Scope["method"] != "POST":
+        await send_response(SendFunc, 405)
+        return
+
+    RemoteAddr = get_remote_addr(Scope)
+    logging.getLogger(__name__).debug("Incoming request from: %s", RemoteAddr)
+
+    RequestStart = time.perf_counter()
+
+    async def send_checked(Message: dict):
+        if Message["type"] == "http.response.start":
+            # failed authentications take additional tokens
+            if Message["status"] == 401:
+                await asyncio.to_thread(data.penalize_request_ip, RemoteAddr)
+
+            # streamed responses are only measured until the first chunk
+            metrics.observe(
+                "msp_stage_seconds", time.perf_counter() - RequestStart, stage="total"
+            )
+
+        await SendFunc(Message)
+
+    # throttle before the body is read or decrypted, the shared store is written
+    # in a thread, not on the loop
+    RetryAfter = await asyncio.to_thread(data.check_rate_limit, RemoteAddr)
+
+    if RetryAfter > 0:
+        await send_checked(
+            {
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-length", b"0"),
+                    (b"retry-after", str(RetryAfter).encode("latin-1")),
+                ],
+            }
+        )
+        await send_checked({"type": "http.response.body", "body": b""})
+        return
+
+    Body = await read_body(Receive)
+
+    if Body is None:
+        logging.getLogger(__name__).info("Request too large from: %s", RemoteAddr)
+        await send_response(send_checked, 413)
+        return
+
+    ContentType = get_header(Scope, b"content-type").split(";")[0].strip().lower()
+    DecryptResponse = await decrypt_request(
+        Scope["path"], ContentType, Body, RemoteAddr
+    )
+
+    if DecryptResponse is None:
+        await send_response(send_checked, 401)
+        return
+
+    # v1 only knows JSON responses
+    Binary = Scope["path"] == "/v2/" and accepts_binary(Scope)
+
+    await respond_remote_call(send_checked, RemoteAddr, DecryptResponse, Binary)
@@ -1,15 +1,151 @@
 import configparser
+import dataclasses
+import ipaddress
 import logging
 import os
 
 
-__config = configparser.ConfigParser()
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    """Typed server settings, parsed once from the config file"""
+
+    # [Server]
+    ServerKeypath: str = "sec"
+    IPAddressTTL: int = 300
+    IPTableSize: int = 65536
+    KeyCacheSize: int = 8192
+    ConfigWatchInterval: int = 5
+    # [Clients]
+    ClientKeypath: str = "sec"
+    ClientRegister: str = "sec/clients.dev"
+    # single file keystore, replaces keyfiles and register if set
+    ClientKeystore: str = ""
+    # packed clients mapped by all workers, rebuilt if the clients change
+    ClientSnapshot: str = ""
+    RequestTTL: int = 30
+    ClientWatchInterval: int = 5
+    MaxBatchSize: int = 32
+    ReplayCacheSize: int = 100000
+    # nonces shared by all workers, kept per process if empty
+    ReplayStore: str = ""
+    # [RateLimit]
+    # buckets are keyed by the remote address, off as it needs ForwardFor behind a proxy
+    RateLimit: int = 0
+    RateBurst: int = 40
+    RateFailCost: int = 10
+    # token buckets shared by all workers, kept per process if empty
+    RateStore: str = ""
+    # [Modules]
+    ModuleWatchInterval: int = 5
+    # [Metrics]
+    MetricsEnabled: bool = False
+    # remote addresses or networks allowed to read /metrics
+    MetricsAllow: tuple[str, ...] = ("127.0.0.1", "::1")
+    MetricsDir: str = ""
+    MetricsInterval: int = 5
+    # [Proxy]
+    ForwardFor: int = 0
+    ForwardHost: int = 0
+    ForwardPort: int = 0
+    ForwardPrefix: int = 0
+    ForwardProto: int = 0
+
+
+__settings = Settings()
+__configFilePath = ""
+
+
+def parse_settings(Config: configparser.ConfigParser) -> Settings:
+    """Build the settings from a parsed config. Raises ValueError on bad values"""
+    Default = Settings()
+
+    def get_str(Section: str, Key: str, Fallback: str) -> str:
+        return Config.get(Section, Key, fallback=Fallback)
+
+    def get_int(Section: str, Key: str, Fallback: int, Minimum: int) -> int:
+        Val = Config.getint(Section, Key, fallback=Fallback)
+
+        if Val < Minimum:
+            raise ValueError(f"[{Section}] {Key} has to be at least {Minimum}")
+
+        return Val
+
+    def get_bool(Section: str, Key: str, Fallback: bool) -> bool:
+        return Config.getboolean(Section, Key, fallback=Fallback)
+
+    def get_networks(Section: str, Key: str, Fallback: tuple[str, ...]):
+        Val = Config.get(Section, Key, fallback=None)
+
+        if Val is None:
+            return Fallback
+
+        Networks = tuple(Item.strip() for Item in Val.split(",") if Item.strip() != "")
+
+        for Network in Networks:
+            ipaddress.ip_network(Network, strict=False)
+
+        return Networks
+
+    return Settings(
+        ServerKeypath=get_str("Server", "Keypath", Default.ServerKeypath),
+        IPAddressTTL=get_int("Server", "IPAddressTTL", Default.IPAddressTTL, 1),
+        IPTableSize=get_int("Server", "IPTableSize", Default.IPTableSize, 1),
+        KeyCacheSize=get_int("Server", "KeyCacheSize", Default.KeyCacheSize, 1),
+        ConfigWatchInterval=get_int(
+            "Server", "WatchInterval", Default.ConfigWatchInterval, 0
+        ),
+        ClientKeypath=get_str("Clients", "Keypath", Default.ClientKeypath),
+        ClientRegister=get_str("Clients", "Register", Default.ClientRegister),
+        ClientKeystore=get_str("Clients", "Keystore", Default.ClientKeystore),
+        ClientSnapshot=get_str("Clients", "Snapshot", Default.ClientSnapshot),
+        RequestTTL=get_int("Clients", "RequestTTL", Default.RequestTTL, 1),
+        ClientWatchInterval=get_int(
+            "Clients", "WatchInterval", Default.ClientWatchInterval, 0
+        ),
+        MaxBatchSize=get_int("Clients", "MaxBatchSize", Default.MaxBatchSize, 1),
+        ReplayCacheSize=get_int(
+            "Clients", "ReplayCacheSize", Default.ReplayCacheSize, 0
+        ),
+        ReplayStore=get_str("Clients", "ReplayStore", Default.ReplayStore),
+        RateLimit=get_int("RateLimit", "Rate", Default.RateLimit, 0),
+        RateBurst=get_int("RateLimit", "Burst", Default.RateBurst, 1),
+        RateFailCost=get_int("RateLimit", "FailCost", Default.RateFailCost, 0),
+        RateStore=get_str("RateLimit", "Store", Default.RateStore),
+        ModuleWatchInterval=get_int(
+            "Modules", "WatchInterval", Default.ModuleWatchInterval, 0
+        ),
+        MetricsEnabled=get_bool("Metrics", "Enabled", Default.MetricsEnabled),
+        MetricsAllow=get_networks("Metrics", "Allow", Default.MetricsAllow),
+        MetricsDir=get_str("Metrics", "Directory", Default.MetricsDir),
+        MetricsInterval=get_int("Metrics", "FlushInterval", Default.MetricsInterval, 1),
+        ForwardFor=get_int("Proxy", "ForwardFor", Default.ForwardFor, 0),
+        ForwardHost=get_int("Proxy", "ForwardHost", Default.ForwardHost, 0),
+        ForwardPort=get_int("Proxy", "ForwardPort", Default.ForwardPort, 0),
+        ForwardPrefix=get_int("Proxy", "ForwardPrefix", Default.ForwardPrefix, 0),
+        ForwardProto=get_int("Proxy", "ForwardProto", Default.ForwardProto, 0),
+    )
 
 
 def load_config(ConfigFilePath: str) -> bool:
     """Load the main configuration from file"""
+    global __settings, __configFilePath
+
     if os.path.exists(ConfigFilePath) and os.path.isfile(ConfigFilePath):
-        __config.read(ConfigFilePath)
+        NewConfig = configparser.ConfigParser()
+
+        try:
+            NewConfig.read(ConfigFilePath)
+            NewSettings = parse_settings(NewConfig)
+
+        except (configparser.Error, ValueError) as e:
+            logging.getLogger(__name__).critical(
+                "Invalid value in config file <%s>: %s", ConfigFilePath, e
+            )
+            return False
+
+        # swap whole configuration at once
+        __settings = NewSettings
+        __configFilePath = ConfigFilePath
         return True
 
     else:
@@ -19,8 +155,15 @@ def load_config(ConfigFilePath: str) -> bool:
         return False
 
 
-def read_config(Section: str, Key: str, Fallback: str) -> str:
-    """Return a configured value"""
-    Val = __config.get(Section, Key, fallback=Fallback)
+def reload_config() -> bool:
+    """Reload the configuration file. Old settings are kept on errors"""
+    if __configFilePath == "":
+        logging.getLogger(__name__).error("No config file loaded yet!")
+        return False
+
+    return load_config(__configFilePath)
+
 
-    return Val
+def get_settings() -> Settings:
+    """Return the current settings"""
+    return __settings
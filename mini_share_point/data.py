@@ -1,49 +1,412 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, g, request, jsonify
+import collections
+import itertools
+import json
 import logging
+import math
+import sqlite3
+import threading
 import time
+from typing import Iterable, Iterator
 
-from . import function_factory, sec_client, sec_server, config
+from . import function_factory, metrics, sec_client, sec_server, config, statestore
 
 
 Datapoint = Blueprint("sharepoint", __name__, url_prefix="/v1")
-IPTable: dict[str, int] = {}
+DatapointV2 = Blueprint("sharepointv2", __name__, url_prefix="/v2")
+"""Last request time per IP, ordered from oldest to newest request"""
+IPTable: collections.OrderedDict[str, int] = collections.OrderedDict()
+__IPTableLock = threading.Lock()
+"""Token bucket per IP as (tokens, last update), ordered from oldest to newest update"""
+RateTable: collections.OrderedDict[str, tuple[float, float]] = collections.OrderedDict()
+__RateTableLock = threading.Lock()
+"""Token buckets shared by all worker processes, None keeps them in RateTable"""
+__RateStore: statestore.StateStore | None = None
+__RateUpdates: int = 0
 
+RATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rates (
+    ip TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    missing REAL NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rates_updated ON rates (updated);
+"""
+"""Same token bucket as take_rate_tokens in one statement, returns missing tokens"""
+RATE_UPDATE = """
+INSERT INTO rates (ip, tokens, missing, updated)
+VALUES (:ip, :tokens, :missing, :now)
+ON CONFLICT (ip) DO UPDATE SET
+    tokens = CASE
+        WHEN :penalty THEN MAX(-:burst, {Refill} - :cost)
+        WHEN {Refill} >= :cost THEN {Refill} - :cost
+        ELSE {Refill}
+    END,
+    missing = CASE
+        WHEN :penalty OR {Refill} >= :cost THEN 0
+        ELSE :cost - {Refill}
+    END,
+    updated = :now
+RETURNING missing
+""".format(Refill="MIN(:burst, tokens + (:now - updated) * :rate)")
 
-def check_request_ip(IPAddress: str):
-    MaxTTL = int(config.read_config("Server", "IPAddressTTL", "300"))
+metrics.register_gauge("msp_ip_table_size", lambda: len(IPTable))
+metrics.register_gauge("msp_rate_table_size", lambda: get_rate_table_size())
 
-    if IPAddress not in IPTable:
-        IPTable[IPAddress] = int(time.time())
-        logging.getLogger(__name__).warning("New request from IP: %s", IPAddress)
 
-    else:
-        LastReq = IPTable[IPAddress]
+def check_request_ip(IPAddress: str):
+    Settings = config.get_settings()
+    MaxTTL = Settings.IPAddressTTL
+    MaxIPs = Settings.IPTableSize
+    Time = int(time.time())
+
+    with __IPTableLock:
+        if IPAddress not in IPTable:
+            logging.getLogger(__name__).warning("New request from IP: %s", IPAddress)
 
         # IP with last request is too old
-        if abs(LastReq - int(time.time())) > MaxTTL:
+        elif Time - IPTable[IPAddress] > MaxTTL:
             logging.getLogger(__name__).warning(
                 "Remote address with a new connection! IP: %s", IPAddress
             )
 
-        # always set new timestamp
-        IPTable[IPAddress] = int(time.time())
+        # always set new timestamp, newest entry is moved to the end
+        IPTable[IPAddress] = Time
+        IPTable.move_to_end(IPAddress)
 
-    Time = int(time.time())
-    for IP in IPTable:
-        IPTime = IPTable[IP]
+        # scrap oldest IP entries while over the max TTL or the max table size
+        while len(IPTable) > 0:
+            OldestIP, OldestTime = next(iter(IPTable.items()))
+
+            if Time - OldestTime <= MaxTTL and len(IPTable) <= MaxIPs:
+                break
+
+            IPTable.pop(OldestIP)
+
+
+def setup_rate_limit(Store: str = "") -> bool:
+    """Keep the token buckets in the Store file shared by all workers if set"""
+    global __RateStore
+
+    __RateStore = None
+
+    with __RateTableLock:
+        RateTable.clear()
+
+    if Store != "":
+        try:
+            __RateStore = statestore.StateStore(Store, RATE_SCHEMA)
+
+        except sqlite3.Error as e:
+            logging.getLogger(__name__).critical(
+                "Could not open rate limit store <%s>: %s", Store, e
+            )
+            return False
+
+    return True
+
+
+def get_rate_table_size() -> int:
+    """Number of token buckets, of all workers if they are shared"""
+    Store = __RateStore
+
+    if Store is not None:
+        return Store.execute("SELECT COUNT(*) FROM rates")[0][0]
+
+    return len(RateTable)
+
+
+def take_rate_tokens(IPAddress: str, Cost: int, Penalty: bool = False) -> float:
+    """Take tokens from the bucket of an IP. Returns the missing tokens, 0 if allowed"""
+    Store = __RateStore
+
+    if Store is not None:
+        return take_shared_rate_tokens(Store, IPAddress, Cost, Penalty)
+
+    Settings = config.get_settings()
+    Rate = Settings.RateLimit
+    Burst = Settings.RateBurst
+    Time = time.monotonic()
+    Missing = 0.0
+
+    with __RateTableLock:
+        Tokens, LastTime = RateTable.get(IPAddress, (Burst, Time))
+        Tokens = min(Burst, Tokens + (Time - LastTime) * Rate)
+
+        # penalties drain the bucket below zero -> the IP has to wait longer
+        if Penalty:
+            Tokens = max(-Burst, Tokens - Cost)
+
+        elif Tokens >= Cost:
+            Tokens -= Cost
+
+        else:
+            Missing = Cost - Tokens
+
+        RateTable[IPAddress] = (Tokens, Time)
+        RateTable.move_to_end(IPAddress)
+
+        # scrap refilled buckets, same as new ones, and while over the max table size
+        while len(RateTable) > 0:
+            OldestIP, (OldestTokens, OldestTime) = next(iter(RateTable.items()))
+
+            if (
+                OldestTokens + (Time - OldestTime) * Rate < Burst
+                and len(RateTable) <= Settings.IPTableSize
+            ):
+                break
+
+            RateTable.pop(OldestIP)
+
+    return Missing
+
+
+def take_shared_rate_tokens(
+    Store: statestore.StateStore, IPAddress: str, Cost: int, Penalty: bool
+) -> float:
+    """take_rate_tokens with the buckets of all workers"""
+    global __RateUpdates
+
+    Settings = config.get_settings()
+    Rate = Settings.RateLimit
+    Burst = Settings.RateBurst
+    # monotonic time is not comparable between processes on every platform
+    Time = time.time()
+
+    # scrap refilled buckets and oldest ones over the max table size, not per request
+    if __RateUpdates % 1024 == 0:
+        Store.execute(
+            "DELETE FROM rates WHERE tokens + (? - updated) * ? >= ?",
+            (Time, Rate, Burst),
+        )
+        Count = Store.execute("SELECT COUNT(*) FROM rates")[0][0]
+
+        if Count > Settings.IPTableSize:
+            Store.execute(
+                "DELETE FROM rates WHERE ip IN "
+                "(SELECT ip FROM rates ORDER BY updated LIMIT ?)",
+                (Count - Settings.IPTableSize,),
+            )
+
+    __RateUpdates += 1
+
+    # bucket of a new IP starts full
+    if Penalty:
+        Tokens, Missing = max(-Burst, Burst - Cost), 0
+
+    elif Burst >= Cost:
+        Tokens, Missing = Burst - Cost, 0
+
+    else:
+        Tokens, Missing = Burst, Cost - Burst
+
+    return Store.execute(
+        RATE_UPDATE,
+        {
+            "ip": IPAddress,
+            "tokens": Tokens,
+            "missing": Missing,
+            "now": Time,
+            "penalty": Penalty,
+            "burst": Burst,
+            "rate": Rate,
+            "cost": Cost,
+        },
+    )[0][0]
+
+
+def check_rate_limit(IPAddress: str) -> int:
+    """Take a token for a request. Returns the seconds to wait, 0 if allowed"""
+    Rate = config.get_settings().RateLimit
+
+    if Rate == 0:
+        return 0
+
+    Missing = take_rate_tokens(IPAddress, 1)
+
+    if Missing > 0:
+        logging.getLogger(__name__).debug("Rate limit hit by: %s", IPAddress)
+        metrics.inc("msp_throttled_total")
+        return max(1, math.ceil(Missing / Rate))
+
+    return 0
+
+
+def penalize_request_ip(IPAddress: str):
+    """Failed authentications take additional tokens"""
+    Settings = config.get_settings()
+
+    if Settings.RateLimit == 0 or Settings.RateFailCost == 0:
+        return
+
+    take_rate_tokens(IPAddress, Settings.RateFailCost, Penalty=True)
+
+
+@Datapoint.before_request
+@DatapointV2.before_request
+def start_request_timer():
+    g.RequestStart = time.perf_counter()
+
+
+@Datapoint.before_request
+@DatapointV2.before_request
+@metrics.Metricpoint.before_request
+def limit_request_rate():
+    """Throttle requests before the body is decoded or decrypted"""
+    RetryAfter = check_rate_limit(request.remote_addr)
+
+    if RetryAfter > 0:
+        return "", 429, {"Retry-After": str(RetryAfter)}
 
-        # scrap IP entry if over the max TTL
-        if abs(IPTime - Time) > MaxTTL:
-            IPTable.pop(IP, "")
+    return None
+
+
+@Datapoint.after_request
+@DatapointV2.after_request
+def penalize_failed_auth(Response):
+    if Response.status_code == 401:
+        penalize_request_ip(request.remote_addr)
+
+    # streamed responses are only measured until the first chunk
+    metrics.observe(
+        "msp_stage_seconds", time.perf_counter() - g.RequestStart, stage="total"
+    )
+
+    return Response
+
+
+def make_message_response(ClientKey, Message: str | bytes, Status: int, Binary: bool):
+    """Encrypt a message and return it as JSON or as binary frame"""
+    if Binary:
+        return Response(
+            sec_server.pack_frame(sec_server.encrypt_message_bytes(ClientKey, Message)),
+            Status,
+            mimetype=sec_server.FRAME_MIMETYPE,
+        )
+
+    return jsonify(value=sec_server.encrypt_message(ClientKey, Message)), Status
+
+
+def start_chunks(Chunks: Iterable[str | bytes]) -> Iterator[str | bytes]:
+    """Take the first chunk, errors before it are answered like single messages"""
+    ChunkIter = iter(Chunks)
+    Done = object()
+    First = next(ChunkIter, Done)
+
+    if First is Done:
+        return ChunkIter
+
+    return itertools.chain([First], ChunkIter)
+
+
+def encrypt_chunks(ClientKey, Chunks: Iterator[str | bytes], Binary: bool):
+    """Encrypt module chunks one by one, a timed out module truncates the stream"""
+    try:
+        yield from sec_server.encrypt_stream(ClientKey, Chunks, Binary)
+
+    # missing final frame shows the client a truncated stream
+    except function_factory.ModuleTimeout as e:
+        logging.getLogger(__name__).warning("%s", e)
+
+
+def check_remote_call(
+    DecryptResponse: sec_server.DecryptedMessage, RemoteAddr: str
+) -> bool:
+    """Check that a decrypted request comes from a registered client"""
+    # message could not be decrypted -> no key registered
+    if DecryptResponse.ReturnCode == sec_server.ReturnCode.NOT_AUTHORIZED:
+        logging.getLogger(__name__).info(
+            "Unauthorized endpoint tried connecting - %s", RemoteAddr
+        )
+        return False
+
+    with metrics.timed("msp_stage_seconds", stage="register_check"):
+        Registered = sec_client.check_client_register(
+            DecryptResponse.ClientSecret, DecryptResponse.ClientKey
+        )
+
+    if not Registered:
+        logging.getLogger(__name__).warning(
+            "Key Error on decrypted message! %s sent unregistered SECRET! Client Private Key may be compromised!",
+            RemoteAddr,
+        )
+        metrics.inc("msp_unauthorized_total", reason="unregistered_secret")
+        return False
+
+    return True
+
+
+def get_module_error(Error: Exception) -> tuple[int, str]:
+    """Status and message of a failed module call, sent encrypted to the client"""
+    if isinstance(Error, function_factory.ModuleTimeout):
+        logging.getLogger(__name__).warning("%s", Error)
+        return 504, "ERROR: module call timed out"
+
+    logging.getLogger(__name__).error("%s", Error)
+    return 500, "ERROR: module call failed"
+
+
+def call_remote_module(
+    DecryptResponse: sec_server.DecryptedMessage,
+) -> tuple[int, str | bytes | Iterator[str | bytes]]:
+    """Call the requested modules. Returns the status and a message or chunks"""
+    try:
+        if len(DecryptResponse.FunctionBatch) > 0:
+            BatchVal = function_factory.call_modules(DecryptResponse.FunctionBatch)
+            return 200, json.dumps(BatchVal)
+
+        FunctionVal = function_factory.call_module(DecryptResponse.FunctionCall)
+
+        # checked before the response starts, a stream can not be turned into an error
+        if not isinstance(FunctionVal, (str, bytes)):
+            return 200, start_chunks(FunctionVal)
+
+        return 200, FunctionVal
+
+    except (function_factory.ModuleTimeout, function_factory.ModuleValueError) as e:
+        return get_module_error(e)
+
+
+def respond_remote_call(
+    DecryptResponse: sec_server.DecryptedMessage, Binary: bool = False
+):
+    """Check a decrypted request and return the encrypted module response"""
+    if not check_remote_call(DecryptResponse, request.remote_addr):
+        return "", 401
+
+    Status, FunctionVal = call_remote_module(DecryptResponse)
+
+    if Status == 200:
+        check_request_ip(request.remote_addr)
+
+    # module returned chunks -> stream them encrypted one by one
+    if not isinstance(FunctionVal, (str, bytes)):
+        logging.getLogger(__name__).debug("Streaming function value")
+        return Response(
+            encrypt_chunks(DecryptResponse.ClientKey, FunctionVal, Binary),
+            200,
+            mimetype=(
+                sec_server.FRAME_STREAM_MIMETYPE
+                if Binary
+                else sec_server.STREAM_MIMETYPE
+            ),
+        )
+
+    logging.getLogger(__name__).debug("Returned function value: %s", FunctionVal)
+
+    return make_message_response(DecryptResponse.ClientKey, FunctionVal, Status, Binary)
 
 
 @Datapoint.route("/", methods=["POST"])
 def post_data_json():
-    PostJson = request.get_json(silent=True)
+    with metrics.timed("msp_stage_seconds", stage="json_parse"):
+        PostJson = request.get_json(silent=True)
 
     logging.getLogger(__name__).debug("Incoming request from: %s", request.remote_addr)
     if PostJson is None:
         logging.getLogger(__name__).info("Malformed JSON from: %s", request.remote_addr)
+        metrics.inc("msp_unauthorized_total", reason="malformed")
         return "", 401
 
     if (
@@ -56,36 +419,69 @@ def post_data_json():
         CRCSent = PostJson["check"]
         TimeSent = PostJson["ts"]
         FuncSent = PostJson["entry"]
+        # optional fingerprint of the client key
+        KeyIDSent = PostJson.get("kid", "")
         DecryptResponse: sec_server.DecryptedMessage = sec_server.decrypt_remote_call(
-            IDSent, CRCSent, TimeSent, FuncSent
+            IDSent, CRCSent, TimeSent, FuncSent, KeyIDSent
         )
 
-        # message could not be decrypted -> no key registered
-        if DecryptResponse.ReturnCode == sec_server.ReturnCode.NOT_AUTHORIZED:
+        return respond_remote_call(DecryptResponse)
+
+    logging.getLogger(__name__).info("Malformed request from: %s", request.remote_addr)
+    metrics.inc("msp_unauthorized_total", reason="malformed")
+    return "", 401
+
+
+def accepts_binary() -> bool:
+    """Check if the client wants binary frames instead of JSON responses"""
+    BestMatch = request.accept_mimetypes.best_match(
+        ["application/json", sec_server.FRAME_MIMETYPE]
+    )
+
+    return BestMatch == sec_server.FRAME_MIMETYPE
+
+
+@DatapointV2.route("/", methods=["POST"])
+def post_envelope():
+    # binary request: raw envelope without base64 and JSON
+    if request.mimetype == sec_server.FRAME_MIMETYPE:
+        logging.getLogger(__name__).debug(
+            "Incoming binary request from: %s", request.remote_addr
+        )
+        Frame = sec_server.unpack_request_frame(request.get_data())
+
+        if Frame is None:
             logging.getLogger(__name__).info(
-                "Unauthorized endpoint tried connecting - %s", request.remote_addr
+                "Malformed frame from: %s", request.remote_addr
             )
+            metrics.inc("msp_unauthorized_total", reason="malformed")
             return "", 401
 
-        Registered = sec_client.check_client_register(DecryptResponse.ClientSecret)
+        DecryptResponse: sec_server.DecryptedMessage = (
+            sec_server.decrypt_envelope_bytes(Frame[0], Frame[1])
+        )
 
-        if Registered:
-            FunctionVal = function_factory.call_module(DecryptResponse.FunctionCall)
-            logging.getLogger(__name__).debug("Returned function value: %s", FunctionVal)
-            ResponseEncrypt = sec_server.encrypt_message(
-                DecryptResponse.ClientKey, FunctionVal
-            )
+        return respond_remote_call(DecryptResponse, accepts_binary())
 
-            check_request_ip(request.remote_addr)
+    with metrics.timed("msp_stage_seconds", stage="json_parse"):
+        PostJson = request.get_json(silent=True)
 
-            return jsonify(value=ResponseEncrypt), 200
+    logging.getLogger(__name__).debug("Incoming request from: %s", request.remote_addr)
+    if PostJson is None or not isinstance(PostJson, dict):
+        logging.getLogger(__name__).info("Malformed JSON from: %s", request.remote_addr)
+        metrics.inc("msp_unauthorized_total", reason="malformed")
+        return "", 401
 
-        else:
-            logging.getLogger(__name__).warning(
-                "Key Error on decrypted message! %s sent unregistered SECRET! Client Private Key may be compromised!",
-                request.remote_addr,
-            )
-            return "", 401
+    if "msg" in PostJson and isinstance(PostJson["msg"], str):
+        EnvelopeSent = PostJson["msg"]
+        # optional fingerprint of the client key
+        KeyIDSent = PostJson.get("kid", "")
+        DecryptResponse: sec_server.DecryptedMessage = sec_server.decrypt_envelope(
+            EnvelopeSent, KeyIDSent
+        )
+
+        return respond_remote_call(DecryptResponse, accepts_binary())
 
     logging.getLogger(__name__).info("Malformed request from: %s", request.remote_addr)
+    metrics.inc("msp_unauthorized_total", reason="malformed")
     return "", 401
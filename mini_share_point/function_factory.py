@@ -1,9 +1,22 @@
+import asyncio
+import collections
+import collections.abc
+import concurrent.futures
 import configparser
+import dataclasses
+import functools
 import importlib
+import importlib.util
+import inspect
 import logging
-from typing import Callable
+import os
+import sys
+import threading
+import time
+import types
+from typing import AsyncIterator, Iterable, Iterator
 
-from . import util
+from . import metrics, util, watcher
 
 
 @staticmethod
@@ -11,14 +24,227 @@ def entry_call() -> str:
     """Main entry point of any loaded function"""
 
 
-__ModList: dict[str, Callable[..., entry_call]] = {}
+@dataclasses.dataclass
+class ModuleOptions:
+    """Per module options, set in the [module:<NAME>] section of the module config"""
 
+    CacheTTL: float = 0.0
+    # inline | thread | process
+    Executor: str = "inline"
+    Timeout: float = 0.0
+    MaxConcurrent: int = 0
+    # imported on the first call instead of at startup
+    Lazy: bool = False
+
+
+class ModuleTimeout(Exception):
+    """Module call did not finish in its configured time"""
+
+
+class ModuleValueError(Exception):
+    """Module returned neither a message nor chunks"""
+
+
+@dataclasses.dataclass
+class CachedResult:
+    Value: str | bytes
+    Expires: float
+
+
+@dataclasses.dataclass
+class PendingCall:
+    """Module call in progress, concurrent callers wait for its result"""
+
+    Done: threading.Event
+    Value: str | bytes = ""
+    Error: BaseException | None = None
+
+
+@dataclasses.dataclass
+class ModuleRegistry:
+    """All registered modules, replaced as a whole on reload"""
+
+    """Imported modules by registered name, lazy ones are added on their first call"""
+    Mods: dict[str, types.ModuleType]
+    """Python module of every registered name"""
+    Paths: dict[str, str]
+    Options: dict[str, ModuleOptions]
+    """Limits the number of running calls for modules with MaxConcurrent set"""
+    Semaphores: dict[str, threading.BoundedSemaphore]
+    """Source file of every module in the config, watched for reloads"""
+    Files: dict[str, str]
+    """(mtime, size) of the source file of every module when it was imported"""
+    Versions: dict[str, tuple[int, int]]
+
+
+__Modules = ModuleRegistry({}, {}, {}, {}, {}, {})
+"""Serializes lazy imports and reloads"""
+__ImportLock = threading.Lock()
+
+"""Pools for module calls, created on first use inside each worker"""
+__ThreadPool: concurrent.futures.ThreadPoolExecutor | None = None
+__ThreadPoolSize: int = 16
+__ProcessPool: concurrent.futures.ProcessPoolExecutor | None = None
+__ProcessPoolSize: int = 0
+"""Server processes sharing the cores, every one has its own process pool"""
+__ServerWorkers: int = max(1, int(os.getenv("MSP_WORKER_PROCESSES", "1")))
+"""Runs the calls of batch requests in parallel, separate to avoid deadlocks"""
+__BatchPool: concurrent.futures.ThreadPoolExecutor | None = None
+__BatchPoolSize: int = 8
+__PoolLock = threading.Lock()
+
+"""Cached module results (LRU), bounded by the summed length of all results"""
+__ResultCache: collections.OrderedDict[str, CachedResult] = collections.OrderedDict()
+__ResultCacheSize: int = 0
+__ResultCacheMaxSize: int = 16 * 1024 * 1024
+__PendingCalls: dict[str, PendingCall] = {}
+"""Async module calls in progress, concurrent callers await the same task"""
+__PendingTasks: dict[str, asyncio.Future] = {}
+__CacheLock = threading.Lock()
+
+
+def load_module_options(
+    ModConfig: configparser.ConfigParser, ModName: str, Lazy: bool = False
+):
+    """Parse the options of a module. Raises ValueError on bad values"""
+    Section = f"module:{ModName}"
+    Options = ModuleOptions(
+        CacheTTL=ModConfig.getfloat(Section, "CacheTTL", fallback=0.0),
+        Executor=ModConfig.get(Section, "Executor", fallback="inline").lower(),
+        Timeout=ModConfig.getfloat(Section, "Timeout", fallback=0.0),
+        MaxConcurrent=ModConfig.getint(Section, "MaxConcurrent", fallback=0),
+        Lazy=ModConfig.getboolean(Section, "Lazy", fallback=Lazy),
+    )
+
+    if Options.CacheTTL < 0:
+        raise ValueError("CacheTTL has to be positive")
+
+    if Options.Executor not in ["inline", "thread", "process"]:
+        raise ValueError(f"Unknown executor <{Options.Executor}>")
+
+    if Options.Timeout < 0 or Options.MaxConcurrent < 0:
+        raise ValueError("Timeout and MaxConcurrent have to be positive")
+
+    if Options.Executor == "inline" and Options.Timeout > 0:
+        logging.getLogger(__name__).warning(
+            "Timeout of module <%s> only applies to async entry calls", ModName
+        )
+
+    return Options
+
+
+def import_mod(PyModule: str) -> tuple[types.ModuleType | None, float]:
+    """Import a module and run its warm up. Returns the module and the time taken"""
+    Start = time.perf_counter()
+
+    try:
+        Mod = importlib.import_module(PyModule)
+
+        # optional hook, e.g. to load data or open connections before the first call
+        if hasattr(Mod, "warm_up"):
+            Mod.warm_up()
+
+    except ModuleNotFoundError:
+        logging.getLogger(__name__).warning(
+            "Module <%s> given in mods not found! Skipping initialization", PyModule
+        )
+        return None, time.perf_counter() - Start
+
+    except Exception:
+        logging.getLogger(__name__).exception(
+            "Module <%s> could not be initialized! Skipping initialization", PyModule
+        )
+        # imported again on the next try, e.g. if only the warm up failed
+        sys.modules.pop(PyModule, None)
+        return None, time.perf_counter() - Start
+
+    return Mod, time.perf_counter() - Start
+
+
+def log_import_report(Report: list[tuple[str, str, str, float]]):
+    """Log the import mode and time of every module"""
+    Lines = [
+        f"  {ModName:<24} {PyModule:<24} {Mode:<6} "
+        + (f"{Seconds * 1000:9.1f} ms" if Mode != "lazy" else f"{'-':>9}")
+        for ModName, PyModule, Mode, Seconds in Report
+    ]
+    Total = sum(Seconds for _, _, _, Seconds in Report)
+
+    logging.getLogger(__name__).info(
+        "Module imports took %.1f ms:\n%s", Total * 1000, "\n".join(Lines)
+    )
+
+
+def get_module_file(PyModule: str, Mod: types.ModuleType | None = None) -> str:
+    """Source file of a module, found without importing it. Empty if unknown"""
+    if Mod is not None:
+        return getattr(Mod, "__file__", None) or ""
+
+    try:
+        Spec = importlib.util.find_spec(PyModule)
+
+    except (ImportError, ValueError):
+        return ""
+
+    if Spec is None or not Spec.has_location or Spec.origin is None:
+        return ""
+
+    return Spec.origin
+
+
+def reimport_mod(PyModule: str) -> tuple[types.ModuleType | None, float]:
+    """Import a new version of a loaded module, the old one is untouched on errors"""
+    Start = time.perf_counter()
+
+    try:
+        Spec = importlib.util.find_spec(PyModule)
+
+        if Spec is None or Spec.origin is None:
+            raise ModuleNotFoundError(f"No module named {PyModule}")
+
+        # executed as a new module object, calls in progress keep the old one
+        Mod = importlib.util.module_from_spec(Spec)
+        # compiled from the source, cached bytecode may be stale within a second
+        with open(Spec.origin, "rb") as File:
+            Code = compile(File.read(), Spec.origin, "exec")
+
+        exec(Code, Mod.__dict__)
+
+        if hasattr(Mod, "warm_up"):
+            Mod.warm_up()
+
+    except Exception:
+        logging.getLogger(__name__).exception(
+            "Module <%s> could not be reloaded! Keeping the previous version", PyModule
+        )
+        return None, time.perf_counter() - Start
+
+    sys.modules[PyModule] = Mod
+
+    return Mod, time.perf_counter() - Start
+
+
+def get_file_version(Filepath: str) -> tuple[int, int]:
+    """(mtime, size) of a file, zero if it does not exist"""
+    return watcher.get_file_signatures([Filepath]).get(Filepath, (0, 0))
+
+
+def load_mods(ModuleConfigFile: str, Reload: bool = False) -> bool:
+    """Load all registered modules. A reload only imports modules of changed files"""
+    global __Modules
+    global __ResultCacheMaxSize, __ThreadPoolSize, __ProcessPoolSize, __BatchPoolSize
 
-def load_mods(ModuleConfigFile: str) -> bool:
-    """Load all registered python modules inside basic module config"""
     ModConfig = configparser.ConfigParser()
     if util.check_file_exist(ModuleConfigFile):
-        ModConfig.read(ModuleConfigFile)
+        try:
+            ModConfig.read(ModuleConfigFile)
+
+        except configparser.Error as e:
+            logging.getLogger(__name__).critical(
+                "Module configuration <%s> is invalid: %s", ModuleConfigFile, e
+            )
+            return False
+
         logging.getLogger(__name__).debug("Config file loaded")
 
     else:
@@ -33,30 +259,713 @@ def load_mods(ModuleConfigFile: str) -> bool:
         )
         return False
 
-    for ModName in ModConfig["Modules"]:
-        PyModule = ModConfig["Modules"][ModName]
+    try:
+        # default of all modules, Lazy of a module overrides it
+        LazyImport = ModConfig.getboolean("Import", "Lazy", fallback=False)
+        ResultCacheMaxSize = ModConfig.getint(
+            "Cache", "MaxSize", fallback=__ResultCacheMaxSize
+        )
+        ThreadPoolSize = ModConfig.getint(
+            "Executor", "Threads", fallback=__ThreadPoolSize
+        )
+        # 0 shares the cores between all server workers
+        ProcessPoolSize = ModConfig.getint(
+            "Executor", "Processes", fallback=__ProcessPoolSize
+        )
+        BatchPoolSize = ModConfig.getint(
+            "Executor", "BatchThreads", fallback=__BatchPoolSize
+        )
+
+    except ValueError:
+        logging.getLogger(__name__).critical(
+            "Module cache or executor size is not a number, or Lazy not a boolean!"
+        )
+        return False
+
+    Report: list[tuple[str, str, str, float]] = []
 
-        try:
-            Mod = importlib.import_module(PyModule)
-            __ModList[ModName] = Mod
-            logging.getLogger(__name__).debug("Loaded module: %s", ModName)
+    # lazy imports would go into the old registry while the new one is built
+    with __ImportLock:
+        Old = __Modules
+        New = ModuleRegistry({}, {}, {}, {}, {}, {})
+
+        for ModName in ModConfig["Modules"]:
+            PyModule = ModConfig["Modules"][ModName]
+
+            try:
+                Options = load_module_options(ModConfig, ModName, LazyImport)
 
-        except ModuleNotFoundError:
-            logging.getLogger(__name__).warning(
-                "Module <%s> given in mods not found! Skipping initialization", PyModule
+            except ValueError as e:
+                logging.getLogger(__name__).critical(
+                    "Invalid options for module <%s>: %s", ModName, e
+                )
+                return False
+
+            New.Options[ModName] = Options
+
+            if Options.MaxConcurrent > 0:
+                OldOptions = Old.Options.get(ModName, ModuleOptions())
+
+                # running calls keep their slots if the limit did not change
+                if OldOptions.MaxConcurrent == Options.MaxConcurrent:
+                    New.Semaphores[ModName] = Old.Semaphores[ModName]
+
+                else:
+                    New.Semaphores[ModName] = threading.BoundedSemaphore(
+                        Options.MaxConcurrent
+                    )
+
+            OldMod = (
+                Old.Mods.get(ModName) if Old.Paths.get(ModName) == PyModule else None
             )
+            OldFile = Old.Files.get(ModName, "")
+            OldVersion = Old.Versions.get(ModName, (0, 0))
+
+            if OldMod is not None:
+                Mod = OldMod
+                Version = OldVersion
+
+                if OldFile != "" and get_file_version(OldFile) != OldVersion:
+                    Version = get_file_version(OldFile)
+                    NewMod, Seconds = reimport_mod(PyModule)
+                    Mode = "reload" if NewMod is not None else "failed"
+                    Report.append((ModName, PyModule, Mode, Seconds))
+
+                    # the previous version keeps serving if the reload failed
+                    if NewMod is not None:
+                        Mod = NewMod
+
+                New.Mods[ModName] = Mod
+                New.Paths[ModName] = PyModule
+                New.Files[ModName] = OldFile
+                # failed reloads are not retried until the file changes again
+                New.Versions[ModName] = Version
+                continue
+
+            if Options.Lazy:
+                New.Paths[ModName] = PyModule
+                New.Files[ModName] = get_module_file(PyModule)
+                New.Versions[ModName] = get_file_version(New.Files[ModName])
+                Report.append((ModName, PyModule, "lazy", 0.0))
+                logging.getLogger(__name__).debug("Registered lazy module: %s", ModName)
+                continue
+
+            Mod, Seconds = import_mod(PyModule)
+            # failed modules are still watched, a fixed file is imported again
+            New.Files[ModName] = get_module_file(PyModule, Mod)
+            New.Versions[ModName] = get_file_version(New.Files[ModName])
+
+            if Mod is None:
+                Report.append((ModName, PyModule, "failed", Seconds))
+                continue
+
+            New.Mods[ModName] = Mod
+            New.Paths[ModName] = PyModule
+            Report.append((ModName, PyModule, "eager", Seconds))
+            logging.getLogger(__name__).debug("Loaded module: %s", ModName)
+
+        # all calls after this see the new modules at once
+        __Modules = New
+
+    __ResultCacheMaxSize = ResultCacheMaxSize
+    __ThreadPoolSize = ThreadPoolSize
+    __ProcessPoolSize = ProcessPoolSize
+    __BatchPoolSize = BatchPoolSize
+
+    if Reload:
+        # results and pool processes may still belong to old module versions
+        clear_results()
+        reset_process_pool()
+
+    if len(Report) > 0:
+        log_import_report(Report)
 
     logging.getLogger(__name__).debug("Function setup complete")
 
     return True
 
 
-def call_module(module: str) -> str:
-    """Call module by its registered name"""
-    if module in __ModList:
-        return __ModList[module].entry_call()
+def get_module_files(ModuleConfigFile: str) -> list[str]:
+    """Module config and source files of all registered modules, watched for reloads"""
+    return [ModuleConfigFile] + [File for File in __Modules.Files.values() if File]
+
+
+def get_module(Module: str) -> types.ModuleType | None:
+    """Return a registered module, lazy modules are imported on their first call"""
+    Registry = __Modules
+    Mod = Registry.Mods.get(Module)
+
+    if Mod is not None or Module not in Registry.Paths:
+        return Mod
+
+    with __ImportLock:
+        # a reload may have replaced the registry while waiting for the lock
+        Registry = __Modules
+
+        # imported by a concurrent call in the meantime
+        if Module in Registry.Mods:
+            return Registry.Mods[Module]
+
+        PyModule = Registry.Paths.get(Module)
+
+        if PyModule is None:
+            return None
+
+        Mod, Seconds = import_mod(PyModule)
+
+        # failed imports are not retried on every call
+        if Mod is None:
+            Registry.Paths.pop(Module)
+            return None
+
+        Registry.Mods[Module] = Mod
+        Registry.Versions[Module] = get_file_version(Registry.Files.get(Module, ""))
+
+    logging.getLogger(__name__).info(
+        "Imported lazy module <%s> in %.1f ms", Module, Seconds * 1000
+    )
+
+    return Mod
+
+
+def get_executor(Executor: str) -> concurrent.futures.Executor:
+    """Return the thread, batch or process pool, created on first use"""
+    global __ThreadPool, __ProcessPool, __BatchPool
+
+    with __PoolLock:
+        if Executor == "batch":
+            if __BatchPool is None:
+                __BatchPool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max(1, __BatchPoolSize), thread_name_prefix="batch"
+                )
+
+            return __BatchPool
+
+        if Executor == "thread":
+            if __ThreadPool is None:
+                __ThreadPool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max(1, __ThreadPoolSize), thread_name_prefix="module"
+                )
+
+            return __ThreadPool
+
+        if __ProcessPool is None:
+            __ProcessPool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=get_process_pool_size()
+            )
+
+        return __ProcessPool
+
+
+def get_process_pool_size() -> int:
+    """Configured size of the process pool, 0 shares the cores between all workers"""
+    if __ProcessPoolSize > 0:
+        return __ProcessPoolSize
+
+    # e.g. 2 * cores + 1 gunicorn workers -> a single process each
+    return max(1, (os.cpu_count() or 1) // __ServerWorkers)
+
+
+def reset_process_pool():
+    """Replace the process pool, its processes keep the modules they imported"""
+    global __ProcessPool
+
+    with __PoolLock:
+        Pool = __ProcessPool
+        __ProcessPool = None
+
+    # running calls finish in the old pool
+    if Pool is not None:
+        Pool.shutdown(wait=False)
+
+
+async def collect_chunks(Chunks: AsyncIterator[str | bytes]) -> list[str | bytes]:
+    """Collect all chunks of an async module result"""
+    return [Chunk async for Chunk in Chunks]
+
+
+def run_entry(Mod) -> str | Iterable[str | bytes]:
+    """Call the entry of a module, async entry calls get their own event loop"""
+    if inspect.iscoroutinefunction(Mod.entry_call):
+        return asyncio.run(Mod.entry_call())
+
+    # async chunks are collected, they can not be streamed without a loop
+    if inspect.isasyncgenfunction(Mod.entry_call):
+        return iter(asyncio.run(collect_chunks(Mod.entry_call())))
+
+    return Mod.entry_call()
+
+
+def run_entry_call(PyModule: str) -> str | Iterable[str | bytes]:
+    """Call a module by its python module name, used inside the process pool"""
+    Value = run_entry(importlib.import_module(PyModule))
+
+    # generators can not be sent back from the pool, chunks are collected
+    if isinstance(Value, collections.abc.Iterator):
+        return iter(list(Value))
+
+    return Value
+
+
+def run_module(Module: str) -> str | Iterable[str | bytes]:
+    """Run the entry call of a module, the runtime is added to the module metrics"""
+    Registry = __Modules
+    Options = Registry.Options.get(Module, ModuleOptions())
+    Mod = get_module(Module)
+
+    # generators run while the response is sent, their limits cover the stream
+    if (
+        Mod is not None
+        and Options.Executor != "process"
+        and inspect.isgeneratorfunction(Mod.entry_call)
+    ):
+        return stream_chunks(
+            Module, Mod.entry_call, Options, Registry.Semaphores.get(Module)
+        )
+
+    with metrics.timed("msp_module_seconds", module=Module):
+        return run_module_call(Module)
+
+
+def stream_chunks(
+    Module: str, EntryCall, Options: ModuleOptions, Semaphore
+) -> Iterator[str | bytes]:
+    """Stream a sync generator module, its limits apply to the whole stream"""
+    Timeout = Options.Timeout if Options.Timeout > 0 else None
+
+    if Semaphore is not None and not Semaphore.acquire(timeout=Timeout):
+        raise ModuleTimeout(f"Module <{Module}> has too many running calls")
+
+    Deadline = time.monotonic() + Timeout if Timeout is not None else None
+    Chunks = EntryCall()
+    Done = object()
+    # last chunk requested from the module thread
+    Pending: concurrent.futures.Future | None = None
+
+    def finish(_=None):
+        Chunks.close()
+
+        if Semaphore is not None:
+            Semaphore.release()
+
+    try:
+        with metrics.timed("msp_module_seconds", module=Module):
+            while True:
+                if Options.Executor == "inline":
+                    Chunk = next(Chunks, Done)
+
+                else:
+                    Left = Deadline - time.monotonic() if Deadline is not None else None
+                    Pending = get_executor("thread").submit(next, Chunks, Done)
+                    Chunk = Pending.result(timeout=Left)
+
+                if Chunk is Done:
+                    return
+
+                yield Chunk
+
+    except concurrent.futures.TimeoutError:
+        raise ModuleTimeout(f"Module <{Module}> timed out after {Timeout}s")
+
+    finally:
+        # slot is freed when the module thread really finished, not on a timeout
+        if Pending is not None:
+            Pending.add_done_callback(finish)
+
+        else:
+            finish()
+
+
+def run_module_call(Module: str) -> str:
+    """Run the entry call of a module with its configured executor"""
+    Registry = __Modules
+    Options = Registry.Options.get(Module, ModuleOptions())
+    Semaphore = Registry.Semaphores.get(Module)
+    Timeout = Options.Timeout if Options.Timeout > 0 else None
+    Mod = get_module(Module)
+
+    # removed by a reload after the call was accepted
+    if Mod is None:
+        logging.getLogger(__name__).warning("Requested module <%s> not found!", Module)
+        return ""
+
+    if Semaphore is not None and not Semaphore.acquire(timeout=Timeout):
+        raise ModuleTimeout(f"Module <{Module}> has too many running calls")
+
+    if Options.Executor == "inline":
+        try:
+            return run_entry(Mod)
+
+        finally:
+            if Semaphore is not None:
+                Semaphore.release()
+
+    try:
+        if Options.Executor == "thread":
+            Future = get_executor("thread").submit(run_entry, Mod)
+
+        else:
+            Future = get_executor("process").submit(run_entry_call, Mod.__name__)
+
+    except BaseException:
+        if Semaphore is not None:
+            Semaphore.release()
+        raise
+
+    # slot is freed when the call really finished, not when the request gave up
+    if Semaphore is not None:
+        Future.add_done_callback(lambda _: Semaphore.release())
+
+    try:
+        return Future.result(timeout=Timeout)
+
+    except concurrent.futures.TimeoutError:
+        Future.cancel()
+        raise ModuleTimeout(f"Module <{Module}> timed out after {Timeout}s")
+
+
+def clear_results():
+    """Drop all cached module results"""
+    global __ResultCacheSize
+
+    with __CacheLock:
+        __ResultCache.clear()
+        __ResultCacheSize = 0
+
+
+def store_result(Module: str, Value: str | bytes, TTL: float):
+    """Put a module result into the cache. Needs the cache lock"""
+    global __ResultCacheSize
+
+    # result does not fit the cache at all
+    if len(Value) > __ResultCacheMaxSize:
+        return
+
+    Old = __ResultCache.pop(Module, None)
+    if Old is not None:
+        __ResultCacheSize -= len(Old.Value)
+
+    __ResultCache[Module] = CachedResult(Value, time.monotonic() + TTL)
+    __ResultCacheSize += len(Value)
+
+    # evict least recently used results
+    while __ResultCacheSize > __ResultCacheMaxSize:
+        _, Evicted = __ResultCache.popitem(last=False)
+        __ResultCacheSize -= len(Evicted.Value)
+
+
+def call_cached(Module: str, TTL: float) -> str:
+    """Return a cached module result. Concurrent misses only call the module once"""
+    IsCaller = False
+
+    with __CacheLock:
+        Cached = __ResultCache.get(Module)
+
+        if Cached is not None and Cached.Expires > time.monotonic():
+            __ResultCache.move_to_end(Module)
+            metrics.inc("msp_cache_requests_total", cache="result", result="hit")
+            return Cached.Value
+
+        metrics.inc("msp_cache_requests_total", cache="result", result="miss")
+        Pending = __PendingCalls.get(Module)
+
+        if Pending is None:
+            Pending = PendingCall(threading.Event())
+            __PendingCalls[Module] = Pending
+            IsCaller = True
+
+    # another request is already calling the module
+    if not IsCaller:
+        Pending.Done.wait()
+
+        if Pending.Error is not None:
+            raise Pending.Error
+
+        # chunks can not be shared, every caller needs its own stream
+        if not isinstance(Pending.Value, (str, bytes)):
+            return run_module(Module)
+
+        return Pending.Value
+
+    try:
+        Pending.Value = run_module(Module)
+
+    except BaseException as e:
+        Pending.Error = e
+        raise
+
+    finally:
+        with __CacheLock:
+            # streamed results can only be consumed once
+            if Pending.Error is None and isinstance(Pending.Value, (str, bytes)):
+                store_result(Module, Pending.Value, TTL)
+
+            __PendingCalls.pop(Module, None)
+
+        Pending.Done.set()
+
+    return Pending.Value
+
+
+def check_module_value(Module: str, Value):
+    """Return a module result that can be sent. Raises ModuleValueError otherwise"""
+    # str and bytes are a single message, only iterators are streamed
+    if isinstance(
+        Value,
+        (str, bytes, collections.abc.Iterator, collections.abc.AsyncIterator),
+    ):
+        return Value
+
+    raise ModuleValueError(
+        f"Module <{Module}> returned an unsupported {type(Value).__name__}"
+    )
+
+
+def call_module(module: str) -> str | bytes | Iterator[str | bytes]:
+    """Call module by its registered name. Modules may also return chunks"""
+    if get_module(module) is not None:
+        Options = __Modules.Options.get(module, ModuleOptions())
+
+        if Options.CacheTTL > 0:
+            return check_module_value(module, call_cached(module, Options.CacheTTL))
+
+        return check_module_value(module, run_module(module))
 
     else:
         logging.getLogger(__name__).warning("Requested module <%s> not found!", module)
 
         return ""
+
+
+async def call_module_async(module: str):
+    """Call module by its registered name from an event loop, sync ones use a thread"""
+    Registry = __Modules
+    Mod = Registry.Mods.get(module)
+
+    # lazy imports would block the event loop
+    if Mod is None and module in Registry.Paths:
+        Mod = await asyncio.to_thread(get_module, module)
+
+    if Mod is None:
+        logging.getLogger(__name__).warning("Requested module <%s> not found!", module)
+
+        return ""
+
+    EntryCall = Mod.entry_call
+    Options = Registry.Options.get(module, ModuleOptions())
+    Semaphore = Registry.Semaphores.get(module)
+
+    # async generators are streamed by the caller
+    if inspect.isasyncgenfunction(EntryCall):
+        return stream_module(module, EntryCall, Options, Semaphore)
+
+    if not inspect.iscoroutinefunction(EntryCall):
+        return await asyncio.to_thread(call_module, module)
+
+    if Options.CacheTTL > 0:
+        return await call_cached_async(module, EntryCall, Options, Semaphore)
+
+    return await run_module_async(module, EntryCall, Options, Semaphore)
+
+
+async def run_module_async(
+    Module: str, EntryCall, Options: ModuleOptions, Semaphore
+) -> str | bytes | Iterator[str | bytes] | AsyncIterator[str | bytes]:
+    """Run an async entry call with the timeout and call limit of its module"""
+    Timeout = Options.Timeout if Options.Timeout > 0 else None
+
+    # waiting would block the event loop
+    if Semaphore is not None and not Semaphore.acquire(blocking=False):
+        raise ModuleTimeout(f"Module <{Module}> has too many running calls")
+
+    try:
+        with metrics.timed("msp_module_seconds", module=Module):
+            Value = await asyncio.wait_for(EntryCall(), Timeout)
+
+    except asyncio.TimeoutError:
+        raise ModuleTimeout(f"Module <{Module}> timed out after {Timeout}s")
+
+    finally:
+        if Semaphore is not None:
+            Semaphore.release()
+
+    return check_module_value(Module, Value)
+
+
+async def run_cached_async(
+    Module: str, EntryCall, Options: ModuleOptions, Semaphore
+) -> str | bytes | Iterator[str | bytes] | AsyncIterator[str | bytes]:
+    """Run an async entry call and cache its result"""
+    Value = await run_module_async(Module, EntryCall, Options, Semaphore)
+
+    # streamed results can only be consumed once
+    if isinstance(Value, (str, bytes)):
+        with __CacheLock:
+            store_result(Module, Value, Options.CacheTTL)
+
+    return Value
+
+
+def finish_pending_task(Module: str, Task: asyncio.Future):
+    """Remove a finished async call from the pending calls"""
+    if __PendingTasks.get(Module) is Task:
+        __PendingTasks.pop(Module)
+
+    # errors are raised in every caller, not logged if all of them are gone
+    if not Task.cancelled():
+        Task.exception()
+
+
+async def call_cached_async(
+    Module: str, EntryCall, Options: ModuleOptions, Semaphore
+) -> str | bytes | Iterator[str | bytes] | AsyncIterator[str | bytes]:
+    """Async version of call_cached. Concurrent misses only call the module once"""
+    with __CacheLock:
+        Cached = __ResultCache.get(Module)
+
+        if Cached is not None and Cached.Expires > time.monotonic():
+            __ResultCache.move_to_end(Module)
+            metrics.inc("msp_cache_requests_total", cache="result", result="hit")
+            return Cached.Value
+
+    metrics.inc("msp_cache_requests_total", cache="result", result="miss")
+    Pending = __PendingTasks.get(Module)
+    # tasks are bound to the event loop that started them
+    IsCaller = Pending is None or Pending.get_loop() is not asyncio.get_running_loop()
+
+    if IsCaller:
+        Pending = asyncio.ensure_future(
+            run_cached_async(Module, EntryCall, Options, Semaphore)
+        )
+        __PendingTasks[Module] = Pending
+        Pending.add_done_callback(functools.partial(finish_pending_task, Module))
+
+    # a cancelled caller, e.g. on a closed connection, does not cancel the call
+    Value = await asyncio.shield(Pending)
+
+    # chunks can not be shared, every caller needs its own stream
+    if not IsCaller and not isinstance(Value, (str, bytes)):
+        return await run_module_async(Module, EntryCall, Options, Semaphore)
+
+    return Value
+
+
+async def stream_module(
+    Module: str, EntryCall, Options: ModuleOptions, Semaphore
+) -> AsyncIterator[str | bytes]:
+    """Stream an async generator module, its limits apply to the whole stream"""
+    # waiting would block the event loop
+    if Semaphore is not None and not Semaphore.acquire(blocking=False):
+        raise ModuleTimeout(f"Module <{Module}> has too many running calls")
+
+    Loop = asyncio.get_running_loop()
+    Deadline = Loop.time() + Options.Timeout if Options.Timeout > 0 else None
+    Chunks = EntryCall()
+    Done = object()
+
+    try:
+        with metrics.timed("msp_module_seconds", module=Module):
+            while True:
+                # only the module is timed, not the caller sending the chunks
+                Left = Deadline - Loop.time() if Deadline is not None else None
+                Chunk = await asyncio.wait_for(anext(Chunks, Done), Left)
+
+                if Chunk is Done:
+                    return
+
+                yield Chunk
+
+    except asyncio.TimeoutError:
+        raise ModuleTimeout(f"Module <{Module}> timed out after {Options.Timeout}s")
+
+    finally:
+        await Chunks.aclose()
+
+        if Semaphore is not None:
+            Semaphore.release()
+
+
+def join_chunks(Chunks: Iterable[str | bytes]) -> str:
+    """Join a streamed module result into a single message"""
+    return "".join(
+        Chunk.decode("utf-8") if isinstance(Chunk, bytes) else Chunk for Chunk in Chunks
+    )
+
+
+def call_batch_entry(module: str) -> str:
+    """Call a single module of a batch, errors only affect its own result"""
+    try:
+        Value = call_module(module)
+
+        # streamed results are joined, a batch returns a single message
+        if isinstance(Value, bytes):
+            Value = Value.decode("utf-8")
+
+        elif not isinstance(Value, str):
+            Value = join_chunks(Value)
+
+        return Value
+
+    except ModuleTimeout as e:
+        logging.getLogger(__name__).warning("%s", e)
+        return "ERROR: module call timed out"
+
+    except ModuleValueError as e:
+        logging.getLogger(__name__).error("%s", e)
+        return "ERROR: module call failed"
+
+    except Exception:
+        logging.getLogger(__name__).exception("Module <%s> call failed!", module)
+        return "ERROR: module call failed"
+
+
+def call_modules(modules: list[str]) -> dict[str, str]:
+    """Call several modules in parallel, returns the results by module name"""
+    # every module is only called once per batch
+    Modules = list(dict.fromkeys(modules))
+
+    if len(Modules) == 1:
+        return {Modules[0]: call_batch_entry(Modules[0])}
+
+    Results = get_executor("batch").map(call_batch_entry, Modules)
+
+    return dict(zip(Modules, Results))
+
+
+async def call_batch_entry_async(module: str) -> str:
+    """Call a single module of a batch from an event loop"""
+    try:
+        Value = await call_module_async(module)
+
+        # streamed results are joined, a batch returns a single message
+        if isinstance(Value, collections.abc.AsyncIterator):
+            Value = join_chunks([Chunk async for Chunk in Value])
+
+        elif isinstance(Value, bytes):
+            Value = Value.decode("utf-8")
+
+        elif not isinstance(Value, str):
+            Value = await asyncio.to_thread(join_chunks, Value)
+
+        return Value
+
+    except ModuleTimeout as e:
+        logging.getLogger(__name__).warning("%s", e)
+        return "ERROR: module call timed out"
+
+    except ModuleValueError as e:
+        logging.getLogger(__name__).error("%s", e)
+        return "ERROR: module call failed"
+
+    except Exception:
+        logging.getLogger(__name__).exception("Module <%s> call failed!", module)
+        return "ERROR: module call failed"
+
+
+async def call_modules_async(modules: list[str]) -> dict[str, str]:
+    """Call several modules concurrently from an event loop"""
+    # every module is only called once per batch
+    Modules = list(dict.fromkeys(modules))
+    Results = await asyncio.gather(*[call_batch_entry_async(M) for M in Modules])
+
+    return dict(zip(Modules, Results))
@@ -0,0 +1,328 @@
+"""Client keystore in a single SQLite file, replaces client_<ID>.pub files and register"""
+
+import base64
+import binascii
+from glob import glob
+import logging
+import os
+import pathlib
+import sqlite3
+import sys
+import time
+
+"""Keyfile the old append_client kept overwriting once it existed"""
+OVERWRITTEN_KEYFILE = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    public_key BLOB NOT NULL UNIQUE,
+    secret TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    revoked INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def create_secret() -> str:
+    """Generate a random client secret as hex string"""
+    return os.urandom(64).hex()
+
+
+def connect(Keystore: str, ReadOnly: bool = False) -> sqlite3.Connection:
+    """Open the keystore, it is created if it does not exist and not read only"""
+    # no WAL: the server only needs read access to the file, not to the directory
+    if ReadOnly:
+        URI = pathlib.Path(Keystore).absolute().as_uri() + "?mode=ro"
+        return sqlite3.connect(URI, uri=True)
+
+    Connection = sqlite3.connect(Keystore)
+    Connection.executescript(SCHEMA)
+
+    return Connection
+
+
+def read_clients(Keystore: str) -> list[tuple[int, bytes, str]]:
+    """Return ID, public key and secret of all clients that are not revoked"""
+    Connection = connect(Keystore, ReadOnly=True)
+
+    try:
+        return Connection.execute(
+            "SELECT id, public_key, secret FROM clients WHERE revoked = 0 ORDER BY id"
+        ).fetchall()
+
+    finally:
+        Connection.close()
+
+
+def add_clients(Keystore: str, PublicKeys: list[bytes]) -> list[tuple[int, str]]:
+    """Add clients in a single transaction. Returns ID and secret of every client"""
+    for PKBytes in PublicKeys:
+        if len(PKBytes) != 32:
+            raise ValueError("Client public key has to be 32 bytes")
+
+    Connection = connect(Keystore)
+    Added: list[tuple[int, str]] = []
+
+    try:
+        # all clients are added or none, e.g. if a key is already registered
+        with Connection:
+            for PKBytes in PublicKeys:
+                Secret = create_secret()
+                Cursor = Connection.execute(
+                    "INSERT INTO clients (public_key, secret, created) VALUES (?, ?, ?)",
+                    (PKBytes, Secret, int(time.time())),
+                )
+                Added.append((Cursor.lastrowid, Secret))
+
+    finally:
+        Connection.close()
+
+    return Added
+
+
+def add_client(Keystore: str, PKBytes: bytes) -> tuple[int, str]:
+    """Add a client. Returns its ID and generated secret"""
+    return add_clients(Keystore, [PKBytes])[0]
+
+
+def revoke_client(Keystore: str, ClientID: int) -> bool:
+    """Revoke a client, its key stays registered. Returns False if not found"""
+    Connection = connect(Keystore)
+
+    try:
+        with Connection:
+            Cursor = Connection.execute(
+                "UPDATE clients SET revoked = 1 WHERE id = ? AND revoked = 0",
+                (ClientID,),
+            )
+
+    finally:
+        Connection.close()
+
+    return Cursor.rowcount == 1
+
+
+def purge_clients(Keystore: str) -> int:
+    """Delete all clients in a single transaction. Returns the number deleted"""
+    Connection = connect(Keystore)
+
+    try:
+        # the file stays, a running server reads an empty client set on reload
+        with Connection:
+            Cursor = Connection.execute("DELETE FROM clients")
+
+    finally:
+        Connection.close()
+
+    return Cursor.rowcount
+
+
+def format_lines(Lines: list[int]) -> str:
+    """Sorted line numbers as ranges, e.g. 3, 10-14"""
+    Ranges: list[list[int]] = []
+
+    for Line in Lines:
+        if len(Ranges) > 0 and Ranges[-1][1] == Line - 1:
+            Ranges[-1][1] = Line
+
+        else:
+            Ranges.append([Line, Line])
+
+    return ", ".join(
+        str(First) if First == Last else f"{First}-{Last}" for First, Last in Ranges
+    )
+
+
+def get_secret_lines(KeyIDs: list[int], SecretCount: int) -> dict[int, int]:
+    """Register line of the secret of every keyfile ID in the old layout"""
+    Lines = {ClientID: ClientID for ClientID in KeyIDs if 0 < ClientID <= SecretCount}
+
+    # append_client sorted keyfile names as strings: after client_10.pub every new
+    # client overwrote it while its secret was appended to the register
+    if (
+        max(KeyIDs, default=0) == OVERWRITTEN_KEYFILE
+        and SecretCount > OVERWRITTEN_KEYFILE
+    ):
+        Lines[OVERWRITTEN_KEYFILE] = SecretCount
+        logging.getLogger(__name__).error(
+            "Client register has %d secrets but the last keyfile is client_10.pub! "
+            "It was overwritten by append_client, bound to register line %d",
+            SecretCount,
+            SecretCount,
+        )
+
+    Unbound = sorted(set(range(1, SecretCount + 1)) - set(Lines.values()))
+
+    if len(Unbound) > 0:
+        logging.getLogger(__name__).error(
+            "No client keyfile for register lines %s! These clients can not "
+            "authenticate",
+            format_lines(Unbound),
+        )
+
+    return Lines
+
+
+def read_client_files(
+    ClientRegister: str, ClientKeyPath: str
+) -> list[tuple[int, bytes, str, int]]:
+    """Read ID, public key, secret and creation time of all clients in the old layout"""
+    Secrets: list[str] = []
+
+    if os.path.isfile(ClientRegister):
+        with open(ClientRegister, "r") as File:
+            Secrets = [Line.rstrip("\r\n") for Line in File]
+
+    Keyfiles: list[tuple[int, bytes, str]] = []
+
+    for Keyfile in glob(f"{ClientKeyPath}/client_*.pub"):
+        try:
+            ClientID = int(
+                os.path.splitext(os.path.basename(Keyfile))[0].split("_")[-1]
+            )
+
+            with open(Keyfile, "r") as File:
+                PKBytes = base64.b64decode(File.readline())
+
+        except (ValueError, binascii.Error, OSError):
+            logging.getLogger(__name__).warning("Skipping keyfile: %s", Keyfile)
+            continue
+
+        Keyfiles.append((ClientID, PKBytes, Keyfile))
+
+    Lines = get_secret_lines([ClientID for ClientID, _, _ in Keyfiles], len(Secrets))
+    Clients: list[tuple[int, bytes, str, int]] = []
+
+    for ClientID, PKBytes, Keyfile in Keyfiles:
+        if ClientID not in Lines or len(PKBytes) != 32:
+            logging.getLogger(__name__).warning("Skipping keyfile: %s", Keyfile)
+            continue
+
+        Created = int(os.stat(Keyfile).st_mtime)
+        Clients.append((ClientID, PKBytes, Secrets[Lines[ClientID] - 1], Created))
+
+    return sorted(Clients)
+
+
+def migrate_client_files(Keystore: str, ClientRegister: str, ClientKeyPath: str) -> int:
+    """Create the keystore from the old layout, client IDs are kept"""
+    Clients: list[tuple[int, bytes, str, int]] = []
+    FirstIDs: dict[bytes, int] = {}
+
+    # append_client did not reject keys that were already registered
+    for Client in read_client_files(ClientRegister, ClientKeyPath):
+        FirstID = FirstIDs.setdefault(Client[1], Client[0])
+
+        if FirstID != Client[0]:
+            logging.getLogger(__name__).error(
+                "Client %d has the same public key as client %d! Only client %d is "
+                "migrated",
+                Client[0],
+                FirstID,
+                FirstID,
+            )
+            continue
+
+        Clients.append(Client)
+
+    # keystore only shows up complete, concurrent migrations do not interfere
+    TmpKeystore = f"{Keystore}.{os.getpid()}.tmp"
+    Connection = connect(TmpKeystore)
+
+    try:
+        with Connection:
+            Connection.executemany(
+                "INSERT INTO clients (id, public_key, secret, created) VALUES (?, ?, ?, ?)",
+                Clients,
+            )
+
+        Connection.close()
+        # fails if another process created the keystore in the meantime
+        os.link(TmpKeystore, Keystore)
+
+    finally:
+        Connection.close()
+        os.remove(TmpKeystore)
+
+    return len(Clients)
+
+
+def open_keystore(Keystore: str, ClientRegister: str, ClientKeyPath: str) -> bool:
+    """Make sure the keystore exists, clients of the old layout are migrated once"""
+    if os.path.isfile(Keystore):
+        return True
+
+    try:
+        Migrated = migrate_client_files(Keystore, ClientRegister, ClientKeyPath)
+
+    except FileExistsError:
+        return True
+
+    except (OSError, sqlite3.Error) as e:
+        logging.getLogger(__name__).critical(
+            "Could not create client keystore <%s>: %s", Keystore, e
+        )
+        return False
+
+    logging.getLogger(__name__).info(
+        "Created client keystore <%s>, migrated %d clients", Keystore, Migrated
+    )
+
+    return True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="[%(asctime)s] %(levelname)s: %(message)s", level=logging.INFO
+    )
+
+    # config is read the same way as by append_client
+    import append_client
+
+    append_client.load_config()
+    ClientRegFile = append_client.read_config("Clients", "Register", "sec/clients.dev")
+    ClientKeyPath = append_client.read_config("Clients", "Keypath", "sec")
+    ClientKeystore = append_client.read_config("Clients", "Keystore", "")
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ["migrate", "revoke", "purge", "list"]:
+        print("Usage: keystore [migrate|revoke <CLIENT_ID>|purge|list]\n")
+        print("\tmigrate:")
+        print("\t\t- create the keystore from client keyfiles and register, once")
+        print("\trevoke:")
+        print("\t\t- revoke a client by its ID")
+        print("\tpurge:")
+        print("\t\t- delete all clients")
+        print("\tlist:")
+        print("\t\t- list all clients that are not revoked")
+        exit(1)
+
+    if ClientKeystore == "" and sys.argv[1] in ["migrate", "purge"]:
+        logging.info("No client keystore configured, nothing to %s", sys.argv[1])
+        exit(0)
+
+    if ClientKeystore == "":
+        logging.critical("No client keystore configured in [Clients] Keystore!")
+        exit(1)
+
+    if sys.argv[1] == "migrate":
+        if not open_keystore(ClientKeystore, ClientRegFile, ClientKeyPath):
+            exit(1)
+
+    elif sys.argv[1] == "revoke":
+        if len(sys.argv) != 3 or not sys.argv[2].isdigit():
+            print("Usage: keystore revoke <CLIENT_ID>")
+            exit(1)
+
+        if not revoke_client(ClientKeystore, int(sys.argv[2])):
+            logging.critical("No active client with ID %s!", sys.argv[2])
+            exit(1)
+
+        logging.info("Revoked client %s", sys.argv[2])
+
+    elif sys.argv[1] == "purge":
+        logging.info("Deleted %d clients", purge_clients(ClientKeystore))
+
+    else:
+        for ClientID, PKBytes, _ in read_clients(ClientKeystore):
+            print(ClientID, base64.b64encode(PKBytes).decode("utf-8"))
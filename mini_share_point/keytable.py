@@ -0,0 +1,176 @@
+"""Client keys packed into one buffer, memory mapped from a snapshot shared by workers"""
+
+from array import array
+import bisect
+import hashlib
+import itertools
+import mmap
+import os
+import struct
+from typing import Iterator
+
+from . import util
+
+"""Magic, version, number of clients and signature of the source files"""
+HEADER = struct.Struct("=4sIQ16s")
+MAGIC = b"MSPK"
+VERSION = 1
+KEY_SIZE = 32
+
+
+class KeyTable:
+    """Packed client table, keys and secrets are only copied out when used"""
+
+    def __init__(self, Buffer: bytes | mmap.mmap):
+        View = memoryview(Buffer)
+
+        if len(View) < HEADER.size:
+            raise ValueError("Client key table is truncated")
+
+        Magic, Version, Count, Signature = HEADER.unpack_from(View)
+
+        if Magic != MAGIC or Version != VERSION:
+            raise ValueError("Not a client key table")
+
+        # layout: keys, IDs, fingerprints, secret offsets, positions, secrets
+        Sizes = [KEY_SIZE * Count, 8 * Count, 8 * Count, 8 * (Count + 1), 4 * Count]
+        Offsets = list(itertools.accumulate(Sizes, initial=HEADER.size))
+
+        if len(View) < Offsets[-1]:
+            raise ValueError("Client key table is truncated")
+
+        """Mapped file or bytes, views below are only valid as long as it is kept"""
+        self.Buffer = Buffer
+        self.Count: int = Count
+        self.Signature: bytes = Signature
+        """Public keys of all clients, KEY_SIZE bytes each"""
+        self.Keys = View[Offsets[0] : Offsets[1]]
+        self.IDs = View[Offsets[1] : Offsets[2]].cast("Q")
+        """Sorted key fingerprints, the key of each is found through Positions"""
+        self.Fingerprints = View[Offsets[2] : Offsets[3]].cast("Q")
+        self.SecretOffsets = View[Offsets[3] : Offsets[4]].cast("Q")
+        self.Positions = View[Offsets[4] : Offsets[5]].cast("I")
+        self.Secrets = View[Offsets[5] :]
+
+        if self.Count > 0 and len(self.Secrets) < self.SecretOffsets[-1]:
+            raise ValueError("Client key table is truncated")
+
+    def __len__(self) -> int:
+        return self.Count
+
+    def get_key(self, Index: int) -> bytes:
+        return bytes(self.Keys[Index * KEY_SIZE : (Index + 1) * KEY_SIZE])
+
+    def get_id(self, Index: int) -> int:
+        return self.IDs[Index]
+
+    def get_secret(self, Index: int) -> str:
+        Start = self.SecretOffsets[Index]
+        End = self.SecretOffsets[Index + 1]
+
+        return str(self.Secrets[Start:End], "utf-8")
+
+    def iter_keys(self) -> Iterator[bytes]:
+        """All client keys in order of their ID"""
+        for Index in range(self.Count):
+            yield self.get_key(Index)
+
+    def find_fingerprint(self, Fingerprint: int) -> Iterator[int]:
+        """Indices of all keys with the fingerprint"""
+        Pos = bisect.bisect_left(self.Fingerprints, Fingerprint)
+
+        while Pos < self.Count and self.Fingerprints[Pos] == Fingerprint:
+            yield self.Positions[Pos]
+            Pos += 1
+
+    def find_key_id(self, KeyID: str) -> int:
+        """Index of the key with the fingerprint sent by a client, -1 if not found"""
+        try:
+            Fingerprint = int(KeyID, 16)
+
+        except (TypeError, ValueError):
+            return -1
+
+        # only the exact format of util.key_fingerprint
+        if KeyID != f"{Fingerprint:016x}":
+            return -1
+
+        return next(self.find_fingerprint(Fingerprint), -1)
+
+    def find_key(self, PKBytes: bytes) -> int:
+        """Index of a client key, -1 if not found"""
+        Fingerprint = int(util.key_fingerprint(PKBytes), 16)
+
+        for Index in self.find_fingerprint(Fingerprint):
+            if self.get_key(Index) == PKBytes:
+                return Index
+
+        return -1
+
+
+def pack_clients(
+    Clients: list[tuple[int, bytes, str]], Signature: bytes = bytes(16)
+) -> bytes:
+    """Pack ID, public key and secret of all clients into the table format"""
+    Prints = sorted(
+        (int(util.key_fingerprint(PKBytes), 16), Index)
+        for Index, (_, PKBytes, _) in enumerate(Clients)
+    )
+    SecretBytes = [Secret.encode("utf-8") for _, _, Secret in Clients]
+    SecretOffsets = itertools.accumulate(
+        (len(Secret) for Secret in SecretBytes), initial=0
+    )
+
+    return b"".join(
+        [
+            HEADER.pack(MAGIC, VERSION, len(Clients), Signature),
+            b"".join(PKBytes for _, PKBytes, _ in Clients),
+            array("Q", (ClientID for ClientID, _, _ in Clients)).tobytes(),
+            array("Q", (Fingerprint for Fingerprint, _ in Prints)).tobytes(),
+            array("Q", SecretOffsets).tobytes(),
+            array("I", (Index for _, Index in Prints)).tobytes(),
+            b"".join(SecretBytes),
+        ]
+    )
+
+
+def get_signature(Files: list[str]) -> bytes:
+    """Signature of the source files of a snapshot, changes with any of them"""
+    Hash = hashlib.blake2b(digest_size=16)
+
+    for Filepath in sorted(Files):
+        try:
+            Stat = os.stat(Filepath)
+            Hash.update(f"{Filepath}:{Stat.st_mtime_ns}:{Stat.st_size}\n".encode())
+
+        except OSError:
+            Hash.update(f"{Filepath}:-\n".encode())
+
+    return Hash.digest()
+
+
+def write_snapshot(Snapshot: str, Packed: bytes):
+    """Replace the snapshot file, mapped old versions stay valid"""
+    TmpSnapshot = f"{Snapshot}.{os.getpid()}.tmp"
+
+    with open(TmpSnapshot, "wb") as File:
+        File.write(Packed)
+
+    os.replace(TmpSnapshot, Snapshot)
+
+
+def open_snapshot(Snapshot: str, Signature: bytes) -> KeyTable | None:
+    """Map a snapshot, None if it is missing, broken or of other source files"""
+    try:
+        with open(Snapshot, "rb") as File:
+            Buffer = mmap.mmap(File.fileno(), 0, access=mmap.ACCESS_READ)
+
+        Table = KeyTable(Buffer)
+
+    except (OSError, ValueError):
+        return None
+
+    if Table.Signature != Signature:
+        return None
+
+    return Table
@@ -0,0 +1,150 @@
+"""Logging through a queue, a single writer process does all file and console output"""
+
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.process
+import multiprocessing.queues
+import os
+import queue
+import signal
+import threading
+import time
+
+"""Private parts of multiprocessing to reset the queue in forked workers"""
+FORK_RESET = hasattr(multiprocessing.queues.Queue, "_after_fork") and isinstance(
+    getattr(multiprocessing.process, "_children", None), set
+)
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through a number of records per message and interval, the rest is counted"""
+
+    def __init__(self, MaxRecords: int, Interval: float):
+        super().__init__()
+        self.MaxRecords = MaxRecords
+        self.Interval = Interval
+        # (window start, records in window, suppressed records) by message
+        self.Windows: dict[tuple[str, str], list] = {}
+        self.Lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.MaxRecords == 0 or record.levelno >= logging.ERROR:
+            return True
+
+        # same message template from the same place, independent of its arguments
+        Key = (record.name, str(record.msg))
+        Now = time.monotonic()
+
+        with self.Lock:
+            Window = self.Windows.get(Key)
+
+            if Window is None or Now - Window[0] > self.Interval:
+                # only bounded by the number of log calls in the code
+                self.Windows[Key] = [Now, 1, 0]
+
+                if Window is not None and Window[2] > 0:
+                    record.msg = (
+                        f"{record.msg} (suppressed {Window[2]} similar messages)"
+                    )
+
+                return True
+
+            if Window[1] < self.MaxRecords:
+                Window[1] += 1
+                return True
+
+            Window[2] += 1
+            return False
+
+
+class DropQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller, records are dropped if the writer falls behind"""
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+
+        except queue.Full:
+            pass
+
+
+def write_logs(LogQueue, LogFile: str, MaxLogs: int, LogFormat: str):
+    """Main of the writer process, rotates the logfile for all workers"""
+    # shutdown is done by the server process, e.g. Ctrl+C reaches the whole group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Parent = os.getppid()
+
+    LogFileHandler = logging.handlers.RotatingFileHandler(
+        LogFile,
+        maxBytes=(1024 * 1024 * 10),
+        backupCount=MaxLogs,
+        encoding="utf-8",
+    )
+    Handlers = [LogFileHandler, logging.StreamHandler()]
+
+    for Handler in Handlers:
+        Handler.setFormatter(logging.Formatter(LogFormat))
+
+    while True:
+        try:
+            Record = LogQueue.get(timeout=1.0)
+
+        except queue.Empty:
+            # server process is gone without a shutdown
+            if os.getppid() != Parent:
+                break
+
+            continue
+
+        if Record is None:
+            break
+
+        for Handler in Handlers:
+            if Record.levelno >= Handler.level:
+                Handler.handle(Record)
+
+    for Handler in Handlers:
+        Handler.close()
+
+
+def start_log_writer(
+    LogFile: str, MaxLogs: int, LogFormat: str, QueueSize: int = 10000
+) -> multiprocessing.Queue:
+    """Start the writer process. Returns the queue all processes log into"""
+    LogQueue = multiprocessing.Queue(QueueSize)
+    Writer = multiprocessing.Process(
+        target=write_logs,
+        args=(LogQueue, LogFile, MaxLogs, LogFormat),
+        name="msp-log-writer",
+        daemon=True,
+    )
+    Writer.start()
+    Owner = os.getpid()
+
+    def reset_after_fork():
+        # gunicorn forks its workers without multiprocessing -> the feeder thread of
+        # the queue is gone and the writer would be stopped by every exiting worker
+        LogQueue._after_fork()
+        multiprocessing.process._children.discard(Writer)
+
+    if FORK_RESET:
+        os.register_at_fork(after_in_child=reset_after_fork)
+
+    else:
+        logging.getLogger(__name__).warning(
+            "Log queue can not be reset after a fork, records of workers may be lost"
+        )
+
+    def stop_log_writer():
+        # forked workers inherit this, only the starting process stops the writer
+        if os.getpid() != Owner:
+            return
+
+        LogQueue.put(None)
+        Writer.join(timeout=5.0)
+
+    atexit.register(stop_log_writer)
+
+    return LogQueue
@@ -0,0 +1,379 @@
+"""Request pipeline metrics in the Prometheus text format, merged across workers"""
+
+import bisect
+import contextlib
+import dataclasses
+import glob
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterator
+from flask import Blueprint, Response, request
+
+"""Upper bounds of the latency buckets in seconds"""
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+"""Upper bounds of the buckets for counted values, e.g. tried keys"""
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+"""Type and help text of every metric"""
+METRICS: dict[str, tuple[str, str]] = {
+    "msp_stage_seconds": ("histogram", "Time spent in each stage of a request"),
+    "msp_module_seconds": ("histogram", "Time spent in the entry call of a module"),
+    "msp_keys_tried": ("histogram", "Client keys tried to decrypt a request"),
+    "msp_unauthorized_total": ("counter", "Rejected requests by reason"),
+    "msp_throttled_total": ("counter", "Requests rejected by the rate limit"),
+    "msp_cache_requests_total": ("counter", "Cache lookups by cache and result"),
+    "msp_ip_table_size": ("gauge", "Remote addresses in the IP table"),
+    "msp_rate_table_size": ("gauge", "Remote addresses with a rate limit bucket"),
+    "msp_clients": ("gauge", "Registered client keys"),
+}
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = tuple[tuple[str, str], ...]
+
+
+@dataclasses.dataclass
+class Histogram:
+    Bounds: tuple[float, ...]
+    # one count per bucket, the last one counts values above all bounds
+    Counts: list[int]
+    Sum: float = 0.0
+
+
+Metricpoint = Blueprint("metrics", __name__)
+
+__Counters: dict[tuple[str, Labels], float] = {}
+__Histograms: dict[tuple[str, Labels], Histogram] = {}
+"""Gauges are read when the metrics are written"""
+__Gauges: dict[str, Callable[[], float]] = {}
+__MetricsLock = threading.Lock()
+__Enabled: bool = True
+"""Directory shared by all worker processes, every process writes its own file"""
+__MetricsDir: str = ""
+"""Networks of the remote addresses allowed to read the metrics"""
+__Scrapers: list[ipaddress.IPv4Network | ipaddress.IPv6Network] = []
+"""Last rendered metrics and their time, reused for RenderInterval seconds"""
+__Rendered: tuple[float, str] = (0.0, "")
+__RenderInterval: float = 5.0
+__RenderLock = threading.Lock()
+
+
+def get_label_key(Name: str, MetricLabels: dict[str, str]) -> tuple[str, Labels]:
+    return Name, tuple(sorted((Key, str(Val)) for Key, Val in MetricLabels.items()))
+
+
+def inc(Name: str, Amount: float = 1, **MetricLabels: str):
+    """Increase a counter"""
+    if not __Enabled:
+        return
+
+    Key = get_label_key(Name, MetricLabels)
+
+    with __MetricsLock:
+        __Counters[Key] = __Counters.get(Key, 0) + Amount
+
+
+def observe(
+    Name: str,
+    Value: float,
+    Bounds: tuple[float, ...] = LATENCY_BUCKETS,
+    **MetricLabels: str,
+):
+    """Add a value to a histogram"""
+    if not __Enabled:
+        return
+
+    Key = get_label_key(Name, MetricLabels)
+
+    with __MetricsLock:
+        Hist = __Histograms.get(Key)
+
+        if Hist is None:
+            Hist = Histogram(Bounds, [0] * (len(Bounds) + 1))
+            __Histograms[Key] = Hist
+
+        Hist.Counts[bisect.bisect_left(Hist.Bounds, Value)] += 1
+        Hist.Sum += Value
+
+
+@contextlib.contextmanager
+def timed(Name: str, **MetricLabels: str) -> Iterator[None]:
+    """Add the runtime of the block to a latency histogram"""
+    Start = time.perf_counter()
+
+    try:
+        yield
+
+    finally:
+        observe(Name, time.perf_counter() - Start, **MetricLabels)
+
+
+def register_gauge(Name: str, Read: Callable[[], float]):
+    """Register a function returning the current value of a gauge"""
+    __Gauges[Name] = Read
+
+
+def get_process_file() -> str:
+    """Metrics file of this process, prefixed with the pid of the gunicorn master"""
+    return f"{__MetricsDir}/{os.getppid()}_{os.getpid()}.json"
+
+
+def check_pid(PID: int) -> bool:
+    """Check if a process is still running"""
+    try:
+        os.kill(PID, 0)
+
+    except ProcessLookupError:
+        return False
+
+    except PermissionError:
+        return True
+
+    return True
+
+
+def setup_metrics(
+    Enabled: bool,
+    MetricsDir: str,
+    Allow: tuple[str, ...] = ("127.0.0.1", "::1"),
+    RenderInterval: float = 5.0,
+):
+    """Enable metrics and set up the shared directory, files of old servers are removed"""
+    global __Enabled, __MetricsDir, __Scrapers, __Rendered, __RenderInterval
+
+    __Enabled = Enabled
+    __MetricsDir = MetricsDir if Enabled else ""
+    __Scrapers = [ipaddress.ip_network(Network, strict=False) for Network in Allow]
+    __Rendered = (0.0, "")
+    __RenderInterval = RenderInterval
+
+    if __MetricsDir == "":
+        return
+
+    os.makedirs(__MetricsDir, exist_ok=True)
+
+    for Filepath in glob.glob(f"{__MetricsDir}/*_*.json"):
+        try:
+            Master = int(os.path.basename(Filepath).split("_")[0])
+
+            if not check_pid(Master):
+                os.remove(Filepath)
+
+        except (ValueError, OSError):
+            continue
+
+
+def snapshot() -> dict:
+    """Current metrics of this process, serializable as JSON"""
+    with __MetricsLock:
+        Counters = [[Name, Labels, Val] for (Name, Labels), Val in __Counters.items()]
+        Histograms = [
+            [Name, Labels, Hist.Bounds, list(Hist.Counts), Hist.Sum]
+            for (Name, Labels), Hist in __Histograms.items()
+        ]
+
+    Gauges = []
+
+    for Name, Read in list(__Gauges.items()):
+        try:
+            Gauges.append([Name, [], float(Read())])
+
+        except Exception:
+            logging.getLogger(__name__).exception("Reading gauge <%s> failed!", Name)
+
+    return {"counters": Counters, "histograms": Histograms, "gauges": Gauges}
+
+
+def flush():
+    """Write the metrics of this process to the shared directory"""
+    if __MetricsDir == "":
+        return
+
+    # processes without requests, e.g. the gunicorn master, do not show up
+    if len(__Counters) == 0 and len(__Histograms) == 0:
+        return
+
+    Filepath = get_process_file()
+
+    with open(Filepath + ".tmp", "w") as File:
+        json.dump(snapshot(), File)
+
+    os.replace(Filepath + ".tmp", Filepath)
+
+
+def start_flusher(Interval: float) -> threading.Thread:
+    """Write the metrics of this process periodically"""
+
+    def write():
+        while True:
+            time.sleep(Interval)
+
+            try:
+                flush()
+
+            except Exception:
+                logging.getLogger(__name__).exception("Writing metrics failed!")
+
+    Flusher = threading.Thread(target=write, name="metrics-flusher", daemon=True)
+    Flusher.start()
+    logging.getLogger(__name__).debug("Started metrics flusher")
+
+    return Flusher
+
+
+def read_snapshots() -> list[tuple[int, dict]]:
+    """Snapshots of all workers of this server by their pid, the own one is current"""
+    Snapshots = [(os.getpid(), snapshot())]
+
+    if __MetricsDir == "":
+        return Snapshots
+
+    for Filepath in glob.glob(f"{__MetricsDir}/{os.getppid()}_*.json"):
+        try:
+            PID = int(os.path.splitext(os.path.basename(Filepath))[0].split("_")[1])
+
+            if PID == os.getpid():
+                continue
+
+            with open(Filepath, "r") as File:
+                Snapshots.append((PID, json.load(File)))
+
+        except (ValueError, OSError):
+            continue
+
+    return Snapshots
+
+
+def format_labels(MetricLabels: list) -> str:
+    if len(MetricLabels) == 0:
+        return ""
+
+    Escaped = [
+        (Key, str(Val).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for Key, Val in MetricLabels
+    ]
+
+    return "{" + ",".join(f'{Key}="{Val}"' for Key, Val in Escaped) + "}"
+
+
+def render() -> str:
+    """All metrics of all workers in the Prometheus text format"""
+    Counters: dict[tuple, float] = {}
+    Histograms: dict[tuple, Histogram] = {}
+    Gauges: dict[tuple, float] = {}
+
+    for PID, Snapshot in read_snapshots():
+        # counters and histograms of stopped workers still count
+        for Name, MetricLabels, Val in Snapshot["counters"]:
+            Key = (Name, tuple(tuple(Label) for Label in MetricLabels))
+            Counters[Key] = Counters.get(Key, 0) + Val
+
+        for Name, MetricLabels, Bounds, Counts, Sum in Snapshot["histograms"]:
+            Key = (Name, tuple(tuple(Label) for Label in MetricLabels))
+            Hist = Histograms.get(Key)
+
+            if Hist is None:
+                Hist = Histogram(tuple(Bounds), [0] * len(Counts))
+                Histograms[Key] = Hist
+
+            if list(Hist.Bounds) != list(Bounds):
+                continue
+
+            Hist.Counts = [Old + New for Old, New in zip(Hist.Counts, Counts)]
+            Hist.Sum += Sum
+
+        # gauges are per worker and only valid while it runs
+        if PID != os.getpid() and not check_pid(PID):
+            continue
+
+        for Name, MetricLabels, Val in Snapshot["gauges"]:
+            Gauges[(Name, (("pid", str(PID)),))] = Val
+
+    Lines: list[str] = []
+
+    for Name, (Type, Help) in METRICS.items():
+        Lines += [f"# HELP {Name} {Help}", f"# TYPE {Name} {Type}"]
+
+        for (CName, MetricLabels), Val in sorted(Counters.items()):
+            if CName == Name:
+                Lines.append(f"{Name}{format_labels(list(MetricLabels))} {Val}")
+
+        for (GName, MetricLabels), Val in sorted(Gauges.items()):
+            if GName == Name:
+                Lines.append(f"{Name}{format_labels(list(MetricLabels))} {Val}")
+
+        for (HName, MetricLabels), Hist in sorted(Histograms.items()):
+            if HName != Name:
+                continue
+
+            Total = 0
+
+            for Bound, Count in zip(list(Hist.Bounds) + ["+Inf"], Hist.Counts):
+                Total += Count
+                BucketLabels = list(MetricLabels) + [("le", str(Bound))]
+                Lines.append(f"{Name}_bucket{format_labels(BucketLabels)} {Total}")
+
+            Lines.append(f"{Name}_sum{format_labels(list(MetricLabels))} {Hist.Sum}")
+            Lines.append(f"{Name}_count{format_labels(list(MetricLabels))} {Total}")
+
+    return "\n".join(Lines) + "\n"
+
+
+def render_cached() -> str:
+    """Rendered metrics, files of other workers only change every flush interval"""
+    global __Rendered
+
+    # concurrent scrapes wait for a single render
+    with __RenderLock:
+        Rendered, Text = __Rendered
+
+        if Text != "" and time.monotonic() - Rendered < __RenderInterval:
+            return Text
+
+        Text = render()
+        __Rendered = (time.monotonic(), Text)
+
+        return Text
+
+
+def check_scraper(RemoteAddr: str) -> bool:
+    """Check if a remote address may read the metrics"""
+    try:
+        Address = ipaddress.ip_address(RemoteAddr)
+
+    except ValueError:
+        return False
+
+    # IPv4 clients of a dual stack socket
+    if Address.version == 6 and Address.ipv4_mapped is not None:
+        Address = Address.ipv4_mapped
+
+    return any(Address in Network for Network in __Scrapers)
+
+
+@Metricpoint.route("/metrics", methods=["GET"])
+def get_metrics():
+    # module names and client counts are not shown to other addresses
+    if not check_scraper(request.remote_addr):
+        return "", 404
+
+    return Response(render_cached(), 200, content_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,230 @@
+"""Register many clients at once, from a CSV/JSONL file of public keys or generated"""
+
+import argparse
+import base64
+import binascii
+import csv
+import datetime
+import json
+import logging
+from nacl.public import PrivateKey
+import os
+import sqlite3
+import sys
+from typing import TextIO
+
+import append_client
+import keystore
+
+
+def decode_key(KeyStr: str) -> bytes:
+    """Decode a base64 public key. Raises ValueError if it is not 32 bytes"""
+    try:
+        PKBytes = base64.b64decode(KeyStr.strip(), validate=True)
+
+    except binascii.Error:
+        raise ValueError("not a base64-string")
+
+    if len(PKBytes) != 32:
+        raise ValueError("not 32 bytes")
+
+    return PKBytes
+
+
+def read_csv(Lines: list[str]) -> list[dict]:
+    """Clients of a CSV file, with a `public_key` header or keys in the first column"""
+    Rows = [Row for Row in csv.reader(Lines) if len(Row) > 0]
+
+    if len(Rows) > 0 and "public_key" in Rows[0]:
+        # other columns are passed through to the bundle, e.g. a device name
+        return [dict(zip(Rows[0], Row)) for Row in Rows[1:]]
+
+    return [{"public_key": Row[0]} for Row in Rows]
+
+
+def read_jsonl(Lines: list[str]) -> list[dict]:
+    """Clients of a JSONL file, one object with a `public_key` per line"""
+    Entries = []
+
+    for Line in Lines:
+        if Line.strip() != "":
+            Entry = json.loads(Line)
+
+            if not isinstance(Entry, dict):
+                raise ValueError("JSONL lines have to be objects")
+
+            Entries.append(Entry)
+
+    return Entries
+
+
+def read_clients(Path: str, Format: str) -> list[dict]:
+    """Read clients from a file or stdin (-), the format is detected if not given"""
+    File = sys.stdin if Path == "-" else open(Path, "r", newline="")
+
+    try:
+        Content = File.read().splitlines(keepends=True)
+
+    finally:
+        if File is not sys.stdin:
+            File.close()
+
+    if Format == "":
+        First = next((Line for Line in Content if Line.strip() != ""), "")
+        Format = "jsonl" if First.lstrip().startswith("{") else "csv"
+
+    if Format == "jsonl":
+        return read_jsonl(Content)
+
+    return read_csv(Content)
+
+
+def generate_clients(Count: int) -> list[dict]:
+    """Generate new client keypairs, the private key is part of the bundle"""
+    Entries = []
+
+    for _ in range(Count):
+        ClientSK = PrivateKey.generate()
+        PKStr = base64.b64encode(bytes(ClientSK.public_key)).decode("utf-8")
+        SKStr = base64.b64encode(bytes(ClientSK)).decode("utf-8")
+        Entries.append({"public_key": PKStr, "private_key": SKStr})
+
+    return Entries
+
+
+def provision_clients(
+    Entries: list[dict],
+    ClientKeystore: str,
+    ClientRegFile: str,
+    ClientKeyPath: str,
+) -> list[dict]:
+    """Register all clients in one transaction. Returns the entries with ID and secret"""
+    PublicKeys: list[bytes] = []
+    Seen: set[bytes] = set()
+
+    # nothing is written if any key is invalid
+    for Line, Entry in enumerate(Entries, start=1):
+        try:
+            PKBytes = decode_key(str(Entry.get("public_key", "")))
+
+        except ValueError as e:
+            raise ValueError(f"Client {Line}: public key {e}")
+
+        if PKBytes in Seen:
+            raise ValueError(f"Client {Line}: public key is listed twice")
+
+        Seen.add(PKBytes)
+        PublicKeys.append(PKBytes)
+
+    if not keystore.open_keystore(ClientKeystore, ClientRegFile, ClientKeyPath):
+        raise ValueError("Client keystore not available")
+
+    Added = keystore.add_clients(ClientKeystore, PublicKeys)
+
+    return [
+        {**Entry, "id": ClientID, "secret": Secret}
+        for Entry, (ClientID, Secret) in zip(Entries, Added)
+    ]
+
+
+def open_bundle(Path: str) -> TextIO:
+    """Create the bundle output, a file is only readable by the owner"""
+    if Path == "-":
+        return sys.stdout
+
+    # never truncated, an existing bundle may be the only copy of earlier secrets
+    FD = os.open(Path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+
+    return open(FD, "w")
+
+
+def discard_bundle(File: TextIO, Path: str):
+    """Remove a bundle output that was created but not written"""
+    if Path == "-":
+        return
+
+    File.close()
+    os.unlink(Path)
+
+
+def write_bundle(File: TextIO, Clients: list[dict], ServerPublicKey: str):
+    """Write secrets and server public key as JSON"""
+    Bundle = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "server_public_key": ServerPublicKey,
+        "clients": Clients,
+    }
+
+    json.dump(Bundle, File, indent=2)
+    File.write("\n")
+    File.flush()
+
+
+if __name__ == "__main__":
+    # stdout is kept for the bundle
+    logging.basicConfig(
+        format="[%(asctime)s] %(levelname)s: %(message)s", level=logging.INFO
+    )
+
+    Parser = argparse.ArgumentParser(description=__doc__)
+    Source = Parser.add_mutually_exclusive_group(required=True)
+    Source.add_argument("--input", help="CSV or JSONL file of public keys, - for stdin")
+    Source.add_argument("--generate", type=int, help="number of keypairs to generate")
+    Parser.add_argument("--format", choices=["csv", "jsonl"], default="")
+    Parser.add_argument(
+        "--output", default="-", help="bundle file (JSON), - for stdout"
+    )
+    Args = Parser.parse_args()
+
+    if Args.generate is not None and Args.generate < 1:
+        Parser.error("--generate needs at least 1 client")
+
+    append_client.load_config()
+    ClientRegFile = append_client.read_config("Clients", "Register", "sec/clients.dev")
+    ClientKeyPath = append_client.read_config("Clients", "Keypath", "sec")
+    ClientKeystore = append_client.read_config("Clients", "Keystore", "")
+    ServerKeyPath = append_client.read_config("Server", "Keypath", "sec")
+
+    if ClientKeystore == "":
+        logging.critical(
+            "Bulk provisioning needs a client keystore ([Clients] Keystore)!"
+        )
+        exit(1)
+
+    try:
+        with open(f"{ServerKeyPath}/server.pub", "r") as File:
+            ServerPublicKey = File.readline().strip()
+
+        # opened before registering, secrets can not be lost on a bad output path
+        Bundle = open_bundle(Args.output)
+
+        try:
+            if Args.generate is not None:
+                Entries = generate_clients(Args.generate)
+
+            else:
+                Entries = read_clients(Args.input, Args.format)
+
+            Clients = provision_clients(
+                Entries, ClientKeystore, ClientRegFile, ClientKeyPath
+            )
+
+        except BaseException:
+            # nothing was registered, no empty bundle is left behind
+            discard_bundle(Bundle, Args.output)
+            raise
+
+    except (OSError, ValueError) as e:
+        logging.critical("%s!", e)
+        exit(1)
+
+    except sqlite3.IntegrityError:
+        logging.critical("A client public key is already registered, nothing added!")
+        exit(1)
+
+    except sqlite3.Error as e:
+        logging.critical("Client keystore <%s> not writable: %s", ClientKeystore, e)
+        exit(1)
+
+    write_bundle(Bundle, Clients, ServerPublicKey)
+    logging.info("Registered %d clients", len(Clients))
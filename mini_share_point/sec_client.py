@@ -1,24 +1,38 @@
 import binascii
 import base64
+import hmac
 import logging
 from nacl.public import PublicKey
 from glob import glob
+import os
+import sqlite3
+import threading
 
-from . import util
+from . import keystore, keytable, metrics, util
 
-"""Stored public keys from clients"""
-ClientKeys: list[PublicKey] = []
-__ClientStrings = []
+"""All loaded clients packed into one buffer, replaced as a whole on reload"""
+Clients = keytable.KeyTable(keytable.pack_clients([]))
+"""Client secrets by line of the register file, line N belongs to client_N.pub"""
+__ClientStrings: list[str] = []
+"""Decoded keyfiles with their (mtime, size), only changed files are read again"""
+__KeyfileCache: dict[str, tuple[tuple[int, int], bytes]] = {}
+__ReloadLock = threading.Lock()
+
+metrics.register_gauge("msp_clients", lambda: len(Clients))
 
 
 def load_client_secret(ClientRegister: str) -> bool:
     """Load all client secret keys from register file"""
+    global __ClientStrings
+
     if not util.check_file_exist(ClientRegister):
         logging.getLogger(__name__).critical(
             "Client secretfile <%s> not found!", ClientRegister
         )
         return False
 
+    ClientStrings: list[str] = []
+
     with open(ClientRegister, "r") as File:
         Line = File.readline()
 
@@ -26,19 +40,73 @@ def load_client_secret(ClientRegister: str) -> bool:
             Line = Line.split("\n")[0]
             Line = Line.split("\r")[0]
 
-            __ClientStrings.append(Line)
+            ClientStrings.append(Line)
             logging.getLogger(__name__).debug("Added client secret: %s", Line)
 
             Line = File.readline()
 
-        return True
+    __ClientStrings = ClientStrings
 
+    return True
 
-def load_client_keys(ClientKeyPath: str):
-    """Load all client keys from directory"""
+
+def get_client_id(Keyfile: str) -> int:
+    """Return the client ID of a keyfile (client_<ID>.pub), 0 if not valid"""
+    Filename = os.path.splitext(os.path.basename(Keyfile))[0]
+
+    try:
+        return int(Filename.split("_")[-1])
+
+    except ValueError:
+        return 0
+
+
+def read_client_keyfile(Keyfile: str) -> bytes:
+    """Read and decode a client public keyfile. Returns empty bytes if corrupt"""
+    try:
+        Stat = os.stat(Keyfile)
+
+    except OSError:
+        return b""
+
+    Signature = (Stat.st_mtime_ns, Stat.st_size)
+
+    # keyfile did not change since the last load
+    if Keyfile in __KeyfileCache and __KeyfileCache[Keyfile][0] == Signature:
+        return __KeyfileCache[Keyfile][1]
+
+    with open(Keyfile, "r") as File:
+        PKStr = File.readline()
+        PKBytes: bytes
+
+        try:
+            PKBytes = base64.b64decode(PKStr)
+
+        except binascii.Error:
+            PKBytes = b""
+
+        if len(PKBytes) != 32:
+            PKBytes = b""
+
+    __KeyfileCache[Keyfile] = (Signature, PKBytes)
+    logging.getLogger(__name__).debug("Read client keyfile: %s", Keyfile)
+
+    return PKBytes
+
+
+def read_client_keys(ClientKeyPath: str) -> list[tuple[int, bytes, str]]:
+    """Read all client keys from directory and bind them to their secrets"""
+    NewClients: list[tuple[int, bytes, str]] = []
     Keyfiles = glob(f"{ClientKeyPath}/client_*.pub")
+    # register line of each keyfile, mismatches of the old layout are logged
+    Lines = keystore.get_secret_lines(
+        [get_client_id(Keyfile) for Keyfile in Keyfiles], len(__ClientStrings)
+    )
+
     for Keyfile in Keyfiles:
-        if not util.check_file_exist(Keyfile):
+        ClientID = get_client_id(Keyfile)
+
+        if not util.check_file_exist(Keyfile) or ClientID <= 0:
             logging.getLogger(__name__).warning(
                 "File <%s> not a keyfile! Please remove from key location: %s",
                 Keyfile,
@@ -46,34 +114,170 @@ def load_client_keys(ClientKeyPath: str):
             )
             continue
 
+        if ClientID not in Lines:
+            logging.getLogger(__name__).error(
+                "No client secret registered for keyfile! Ignoring keyfile: %s",
+                Keyfile,
+            )
+            continue
+
         # client public key
-        with open(Keyfile, "r") as File:
-            PKStr = File.readline()
-            PKBytes: bytes
+        PKBytes = read_client_keyfile(Keyfile)
+
+        if PKBytes == b"":
+            logging.getLogger(__name__).error(
+                "Client public keyfile corrupt! Ignoring keyfile: %s", Keyfile
+            )
+            continue
+
+        NewClients.append((ClientID, PKBytes, __ClientStrings[Lines[ClientID] - 1]))
+        logging.getLogger(__name__).debug("Loaded client keyfile: %s", Keyfile)
 
-            try:
-                PKBytes = base64.b64decode(PKStr)
+    # drop removed keyfiles from the cache
+    for Keyfile in set(__KeyfileCache) - set(Keyfiles):
+        __KeyfileCache.pop(Keyfile)
 
-            except binascii.Error:
-                logging.getLogger(__name__).error(
-                    "Client public keyfile corrupt! Ignoring keyfile: %s", Keyfile
-                )
-                continue
+    return sorted(NewClients)
 
-            if len(PKBytes) != 32:
-                logging.getLogger(__name__).error(
-                    "Client public keyfile corrupt! Ignoring keyfile: %s", Keyfile
-                )
-                continue
 
-            PKClient = PublicKey(PKBytes)
-            ClientKeys.append(PKClient)
-            logging.getLogger(__name__).debug("Loaded client keyfile: %s", Keyfile)
+def load_client_keys(ClientKeyPath: str):
+    """Load all client keys from directory and bind them to their secrets"""
+    global Clients
+
+    # all requests after this see the new clients at once
+    Clients = keytable.KeyTable(keytable.pack_clients(read_client_keys(ClientKeyPath)))
+
+
+def read_client_keystore(Keystore: str) -> list[tuple[int, bytes, str]] | None:
+    """Read all clients that are not revoked from the keystore in a single read"""
+    try:
+        Rows = keystore.read_clients(Keystore)
+
+    except sqlite3.Error as e:
+        logging.getLogger(__name__).critical(
+            "Client keystore <%s> could not be read: %s", Keystore, e
+        )
+        return None
+
+    NewClients: list[tuple[int, bytes, str]] = []
 
+    for ClientID, PKBytes, Secret in Rows:
+        if len(PKBytes) != 32:
+            logging.getLogger(__name__).error(
+                "Client public key corrupt! Ignoring client: %d", ClientID
+            )
+            continue
+
+        NewClients.append((ClientID, PKBytes, Secret))
+
+    return NewClients
+
+
+def load_client_keystore(Keystore: str) -> bool:
+    """Load all clients that are not revoked from the keystore"""
+    global Clients
+
+    NewClients = read_client_keystore(Keystore)
+
+    if NewClients is None:
+        return False
+
+    Clients = keytable.KeyTable(keytable.pack_clients(NewClients))
+
+    return True
+
+
+def load_client_snapshot(
+    Snapshot: str, ClientRegister: str, ClientKeyPath: str, Keystore: str = ""
+) -> bool:
+    """Map the clients from a snapshot file, rebuilt if any of its sources changed"""
+    global Clients
+
+    # taken before reading, changes while reading lead to another rebuild
+    Signature = keytable.get_signature(
+        get_client_files(ClientRegister, ClientKeyPath, Keystore)
+    )
+    Table = keytable.open_snapshot(Snapshot, Signature)
+
+    if Table is None:
+        if Keystore != "":
+            NewClients = read_client_keystore(Keystore)
+
+        elif load_client_secret(ClientRegister):
+            NewClients = read_client_keys(ClientKeyPath)
+
+        else:
+            NewClients = None
+
+        if NewClients is None:
+            return False
+
+        Packed = keytable.pack_clients(NewClients, Signature)
+
+        try:
+            keytable.write_snapshot(Snapshot, Packed)
+            Table = keytable.open_snapshot(Snapshot, Signature)
+
+        except OSError as e:
+            logging.getLogger(__name__).warning(
+                "Client snapshot <%s> could not be written: %s", Snapshot, e
+            )
+
+        # not shared with other workers, but still packed
+        if Table is None:
+            Table = keytable.KeyTable(Packed)
+
+        logging.getLogger(__name__).debug("Rebuilt client snapshot: %s", Snapshot)
+
+    Clients = Table
+
+    return True
+
+
+def reload_clients(
+    ClientRegister: str, ClientKeyPath: str, Keystore: str = "", Snapshot: str = ""
+) -> bool:
+    """Reload client secrets and keys. Old clients are kept on errors"""
+    with __ReloadLock:
+        if Snapshot != "":
+            if not load_client_snapshot(
+                Snapshot, ClientRegister, ClientKeyPath, Keystore
+            ):
+                return False
+
+        elif Keystore != "":
+            if not load_client_keystore(Keystore):
+                return False
+
+        elif not load_client_secret(ClientRegister):
+            return False
+
+        else:
+            load_client_keys(ClientKeyPath)
+
+    logging.getLogger(__name__).info("Loaded clients, %d keys registered", len(Clients))
+
+    return True
+
+
+def get_client_files(
+    ClientRegister: str, ClientKeyPath: str, Keystore: str = ""
+) -> list[str]:
+    """All files that define the registered clients"""
+    if Keystore != "":
+        return [Keystore]
+
+    return [ClientRegister] + glob(f"{ClientKeyPath}/client_*.pub")
+
+
+def check_client_register(Secret: str, ClientKey: PublicKey) -> bool:
+    """Checks if a client secret is registered for the given client key"""
+    Table = Clients
+    Index = Table.find_key(bytes(ClientKey))
+
+    if Index < 0:
+        return False
 
-def check_client_register(Secret: str) -> bool:
-    """Checks if a client secret is registered"""
-    if Secret in __ClientStrings:
-        return True
+    RegSecret = Table.get_secret(Index)
 
-    return False
+    return hmac.compare_digest(RegSecret.encode("utf-8"), Secret.encode("utf-8"))
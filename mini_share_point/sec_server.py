@@ -1,13 +1,34 @@
 import base64
 import binascii
+import collections
 import dataclasses
 import enum
+import json
 import logging
 from nacl.public import PrivateKey, PublicKey, Box
 from nacl.exceptions import CryptoError
+import os
+import sqlite3
+import threading
 import time
-
-from . import config, sec_client, util
+from typing import Iterable, Iterator
+
+from . import config, metrics, sec_client, statestore, util
+
+"""Content type of streamed responses, one encrypted frame per line"""
+STREAM_MIMETYPE = "application/x-msp-stream"
+"""Content type of binary messages, raw ciphertext prefixed by its length"""
+FRAME_MIMETYPE = "application/x-msp-frame"
+"""Content type of binary streamed responses, one length prefixed frame per chunk"""
+FRAME_STREAM_MIMETYPE = "application/x-msp-frame-stream"
+"""Nonces of accepted requests shared by all worker processes"""
+REPLAY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nonces (
+    nonce BLOB PRIMARY KEY,
+    bucket INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS nonces_bucket ON nonces (bucket);
+"""
 
 
 class ReturnCode(enum.Enum):
@@ -21,10 +42,199 @@ class DecryptedMessage:
     ClientSecret: str
     FunctionCall: str
     ClientKey: PublicKey
+    # set for batch requests, holds all functions to call
+    FunctionBatch: list[str] = dataclasses.field(default_factory=list)
 
 
 __SKStore: list[PrivateKey] = []
 
+"""Boxes with precomputed shared keys, indexed by client public key (LRU)"""
+__BoxCache: collections.OrderedDict[bytes, Box] = collections.OrderedDict()
+__BoxCacheSize: int = 8192
+__BoxCacheLock = threading.Lock()
+
+"""Nonces of accepted requests in buckets of RequestTTL seconds, by bucket number"""
+__ReplayBuckets: collections.OrderedDict[int, set[bytes]] = collections.OrderedDict()
+__ReplayCount: int = 0
+__ReplayCacheSize: int = 100000
+__ReplayLock = threading.Lock()
+"""Shared nonces of all workers, None keeps them in this process"""
+__ReplayStore: statestore.StateStore | None = None
+"""Bucket and number of inserts at the last expiry of the shared nonces"""
+__ReplayExpiry: tuple[int, int] = (0, 0)
+
+
+def setup_box_cache(MaxSize: int):
+    """Set the maximum number of cached client boxes. Clears the cache"""
+    global __BoxCacheSize
+
+    __BoxCacheSize = max(1, MaxSize)
+    clear_box_cache()
+
+
+def clear_box_cache():
+    """Drop all precomputed shared keys, has to be called if keys are reloaded"""
+    with __BoxCacheLock:
+        __BoxCache.clear()
+
+
+def get_client_box(PKClient: PublicKey) -> Box:
+    """Return the box for a client, the shared key is only computed once"""
+    return get_key_box(bytes(PKClient))
+
+
+def get_key_box(PKBytes: bytes, Cache: bool = True) -> Box:
+    """Return the box for a raw client key, see get_client_box. Without Cache a new
+    box is not stored and the LRU order is kept"""
+    with __BoxCacheLock:
+        ClientBox = __BoxCache.get(PKBytes)
+
+        if ClientBox is not None:
+            if Cache:
+                __BoxCache.move_to_end(PKBytes)
+
+            metrics.inc("msp_cache_requests_total", cache="box", result="hit")
+            return ClientBox
+
+    metrics.inc("msp_cache_requests_total", cache="box", result="miss")
+    # shared key computation is done outside of the lock
+    ClientBox = Box(__SKStore[0], PublicKey(PKBytes))
+
+    if Cache:
+        cache_key_box(PKBytes, ClientBox)
+
+    return ClientBox
+
+
+def cache_key_box(PKBytes: bytes, ClientBox: Box):
+    """Store a box as the most recently used one"""
+    with __BoxCacheLock:
+        __BoxCache[PKBytes] = ClientBox
+        __BoxCache.move_to_end(PKBytes)
+
+        while len(__BoxCache) > __BoxCacheSize:
+            __BoxCache.popitem(last=False)
+
+
+def setup_replay_cache(MaxSize: int, Store: str = "") -> bool:
+    """Set the maximum number of stored request nonces, 0 disables the check.
+    Nonces are shared by all worker processes through the Store file if set"""
+    global __ReplayCacheSize, __ReplayCount, __ReplayStore
+
+    with __ReplayLock:
+        __ReplayCacheSize = MaxSize
+        __ReplayBuckets.clear()
+        __ReplayCount = 0
+        __ReplayStore = None
+
+        if Store != "" and MaxSize > 0:
+            try:
+                __ReplayStore = statestore.StateStore(Store, REPLAY_SCHEMA)
+
+            except sqlite3.Error as e:
+                logging.getLogger(__name__).critical(
+                    "Could not open replay store <%s>: %s", Store, e
+                )
+                return False
+
+    return True
+
+
+def check_replay(Nonce: bytes) -> bool:
+    """Records the nonce of a request. Returns False if it was already seen"""
+    if __ReplayCacheSize == 0:
+        return True
+
+    TTL = config.get_settings().RequestTTL
+    Bucket = int(time.time()) // TTL
+    Store = __ReplayStore
+
+    try:
+        if Store is not None:
+            Accepted = add_shared_nonce(Store, Nonce, Bucket)
+
+        else:
+            Accepted = add_nonce(Nonce, Bucket)
+
+    # requests can not be checked -> rejected
+    except sqlite3.Error as e:
+        logging.getLogger(__name__).error("Replay store not available: %s", e)
+        metrics.inc("msp_unauthorized_total", reason="replay_store")
+        return False
+
+    if not Accepted:
+        logging.getLogger(__name__).warning("Replayed request rejected!")
+        metrics.inc("msp_unauthorized_total", reason="replay")
+
+    return Accepted
+
+
+def add_nonce(Nonce: bytes, Bucket: int) -> bool:
+    """Record a nonce in this process. Returns False if it was already seen"""
+    global __ReplayCount
+
+    with __ReplayLock:
+        # timestamps are accepted up to TTL in the past and in the future
+        # -> nonces have to be kept for at least two TTL windows
+        while len(__ReplayBuckets) > 0 and next(iter(__ReplayBuckets)) < Bucket - 2:
+            __ReplayCount -= len(__ReplayBuckets.popitem(last=False)[1])
+
+        for Nonces in __ReplayBuckets.values():
+            if Nonce in Nonces:
+                return False
+
+        # cache is full -> oldest nonces are dropped before their time
+        while __ReplayCount >= __ReplayCacheSize and len(__ReplayBuckets) > 0:
+            __ReplayCount -= len(__ReplayBuckets.popitem(last=False)[1])
+            logging.getLogger(__name__).warning(
+                "Replay cache full! Dropped nonces before end of request TTL"
+            )
+
+        if Bucket not in __ReplayBuckets:
+            __ReplayBuckets[Bucket] = set()
+
+        __ReplayBuckets[Bucket].add(Nonce)
+        __ReplayCount += 1
+
+    return True
+
+
+def add_shared_nonce(Store: statestore.StateStore, Nonce: bytes, Bucket: int) -> bool:
+    """Record a nonce for all processes. Returns False if it was already seen"""
+    global __ReplayExpiry
+
+    ExpiryBucket, Inserts = __ReplayExpiry
+
+    # counting is not done per request, the size is checked every 1024 nonces
+    if Bucket != ExpiryBucket or Inserts >= 1024:
+        Inserts = 0
+        # same TTL windows as the nonces of a single process
+        Store.execute("DELETE FROM nonces WHERE bucket < ?", (Bucket - 2,))
+        Count = Store.execute("SELECT COUNT(*) FROM nonces")[0][0]
+
+        if Count >= __ReplayCacheSize:
+            Store.execute(
+                "DELETE FROM nonces WHERE nonce IN "
+                "(SELECT nonce FROM nonces ORDER BY bucket LIMIT ?)",
+                (Count - __ReplayCacheSize + 1,),
+            )
+            logging.getLogger(__name__).warning(
+                "Replay cache full! Dropped nonces before end of request TTL"
+            )
+
+    __ReplayExpiry = (Bucket, Inserts + 1)
+
+    try:
+        # primary key -> check and insert are one step for all processes
+        Store.execute(
+            "INSERT INTO nonces (nonce, bucket) VALUES (?, ?)", (Nonce, Bucket)
+        )
+
+    except sqlite3.IntegrityError:
+        return False
+
+    return True
+
 
 def load_server_key(ServerKeypath: str) -> bool:
     """Load the server private keyfile"""
@@ -54,106 +264,303 @@ def load_server_key(ServerKeypath: str) -> bool:
 
         SKServer = PrivateKey(SKBytes)
         __SKStore.append(SKServer)
+        clear_box_cache()
         logging.getLogger(__name__).debug("Server keyfile loaded")
 
         return True
 
 
+def get_candidate_keys(KeyID: str) -> Iterable[bytes]:
+    """Return all client keys that should be tried for decrypting a request"""
+    Clients = sec_client.Clients
+
+    # client sent its key fingerprint -> only a single key has to be tried
+    # otherwise try decoding the message with every public key
+    if KeyID != "":
+        Index = Clients.find_key_id(KeyID) if isinstance(KeyID, str) else -1
+
+        if Index < 0:
+            logging.getLogger(__name__).warning(
+                "Sent key ID <%s> is not registered!", KeyID
+            )
+            return []
+
+        return [Clients.get_key(Index)]
+
+    return Clients.iter_keys()
+
+
+def check_request_age(SecTime: int) -> bool:
+    """Checks if the timestamp of a request is still inside the request TTL"""
+    CheckTime = int(time.time())
+    Delta = abs(CheckTime - SecTime)
+    TTL = config.get_settings().RequestTTL
+
+    if Delta > TTL:
+        logging.getLogger(__name__).warning("Send package is already max age!")
+        metrics.inc("msp_unauthorized_total", reason="expired")
+        return False
+
+    return True
+
+
+def find_client_box(
+    Encrypted: bytes, KeyID: str
+) -> tuple[PublicKey, Box, bytes] | None:
+    """Search the client key of a message. Returns key, box and decrypted message"""
+    Tried = 0
+
+    with metrics.timed("msp_stage_seconds", stage="key_search"):
+        for PKBytes in get_candidate_keys(KeyID):
+            # a scan with a wrong key must not evict the boxes of active clients
+            ClientBox = get_key_box(PKBytes, Cache=False)
+            Tried += 1
+
+            try:
+                Decrypted = ClientBox.decrypt(Encrypted)
+
+            except CryptoError:
+                continue
+
+            cache_key_box(PKBytes, ClientBox)
+            metrics.observe("msp_keys_tried", Tried, metrics.COUNT_BUCKETS)
+            return PublicKey(PKBytes), ClientBox, Decrypted
+
+    metrics.observe("msp_keys_tried", Tried, metrics.COUNT_BUCKETS)
+    return None
+
+
 def decrypt_remote_call(
-    EncodedMsg: str, EncodedCRC: str, EncodedTime: str, EncodedFunc: str
+    EncodedMsg: str,
+    EncodedCRC: str,
+    EncodedTime: str,
+    EncodedFunc: str,
+    KeyID: str = "",
 ) -> DecryptedMessage:
     """Decrypts a message and returns the sender secret and call function"""
-    MsgEncoded = base64.urlsafe_b64decode(EncodedMsg)
-    CRCEncoded = base64.urlsafe_b64decode(EncodedCRC)
-    TimeEncoded = base64.urlsafe_b64decode(EncodedTime)
-    FuncEncoded = base64.urlsafe_b64decode(EncodedFunc)
-
     ReturnError = DecryptedMessage(ReturnCode.NOT_AUTHORIZED, "", "", None)
 
-    # try decoding the message with every public key
-    # check is done via CRC32
-    for PKClient in sec_client.ClientKeys:
-        MsgBox = Box(__SKStore[0], PKClient)
-        CRCBox = Box(__SKStore[0], PKClient)
-        TimeBox = Box(__SKStore[0], PKClient)
-        FuncBox = Box(__SKStore[0], PKClient)
+    try:
+        with metrics.timed("msp_stage_seconds", stage="b64_decode"):
+            MsgEncoded = base64.urlsafe_b64decode(EncodedMsg)
+            CRCEncoded = base64.urlsafe_b64decode(EncodedCRC)
+            TimeEncoded = base64.urlsafe_b64decode(EncodedTime)
+            FuncEncoded = base64.urlsafe_b64decode(EncodedFunc)
+
+    except (binascii.Error, TypeError, ValueError):
+        logging.getLogger(__name__).warning("Message is not base64 encoded!")
+        metrics.inc("msp_unauthorized_total", reason="malformed")
+        return ReturnError
+
+    Found = find_client_box(MsgEncoded, KeyID)
+
+    # no PK that is stored could decode the message
+    if Found is None:
+        logging.getLogger(__name__).warning(
+            "Sent message could not be decrypted with any key!"
+        )
+        metrics.inc("msp_unauthorized_total", reason="unknown_key")
+        return ReturnError
+
+    PKClient, ClientBox, SecMsgBytes = Found
+
+    # remaining parts have to be sent by the same client
+    try:
+        SecCRC = int.from_bytes(ClientBox.decrypt(CRCEncoded), "big")
+        SecTime = int.from_bytes(ClientBox.decrypt(TimeEncoded), "big")
+        SecFuncBytes = ClientBox.decrypt(FuncEncoded)
 
-        SecMsgBytes = b""
+    except CryptoError:
         SecCRC = 0
         SecTime = 0
         SecFuncBytes = b""
 
-        try:
-            SecMsgBytes = MsgBox.decrypt(MsgEncoded)
+    if SecMsgBytes == b"" or SecCRC == 0 or SecTime == 0 or SecFuncBytes == b"":
+        logging.getLogger(__name__).warning("Could not decrypt incoming message!")
+        metrics.inc("msp_unauthorized_total", reason="malformed")
+        return ReturnError
 
-        except CryptoError:
-            continue
+    # check CRC32 value
+    CheckCRC = binascii.crc32(SecMsgBytes)
+    logging.getLogger(__name__).debug("Incoming CRC: %s", CheckCRC)
+    logging.getLogger(__name__).debug("Checking against: %s", SecCRC)
 
-        try:
-            SecCRC = int.from_bytes(CRCBox.decrypt(CRCEncoded), "big")
+    # CRC32 values are not identical
+    if not CheckCRC == SecCRC:
+        logging.getLogger(__name__).warning("CRC check of incoming message failed!")
+        metrics.inc("msp_unauthorized_total", reason="malformed")
+        return ReturnError
 
-        except CryptoError:
-            continue
+    # timestamp for TTL check of request
+    if not check_request_age(SecTime):
+        return ReturnError
 
-        try:
-            SecTime = int.from_bytes(TimeBox.decrypt(TimeEncoded), "big")
+    # every request needs a fresh timestamp box, its nonce identifies the request
+    if not check_replay(TimeEncoded[: Box.NONCE_SIZE]):
+        return ReturnError
 
-        except CryptoError:
-            continue
+    # client secret
+    SecKey = SecMsgBytes.decode("utf-8")
+    # function to call
+    SecFunc = SecFuncBytes.decode("utf-8")
+    logging.getLogger(__name__).debug("Client requested method: %s", SecFunc)
 
-        try:
-            SecFuncBytes = FuncBox.decrypt(FuncEncoded)
+    ReturnSuccess = DecryptedMessage(ReturnCode.CLIENT_AUTH, SecKey, SecFunc, PKClient)
 
-        except CryptoError:
-            continue
+    return ReturnSuccess
 
-        if SecMsgBytes == b"" or SecCRC == 0 or SecTime == 0 or SecFuncBytes == b"":
-            logging.getLogger(__name__).warning("Could not decrypt incoming message!")
-            return ReturnError
 
-        # check CRC32 value
-        CheckCRC = binascii.crc32(SecMsgBytes)
-        logging.getLogger(__name__).debug("Incoming CRC: %s", CheckCRC)
-        logging.getLogger(__name__).debug("Checking against: %s", SecCRC)
+def pack_frame(Data: bytes) -> bytes:
+    """Prefix binary data with its length"""
+    return len(Data).to_bytes(4, "big") + Data
 
-        # CRC32 values are not identical
-        if not CheckCRC == SecCRC:
-            continue
 
-        # timestamp for TTL check of request
-        CheckTime = int(time.time())
-        Delta = abs(CheckTime - SecTime)
-        TTL = int(config.read_config("Clients", "RequestTTL", "30"))
+def unpack_request_frame(Body: bytes) -> tuple[bytes, str] | None:
+    """Split a binary request into envelope and key ID. Returns None if malformed"""
+    # request: key ID length (1) | key ID | envelope length (4) | envelope
+    if len(Body) < 1:
+        return None
 
-        if Delta > TTL:
-            logging.getLogger(__name__).warning("Send package is already max age!")
-            return ReturnError
+    Offset = 1 + Body[0]
 
-        # client secret
-        SecKey = SecMsgBytes.decode("utf-8")
-        # function to call
-        SecFunc = SecFuncBytes.decode("utf-8")
-        logging.getLogger(__name__).debug("Client requested method: %s", SecFunc)
+    if len(Body) < Offset + 4:
+        return None
 
-        ReturnSuccess = DecryptedMessage(
-            ReturnCode.CLIENT_AUTH, SecKey, SecFunc, PKClient
-        )
+    EnvelopeLen = int.from_bytes(Body[Offset : Offset + 4], "big")
+    Envelope = Body[Offset + 4 :]
 
-        return ReturnSuccess
+    if len(Envelope) != EnvelopeLen:
+        return None
+
+    return Envelope, Body[1:Offset].hex()
+
+
+def decrypt_envelope(EncodedEnvelope: str, KeyID: str = "") -> DecryptedMessage:
+    """Decrypts a single base64 encoded envelope"""
+    try:
+        with metrics.timed("msp_stage_seconds", stage="b64_decode"):
+            EnvelopeEncoded = base64.urlsafe_b64decode(EncodedEnvelope)
+
+    except (binascii.Error, TypeError, ValueError):
+        logging.getLogger(__name__).warning("Envelope is not base64 encoded!")
+        metrics.inc("msp_unauthorized_total", reason="malformed")
+        return DecryptedMessage(ReturnCode.NOT_AUTHORIZED, "", "", None)
+
+    return decrypt_envelope_bytes(EnvelopeEncoded, KeyID)
+
+
+def decrypt_envelope_bytes(EnvelopeEncoded: bytes, KeyID: str = "") -> DecryptedMessage:
+    """Decrypts a single envelope holding client secret, timestamp and call function"""
+    ReturnError = DecryptedMessage(ReturnCode.NOT_AUTHORIZED, "", "", None)
+
+    # integrity of the envelope is given by the MAC of the box
+    Found = find_client_box(EnvelopeEncoded, KeyID)
 
     # no PK that is stored could decode the message
-    logging.getLogger(__name__).warning(
-        "Sent message could not be decrypted with any key!"
+    if Found is None:
+        logging.getLogger(__name__).warning(
+            "Sent envelope could not be decrypted with any key!"
+        )
+        metrics.inc("msp_unauthorized_total", reason="unknown_key")
+        return ReturnError
+
+    PKClient, _, EnvelopeBytes = Found
+
+    try:
+        Envelope = json.loads(EnvelopeBytes)
+        SecKey = Envelope["secret"]
+        SecTime = Envelope["ts"]
+        # single function or batch of functions
+        SecFunc = Envelope.get("entry", "")
+        SecBatch = Envelope.get("entries", [])
+
+    except (ValueError, TypeError, KeyError, AttributeError):
+        logging.getLogger(__name__).warning("Could not decode incoming envelope!")
+        metrics.inc("msp_unauthorized_total", reason="malformed")
+        return ReturnError
+
+    if (
+        not isinstance(SecKey, str)
+        or not isinstance(SecTime, int)
+        or not isinstance(SecFunc, str)
+        or not isinstance(SecBatch, list)
+        or not all(isinstance(Func, str) for Func in SecBatch)
+        or (SecFunc == "") == (len(SecBatch) == 0)
+    ):
+        logging.getLogger(__name__).warning("Malformed incoming envelope!")
+        metrics.inc("msp_unauthorized_total", reason="malformed")
+        return ReturnError
+
+    if len(SecBatch) > config.get_settings().MaxBatchSize:
+        logging.getLogger(__name__).warning(
+            "Batch request with %d calls is too large!", len(SecBatch)
+        )
+        metrics.inc("msp_unauthorized_total", reason="malformed")
+        return ReturnError
+
+    # timestamp for TTL check of request
+    if not check_request_age(SecTime):
+        return ReturnError
+
+    if not check_replay(EnvelopeEncoded[: Box.NONCE_SIZE]):
+        return ReturnError
+
+    logging.getLogger(__name__).debug(
+        "Client requested method: %s", SecFunc if SecFunc != "" else SecBatch
     )
-    return ReturnError
 
+    return DecryptedMessage(ReturnCode.CLIENT_AUTH, SecKey, SecFunc, PKClient, SecBatch)
 
-def encrypt_message(PKClient: PublicKey, Message: str) -> str:
-    """Encrypts a message string. Returns as safe base64 encoded string"""
-    MsgBox = Box(__SKStore[0], PKClient)
-    SecMsgBytes = Message.encode("utf-8")
-    MsgEncrypt = MsgBox.encrypt(SecMsgBytes)
+
+def encrypt_message_bytes(PKClient: PublicKey, Message: str | bytes) -> bytes:
+    """Encrypts a message string or bytes. Returns the raw ciphertext"""
+    MsgBox = get_client_box(PKClient)
+    SecMsgBytes = Message.encode("utf-8") if isinstance(Message, str) else Message
+
+    with metrics.timed("msp_stage_seconds", stage="encrypt"):
+        return bytes(MsgBox.encrypt(SecMsgBytes))
+
+
+def encrypt_message(PKClient: PublicKey, Message: str | bytes) -> str:
+    """Encrypts a message string or bytes. Returns as safe base64 encoded string"""
+    MsgEncrypt = encrypt_message_bytes(PKClient, Message)
 
     StrMsg = base64.urlsafe_b64encode(MsgEncrypt).decode("utf-8")
 
     return StrMsg
+
+
+def encrypt_frame(
+    MsgBox: Box, StreamID: bytes, Seq: int, Final: bool, Data: bytes, Binary: bool
+) -> bytes:
+    """Encrypts a single stream frame. Returns a base64 line or a binary frame"""
+    # header: stream ID (16) | sequence number (8) | final flag (1)
+    Header = StreamID + Seq.to_bytes(8, "big") + (b"\x01" if Final else b"\x00")
+
+    with metrics.timed("msp_stage_seconds", stage="encrypt"):
+        FrameEncrypt = bytes(MsgBox.encrypt(Header + Data))
+
+    if Binary:
+        return pack_frame(FrameEncrypt)
+
+    return base64.urlsafe_b64encode(FrameEncrypt) + b"\n"
+
+
+def encrypt_stream(
+    PKClient: PublicKey, Chunks: Iterable[str | bytes], Binary: bool = False
+) -> Iterator[bytes]:
+    """Encrypts every chunk on its own, the stream is closed with a final frame"""
+    MsgBox = get_client_box(PKClient)
+    # frames of different streams can not be mixed
+    StreamID = os.urandom(16)
+    Seq = 0
+
+    for Chunk in Chunks:
+        if isinstance(Chunk, str):
+            Chunk = Chunk.encode("utf-8")
+
+        yield encrypt_frame(MsgBox, StreamID, Seq, False, Chunk, Binary)
+        Seq += 1
+
+    # missing final frame shows the client a truncated stream
+    yield encrypt_frame(MsgBox, StreamID, Seq, True, b"", Binary)
@@ -0,0 +1,42 @@
+"""Request state shared by all worker processes through a SQLite file"""
+
+import os
+import sqlite3
+import threading
+
+
+class StateStore:
+    """SQLite file opened by every process on its first use, not shared across forks"""
+
+    def __init__(self, Path: str, Schema: str):
+        self.Path = Path
+        self.Schema = Schema
+        self.Lock = threading.Lock()
+        self.PID = 0
+        self.Connection: sqlite3.Connection | None = None
+
+        # errors show up at startup, workers open their own connection
+        self.open().close()
+
+    def open(self) -> sqlite3.Connection:
+        """Open a new connection, the schema is created if it does not exist"""
+        # autocommit, every statement is its own transaction
+        Connection = sqlite3.connect(
+            self.Path, timeout=5.0, isolation_level=None, check_same_thread=False
+        )
+        # state is lost on a crash anyway, writers only wait for each other
+        Connection.execute("PRAGMA journal_mode=WAL")
+        Connection.execute("PRAGMA synchronous=OFF")
+        Connection.executescript(self.Schema)
+
+        return Connection
+
+    def execute(self, SQL: str, Parameters: tuple | dict = ()) -> list[tuple]:
+        """Run a statement with the connection of this process. Returns all rows"""
+        with self.Lock:
+            # a connection inherited from the parent process must not be used
+            if self.Connection is None or self.PID != os.getpid():
+                self.Connection = self.open()
+                self.PID = os.getpid()
+
+            return self.Connection.execute(SQL, Parameters).fetchall()
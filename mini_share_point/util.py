@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import os
 
@@ -10,3 +11,8 @@ def check_file_exist(Filepath: str) -> bool:
     else:
         logging.getLogger(__name__).info("File not found! - %s", Filepath)
         return False
+
+
+def key_fingerprint(KeyBytes: bytes) -> str:
+    """Short identifier of a public key, used for routing requests to a client key"""
+    return hashlib.blake2b(KeyBytes, digest_size=8).hexdigest()
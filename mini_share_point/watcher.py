@@ -0,0 +1,65 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+
+def get_file_signatures(Files: list[str]) -> dict[str, tuple[int, int]]:
+    """Return (mtime, size) of every existing file"""
+    Signatures: dict[str, tuple[int, int]] = {}
+
+    for Filepath in Files:
+        try:
+            Stat = os.stat(Filepath)
+
+        except OSError:
+            continue
+
+        Signatures[Filepath] = (Stat.st_mtime_ns, Stat.st_size)
+
+    return Signatures
+
+
+def start_watcher(
+    Name: str,
+    GetFiles: Callable[[], list[str]],
+    OnChange: Callable[[set[str]], None],
+    Interval: float,
+) -> threading.Thread:
+    """Poll the files given by GetFiles and call OnChange with all changed files"""
+    Signatures = get_file_signatures(GetFiles())
+
+    def watch():
+        nonlocal Signatures
+
+        while True:
+            time.sleep(Interval)
+
+            try:
+                NewSignatures = get_file_signatures(GetFiles())
+                # added, removed or modified files
+                Changed = {
+                    Filepath
+                    for Filepath in set(Signatures) | set(NewSignatures)
+                    if Signatures.get(Filepath) != NewSignatures.get(Filepath)
+                }
+
+                if len(Changed) > 0:
+                    logging.getLogger(__name__).debug(
+                        "Watcher <%s> detected changes: %s", Name, Changed
+                    )
+                    OnChange(Changed)
+
+                Signatures = NewSignatures
+
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "Watcher <%s> failed to process changes!", Name
+                )
+
+    Watcher = threading.Thread(target=watch, name=f"watcher-{Name}", daemon=True)
+    Watcher.start()
+    logging.getLogger(__name__).debug("Started watcher <%s>", Name)
+
+    return Watcher
@@ -57,4 +57,5 @@ if [ -z "${PYTHONPATH-}" ];then
 fi
 
 # run server as msppython user
-su -c 'gunicorn -b 0.0.0.0:8000 "mini_share_point:create_app()"' msppython
\ No newline at end of file
+# server profile is set up with MSP_* variables, see gunicorn.conf.py
+su -c 'gunicorn -c /app/gunicorn.conf.py' msppython
\ No newline at end of file
@@ -62,6 +62,11 @@ if [ ! -e "/sec/server.key" -a ! -e "/sec/server.pub" ];then
     chmod 644 /sec/server.pub
 fi
 
+# single file client keystore (Clients/Keystore), existing clients are migrated once
+if ! python3 /app/mini_share_point/keystore.py migrate; then
+    exit 1
+fi
+
 # install module requirements if supplied
 if [ -s "$MOD_REQ_FILE" ];then
     pip install -r "$MOD_REQ_FILE"
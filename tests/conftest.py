@@ -0,0 +1,246 @@
+import asyncio
+import base64
+import configparser
+import importlib
+import io
+import json
+import os
+import sys
+import textwrap
+
+from flask import Flask
+from nacl.public import PrivateKey
+import pytest
+
+# tests import the package from the repository root and the client from util
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, Root)
+sys.path.insert(0, os.path.join(Root, "util"))
+
+import client  # noqa: E402
+import mini_share_point  # noqa: E402
+from mini_share_point import (  # noqa: E402
+    asgi,
+    config,
+    data,
+    function_factory,
+    keystore,
+    metrics,
+    sec_server,
+)
+
+"""Server key of all tests, a process only uses the first key it loaded"""
+SERVER_KEY = PrivateKey.generate()
+
+
+class Clock:
+    """Replaces the time module of a server module, time only moves on advance"""
+
+    def __init__(self, Now: float = 1_000_000.0):
+        self.Now = Now
+
+    def advance(self, Seconds: float):
+        self.Now += Seconds
+
+    def time(self) -> float:
+        return self.Now
+
+    def monotonic(self) -> float:
+        return self.Now
+
+    def perf_counter(self) -> float:
+        return self.Now
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+@pytest.fixture
+def load_settings(tmp_path):
+    """Load settings from config.ini text, the defaults are restored afterwards"""
+    ConfigFile = tmp_path / "config.ini"
+
+    def load(Text: str = "") -> bool:
+        ConfigFile.write_text(Text)
+        return config.load_config(str(ConfigFile))
+
+    yield load
+
+    ConfigFile.write_text("")
+    config.load_config(str(ConfigFile))
+
+
+@pytest.fixture
+def load_modules(tmp_path, monkeypatch):
+    """Write module files and a modules.ini registering them by their own name"""
+    monkeypatch.syspath_prepend(str(tmp_path))
+    ModuleConfig = tmp_path / "modules.ini"
+    Names: list[str] = []
+
+    def load(Modules: dict[str, str], Options: str = "", Reload: bool = False) -> bool:
+        for Name, Code in Modules.items():
+            (tmp_path / f"{Name}.py").write_text(textwrap.dedent(Code))
+            Names.append(Name)
+
+        importlib.invalidate_caches()
+        ModuleConfig.write_text(
+            "[Modules]\n"
+            + "".join(f"{Name}={Name}\n" for Name in Modules)
+            + textwrap.dedent(Options)
+        )
+
+        return function_factory.load_mods(str(ModuleConfig), Reload)
+
+    yield load
+
+    ModuleConfig.write_text("[Modules]\n")
+    function_factory.load_mods(str(ModuleConfig), Reload=True)
+
+    for Name in Names:
+        sys.modules.pop(Name, None)
+
+
+class MSPServer:
+    """WSGI and ASGI server set up with one registered client"""
+
+    def __init__(self, KeyStore: client.KeyStorage):
+        self.KeyStore = KeyStore
+        self.App = Flask(__name__)
+
+    def post(self, Path: str, Body: bytes, Headers: dict[str, str], **Options):
+        """Send a request to the WSGI app, returns the Flask test response"""
+        return self.App.test_client().post(Path, data=Body, headers=Headers, **Options)
+
+    def request(self, RemoteMethod: str | list[str], Binary: bool = False):
+        """Send a v2 request for a function or a batch of functions"""
+        if Binary:
+            return self.post(
+                "/v2/",
+                client.prepare_binary_envelope(self.KeyStore, RemoteMethod),
+                {
+                    "Content-Type": sec_server.FRAME_MIMETYPE,
+                    "Accept": sec_server.FRAME_MIMETYPE,
+                },
+            )
+
+        Payload = (
+            client.prepare_envelope(self.KeyStore, RemoteMethod)
+            if isinstance(RemoteMethod, str)
+            else client.prepare_batch_envelope(self.KeyStore, RemoteMethod)
+        )
+
+        return self.post(
+            "/v2/", json.dumps(Payload).encode(), {"Content-Type": "application/json"}
+        )
+
+    def decrypt(self, ContentType: str, Body: bytes) -> str:
+        """Decrypt a single message or a streamed response"""
+        if ContentType.startswith(sec_server.FRAME_STREAM_MIMETYPE):
+            Frames = client.split_frames([Body])
+
+        elif ContentType.startswith(sec_server.STREAM_MIMETYPE):
+            Frames = client.decode_lines(Body.splitlines())
+
+        elif ContentType.startswith(sec_server.FRAME_MIMETYPE):
+            return client.decrypt_binary_awnser(Body, self.KeyStore)
+
+        else:
+            return client.decrypt_awnser(json.loads(Body)["value"], self.KeyStore)
+
+        return b"".join(client.decrypt_stream(Frames, self.KeyStore)).decode("utf-8")
+
+    def call(self, RemoteMethod: str | list[str], Binary: bool = False):
+        """Call over WSGI, returns the status and the decrypted response"""
+        Response = self.request(RemoteMethod, Binary)
+
+        return Response.status_code, self.decrypt(Response.content_type, Response.data)
+
+    def asgi(
+        self,
+        Path: str,
+        Body: bytes = b"",
+        Headers: dict[str, str] | None = None,
+        Method: str = "POST",
+        RemoteAddr: str = "127.0.0.1",
+    ) -> tuple[int, dict[str, str], bytes]:
+        """Send a request to the ASGI app, returns status, headers and body"""
+        Scope = {
+            "type": "http",
+            "method": Method,
+            "path": Path,
+            "headers": [
+                (Key.lower().encode("latin-1"), Val.encode("latin-1"))
+                for Key, Val in (Headers or {}).items()
+            ],
+            "client": (RemoteAddr, 50000),
+        }
+        Messages: list[dict] = []
+
+        async def receive() -> dict:
+            return {"type": "http.request", "body": Body, "more_body": False}
+
+        async def send(Message: dict):
+            Messages.append(Message)
+
+        asyncio.run(asgi.app(Scope, receive, send))
+
+        return (
+            Messages[0]["status"],
+            {
+                Key.decode("latin-1"): Val.decode("latin-1")
+                for Key, Val in Messages[0]["headers"]
+            },
+            b"".join(Message.get("body", b"") for Message in Messages[1:]),
+        )
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch, load_settings, load_modules):
+    """Start the server with modules, options and settings of a test"""
+    Sec = tmp_path / "sec"
+    Sec.mkdir()
+    (Sec / "server.key").write_text(base64.b64encode(bytes(SERVER_KEY)).decode())
+    ClientSK = PrivateKey.generate()
+    Keystore = str(Sec / "clients.db")
+    _, Secret = keystore.add_client(Keystore, bytes(ClientSK.public_key))
+    monkeypatch.setattr(
+        mini_share_point, "__moduleConfig", str(tmp_path / "modules.ini")
+    )
+
+    def start(
+        Modules: dict[str, str], Options: str = "", Settings: str = ""
+    ) -> MSPServer:
+        # no watchers unless a test sets them
+        Config = configparser.ConfigParser()
+        Config.read_dict(
+            {
+                "Server": {"Keypath": str(Sec), "WatchInterval": "0"},
+                "Clients": {
+                    "Keypath": str(Sec),
+                    "Register": str(Sec / "clients.dev"),
+                    "Keystore": Keystore,
+                    "WatchInterval": "0",
+                },
+                "Modules": {"WatchInterval": "0"},
+            }
+        )
+        Config.read_string(textwrap.dedent(Settings))
+        Text = io.StringIO()
+        Config.write(Text)
+
+        assert load_settings(Text.getvalue())
+        assert load_modules(Modules, Options)
+
+        Server = MSPServer(client.KeyStorage(Secret, ClientSK, SERVER_KEY.public_key))
+        assert mini_share_point.setup_server(Server.App)
+
+        return Server
+
+    yield start
+
+    sec_server.setup_replay_cache(0)
+    data.setup_rate_limit()
+    data.IPTable.clear()
+    metrics.setup_metrics(False, "")
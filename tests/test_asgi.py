@@ -0,0 +1,165 @@
+import json
+import threading
+
+import pytest
+
+import client
+from mini_share_point import data, sec_server
+
+ASGI_MODULES = {
+    "asgi_text": """
+        def entry_call():
+            return "text"
+        """,
+    "asgi_async": """
+        async def entry_call():
+            return "async"
+        """,
+    "asgi_stream": """
+        def entry_call():
+            yield "a"
+            yield "b"
+        """,
+    "asgi_async_stream": """
+        async def entry_call():
+            yield "a"
+            yield "b"
+        """,
+    "asgi_slow": """
+        import time
+
+        def entry_call():
+            time.sleep(0.5)
+            return "late"
+        """,
+    "asgi_invalid": """
+        def entry_call():
+            return None
+        """,
+}
+ASGI_OPTIONS = "[module:asgi_slow]\nExecutor=thread\nTimeout=0.1\n"
+JSON = {"Content-Type": "application/json"}
+FRAME = {"Content-Type": sec_server.FRAME_MIMETYPE, "Accept": sec_server.FRAME_MIMETYPE}
+
+
+def send_both(Server, Path: str, make_body, Headers: dict[str, str]) -> list:
+    """Send the same request to both apps, every request needs its own envelope"""
+    Wsgi = Server.post(Path, make_body(), Headers)
+    Status, AsgiHeaders, Body = Server.asgi(Path, make_body(), Headers)
+
+    return [
+        (Wsgi.status_code, Wsgi.content_type, Wsgi.data),
+        (Status, AsgiHeaders.get("content-type", ""), Body),
+    ]
+
+
+@pytest.mark.parametrize(
+    "Name, Expected",
+    [
+        ("asgi_text", (200, "text")),
+        ("asgi_async", (200, "async")),
+        ("asgi_stream", (200, "ab")),
+        ("asgi_async_stream", (200, "ab")),
+        ("asgi_slow", (504, "ERROR: module call timed out")),
+        ("asgi_invalid", (500, "ERROR: module call failed")),
+    ],
+)
+def test_module_responses_match(server, Name, Expected):
+    Server = server(ASGI_MODULES, ASGI_OPTIONS)
+    Requests = [
+        (
+            "/v1/",
+            lambda: json.dumps(client.prepare_payload(Server.KeyStore, Name)).encode(),
+            JSON,
+        ),
+        (
+            "/v2/",
+            lambda: json.dumps(client.prepare_envelope(Server.KeyStore, Name)).encode(),
+            JSON,
+        ),
+        ("/v2/", lambda: client.prepare_binary_envelope(Server.KeyStore, Name), FRAME),
+    ]
+
+    for Path, make_body, Headers in Requests:
+        for Status, ContentType, Body in send_both(Server, Path, make_body, Headers):
+            assert (Status, Server.decrypt(ContentType, Body)) == Expected
+
+
+def test_batch_responses_match(server):
+    Server = server(ASGI_MODULES, ASGI_OPTIONS)
+    Names = ["asgi_text", "asgi_async_stream", "asgi_slow"]
+
+    for Status, ContentType, Body in send_both(
+        Server,
+        "/v2/",
+        lambda: json.dumps(
+            client.prepare_batch_envelope(Server.KeyStore, Names)
+        ).encode(),
+        JSON,
+    ):
+        assert Status == 200
+        assert json.loads(Server.decrypt(ContentType, Body)) == {
+            "asgi_text": "text",
+            "asgi_async_stream": "ab",
+            "asgi_slow": "ERROR: module call timed out",
+        }
+
+
+@pytest.mark.parametrize(
+    "Path, Body, Headers, Status",
+    [
+        ("/v1/", b"{", JSON, 401),
+        ("/v2/", b'{"msg": 1}', JSON, 401),
+        ("/v2/", b"\x08", FRAME, 401),
+        ("/v3/", b"", JSON, 404),
+        ("/v1", b"", JSON, 308),
+        ("/v2", b"", JSON, 308),
+    ],
+)
+def test_error_status_codes_match(server, Path, Body, Headers, Status):
+    Server = server(ASGI_MODULES)
+
+    assert [Res[0] for Res in send_both(Server, Path, lambda: Body, Headers)] == [
+        Status,
+        Status,
+    ]
+
+
+def test_redirect_points_to_the_endpoint(server):
+    Server = server(ASGI_MODULES)
+
+    assert Server.post("/v2", b"", JSON).headers["Location"].endswith("/v2/")
+    assert Server.asgi("/v2", b"", JSON)[1]["location"] == "/v2/"
+
+
+def test_only_post_is_allowed(server):
+    Server = server(ASGI_MODULES)
+
+    assert Server.App.test_client().get("/v2/").status_code == 405
+    assert Server.asgi("/v2/", Method="GET")[0] == 405
+
+
+def test_rate_limit_responses_match(server):
+    Server = server(ASGI_MODULES, Settings="[RateLimit]\nRate=1\nBurst=1\n")
+    Responses = send_both(Server, "/v2/", lambda: b"{", JSON)
+
+    # the failed request took the burst and the fail cost
+    assert [Res[0] for Res in Responses] == [401, 429]
+    assert Server.post("/v2/", b"{", JSON).headers["Retry-After"] == "2"
+    assert Server.asgi("/v2/", b"{", JSON)[1]["retry-after"] == "2"
+
+
+def test_rate_store_is_not_written_on_the_loop(server, monkeypatch):
+    Server = server(ASGI_MODULES)
+    Threads: list[threading.Thread] = []
+
+    def record(*_) -> int:
+        Threads.append(threading.current_thread())
+        return 0
+
+    monkeypatch.setattr(data, "check_rate_limit", record)
+    monkeypatch.setattr(data, "penalize_request_ip", record)
+
+    assert Server.asgi("/v2/", b"{", JSON)[0] == 401
+    assert len(Threads) == 2
+    assert threading.main_thread() not in Threads
@@ -0,0 +1,71 @@
+import json
+import sys
+
+from mini_share_point import function_factory
+
+BATCH_MODULES = {
+    "batch_ok": """
+        Calls = []
+
+        def entry_call():
+            Calls.append(1)
+            return "ok"
+        """,
+    "batch_error": """
+        def entry_call():
+            raise RuntimeError("module failed")
+        """,
+    "batch_slow": """
+        import time
+
+        def entry_call():
+            time.sleep(0.8)
+            return "late"
+        """,
+    "batch_stream": """
+        def entry_call():
+            yield "a"
+            yield b"b"
+        """,
+}
+BATCH_OPTIONS = "[module:batch_slow]\nExecutor=thread\nTimeout=0.1\n"
+
+
+def test_results_are_returned_by_module(load_modules):
+    assert load_modules(BATCH_MODULES, BATCH_OPTIONS)
+
+    assert function_factory.call_modules(
+        ["batch_ok", "batch_error", "batch_slow", "batch_stream", "batch_missing"]
+    ) == {
+        "batch_ok": "ok",
+        "batch_error": "ERROR: module call failed",
+        "batch_slow": "ERROR: module call timed out",
+        "batch_stream": "ab",
+        "batch_missing": "",
+    }
+
+
+def test_duplicate_modules_are_called_once(load_modules):
+    assert load_modules(BATCH_MODULES, BATCH_OPTIONS)
+
+    assert function_factory.call_modules(["batch_ok", "batch_ok"]) == {"batch_ok": "ok"}
+    assert len(sys.modules["batch_ok"].Calls) == 1
+
+
+def test_batch_envelope_is_answered_in_one_message(server):
+    Server = server(BATCH_MODULES, BATCH_OPTIONS)
+
+    for Binary in [False, True]:
+        Status, Response = Server.call(["batch_ok", "batch_stream"], Binary)
+
+        assert Status == 200
+        assert json.loads(Response) == {"batch_ok": "ok", "batch_stream": "ab"}
+
+
+def test_batch_over_max_size_is_rejected(server):
+    Server = server(BATCH_MODULES, BATCH_OPTIONS, "[Clients]\nMaxBatchSize=2\n")
+
+    assert (
+        Server.request(["batch_ok", "batch_error", "batch_stream"]).status_code == 401
+    )
+    assert Server.call(["batch_ok", "batch_error"])[0] == 200
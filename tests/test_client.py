@@ -0,0 +1,47 @@
+import json
+
+import pytest
+import requests
+
+import client
+
+
+def fake_post(monkeypatch, Status: int, Body: bytes):
+    """Answer every request of the client with the given status and body"""
+
+    def post(*_, **__) -> requests.Response:
+        Response = requests.Response()
+        Response.status_code = Status
+        Response._content = Body
+        return Response
+
+    monkeypatch.setattr(client.requests, "post", post)
+
+
+@pytest.mark.parametrize("Status", [401, 429, 500])
+def test_failed_requests_raise(monkeypatch, Status):
+    fake_post(monkeypatch, Status, b"")
+
+    with pytest.raises(client.ClientError, match=str(Status)):
+        client.send_auth("http://msp/v2/", {})
+
+    with pytest.raises(client.ClientError, match=str(Status)):
+        client.send_auth_binary("http://msp/v2/", b"")
+
+    with pytest.raises(client.ClientError, match=str(Status)):
+        client.send_auth_stream("http://msp/v2/", b"")
+
+
+@pytest.mark.parametrize("Status", [200, 504])
+def test_encrypted_messages_are_returned(monkeypatch, Status):
+    fake_post(monkeypatch, Status, json.dumps({"value": "abc"}).encode())
+
+    assert client.send_auth("http://msp/v2/", {}) == "abc"
+
+
+@pytest.mark.parametrize("Body", [b"", b"{", b"{}"])
+def test_missing_message_raises(monkeypatch, Body):
+    fake_post(monkeypatch, 200, Body)
+
+    with pytest.raises(client.ClientError):
+        client.send_auth("http://msp/v2/", {})
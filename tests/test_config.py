@@ -0,0 +1,81 @@
+import logging
+
+import pytest
+
+import mini_share_point
+from mini_share_point import config, sec_server
+
+
+def test_defaults_for_missing_values(load_settings):
+    assert load_settings("")
+    assert config.get_settings() == config.Settings()
+
+
+def test_values_are_parsed(load_settings):
+    assert load_settings(
+        "[Server]\nIPAddressTTL=10\n"
+        "[Clients]\nKeystore=/sec/clients.db\n"
+        "[Metrics]\nEnabled=yes\nAllow=10.0.0.0/8, ::1\n"
+    )
+
+    Settings = config.get_settings()
+
+    assert Settings.IPAddressTTL == 10
+    assert Settings.ClientKeystore == "/sec/clients.db"
+    assert Settings.MetricsEnabled is True
+    assert Settings.MetricsAllow == ("10.0.0.0/8", "::1")
+
+
+@pytest.mark.parametrize(
+    "Text",
+    [
+        "[Server]\nIPAddressTTL=0\n",
+        "[Server]\nIPTableSize=abc\n",
+        "[RateLimit]\nRate=-1\n",
+        "[Metrics]\nEnabled=maybe\n",
+        "[Metrics]\nAllow=10.0.0.300\n",
+        "no section\n",
+    ],
+)
+def test_invalid_values_keep_old_settings(load_settings, Text):
+    assert load_settings("[Server]\nIPAddressTTL=10\n")
+    assert not load_settings(Text)
+    assert config.get_settings().IPAddressTTL == 10
+
+
+def test_missing_file_is_an_error(tmp_path):
+    assert not config.load_config(str(tmp_path / "missing.ini"))
+
+
+def test_reload_reads_the_file_again(load_settings, tmp_path):
+    assert load_settings("[Clients]\nRequestTTL=10\n")
+    (tmp_path / "config.ini").write_text("[Clients]\nRequestTTL=20\n")
+
+    assert config.reload_config()
+    assert config.get_settings().RequestTTL == 20
+
+    (tmp_path / "config.ini").write_text("[Clients]\nRequestTTL=x\n")
+
+    assert not config.reload_config()
+    assert config.get_settings().RequestTTL == 20
+
+
+def test_apply_settings_resizes_box_cache(monkeypatch):
+    Sizes: list[int] = []
+    monkeypatch.setattr(sec_server, "setup_box_cache", Sizes.append)
+
+    mini_share_point.apply_settings(
+        config.Settings(KeyCacheSize=10), config.Settings(KeyCacheSize=20)
+    )
+
+    assert Sizes == [20]
+
+
+def test_apply_settings_warns_about_restart_settings(caplog):
+    with caplog.at_level(logging.WARNING):
+        mini_share_point.apply_settings(
+            config.Settings(), config.Settings(ForwardFor=1, RequestTTL=10)
+        )
+
+    assert "only apply after a restart: ForwardFor" in caplog.text
+    assert "RequestTTL" not in caplog.text
@@ -0,0 +1,109 @@
+import os
+import time
+
+import pytest
+
+from mini_share_point import function_factory
+
+SLEEPING_MODULE = """
+import os
+import time
+
+def entry_call():
+    time.sleep(0.8)
+    return str(os.getpid())
+"""
+
+
+def test_inline_module_runs_in_the_caller(load_modules):
+    assert load_modules({"exec_inline": SLEEPING_MODULE.replace("0.5", "0")})
+
+    assert function_factory.call_module("exec_inline") == str(os.getpid())
+
+
+def test_thread_module_returns_its_result(load_modules):
+    assert load_modules(
+        {"exec_thread": """
+            import threading
+
+            def entry_call():
+                return threading.current_thread().name
+            """},
+        "[module:exec_thread]\nExecutor=thread\n",
+    )
+
+    assert function_factory.call_module("exec_thread").startswith("module")
+
+
+def test_process_module_runs_in_the_pool(load_modules):
+    assert load_modules(
+        {"exec_process": SLEEPING_MODULE.replace("0.5", "0")},
+        "[module:exec_process]\nExecutor=process\n",
+    )
+
+    assert function_factory.call_module("exec_process") != str(os.getpid())
+
+
+@pytest.mark.parametrize("Executor", ["thread", "process"])
+def test_slow_module_times_out(load_modules, Executor):
+    Name = f"exec_slow_{Executor}"
+    assert load_modules(
+        {Name: SLEEPING_MODULE},
+        f"[module:{Name}]\nExecutor={Executor}\nTimeout=0.1\n",
+    )
+
+    with pytest.raises(function_factory.ModuleTimeout):
+        function_factory.call_module(Name)
+
+
+def test_max_concurrent_slot_is_held_until_the_call_finished(load_modules):
+    assert load_modules(
+        {"exec_limit": SLEEPING_MODULE},
+        "[module:exec_limit]\nExecutor=thread\nTimeout=0.1\nMaxConcurrent=1\n",
+    )
+
+    with pytest.raises(function_factory.ModuleTimeout, match="timed out"):
+        function_factory.call_module("exec_limit")
+
+    # the timed out call is still running in the pool
+    with pytest.raises(function_factory.ModuleTimeout, match="too many running"):
+        function_factory.call_module("exec_limit")
+
+    time.sleep(0.8)
+
+    with pytest.raises(function_factory.ModuleTimeout, match="timed out"):
+        function_factory.call_module("exec_limit")
+
+
+@pytest.mark.parametrize(
+    "Options",
+    [
+        "Executor=fiber\n",
+        "Timeout=-1\n",
+        "MaxConcurrent=-1\n",
+        "CacheTTL=-1\n",
+        "Timeout=soon\n",
+    ],
+)
+def test_invalid_options_are_rejected(load_modules, Options):
+    assert not load_modules(
+        {"exec_options": SLEEPING_MODULE}, "[module:exec_options]\n" + Options
+    )
+
+
+def test_process_pool_is_shared_by_server_workers(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    monkeypatch.setattr(function_factory, "__ProcessPoolSize", 0)
+
+    monkeypatch.setattr(function_factory, "__ServerWorkers", 1)
+    assert function_factory.get_process_pool_size() == 8
+
+    monkeypatch.setattr(function_factory, "__ServerWorkers", 4)
+    assert function_factory.get_process_pool_size() == 2
+
+    # 2 * cores + 1 workers
+    monkeypatch.setattr(function_factory, "__ServerWorkers", 17)
+    assert function_factory.get_process_pool_size() == 1
+
+    monkeypatch.setattr(function_factory, "__ProcessPoolSize", 3)
+    assert function_factory.get_process_pool_size() == 3
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from mini_share_point import sec_server
+
+
+def make_request(KeyID: bytes, Envelope: bytes) -> bytes:
+    return bytes([len(KeyID)]) + KeyID + sec_server.pack_frame(Envelope)
+
+
+def test_request_round_trip():
+    KeyID = os.urandom(8)
+    Envelope = os.urandom(200)
+
+    assert sec_server.unpack_request_frame(make_request(KeyID, Envelope)) == (
+        Envelope,
+        KeyID.hex(),
+    )
+
+
+def test_request_without_key_id():
+    assert sec_server.unpack_request_frame(make_request(b"", b"envelope")) == (
+        b"envelope",
+        "",
+    )
+
+
+def test_empty_envelope():
+    assert sec_server.unpack_request_frame(make_request(b"\x01", b"")) == (b"", "01")
+
+
+def test_longest_key_id():
+    KeyID = os.urandom(255)
+
+    assert sec_server.unpack_request_frame(make_request(KeyID, b"x")) == (
+        b"x",
+        KeyID.hex(),
+    )
+
+
+@pytest.mark.parametrize(
+    "Body",
+    [
+        b"",
+        # key ID longer than the body
+        b"\x08\x00\x01",
+        # no room for the envelope length
+        b"\x02ab\x00\x00\x00",
+        b"\x00\x00\x00\x00",
+    ],
+)
+def test_truncated_requests(Body):
+    assert sec_server.unpack_request_frame(Body) is None
+
+
+def test_envelope_length_has_to_match():
+    Request = make_request(b"key", b"envelope")
+
+    assert sec_server.unpack_request_frame(Request[:-1]) is None
+    assert sec_server.unpack_request_frame(Request + b"x") is None
+
+
+def test_envelope_length_is_not_trusted():
+    Body = b"\x00" + (2**32 - 1).to_bytes(4, "big") + b"short"
+
+    assert sec_server.unpack_request_frame(Body) is None
+
+
+def test_pack_frame_prefixes_length():
+    assert sec_server.pack_frame(b"abc") == b"\x00\x00\x00\x03abc"
+    assert sec_server.pack_frame(b"") == bytes(4)
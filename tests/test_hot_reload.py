@@ -0,0 +1,108 @@
+import dataclasses
+import logging
+import os
+import sys
+import threading
+import time
+
+from mini_share_point import function_factory
+
+
+def version(Number: int) -> str:
+    return f"def entry_call():\n    return 'v{Number}'\n"
+
+
+def touch(Path):
+    """Move the mtime forward, rewrites within a second may keep it"""
+    Stat = os.stat(Path)
+    os.utime(Path, ns=(Stat.st_atime_ns, Stat.st_mtime_ns + 2_000_000_000))
+
+
+def test_changed_module_is_reloaded(load_modules, tmp_path):
+    assert load_modules({"reload_a": version(1), "reload_b": version(1)})
+    Unchanged = sys.modules["reload_b"]
+
+    (tmp_path / "reload_a.py").write_text(version(22))
+    touch(tmp_path / "reload_a.py")
+
+    assert function_factory.load_mods(str(tmp_path / "modules.ini"), Reload=True)
+    assert function_factory.call_module("reload_a") == "v22"
+    assert sys.modules["reload_b"] is Unchanged
+
+
+def test_failed_reload_keeps_the_previous_version(load_modules, tmp_path, caplog):
+    assert load_modules({"reload_fail": version(1)})
+    (tmp_path / "reload_fail.py").write_text("def entry_call(:\n")
+    touch(tmp_path / "reload_fail.py")
+
+    with caplog.at_level(logging.ERROR):
+        assert function_factory.load_mods(str(tmp_path / "modules.ini"), Reload=True)
+        # not retried until the file changes again
+        assert function_factory.load_mods(str(tmp_path / "modules.ini"), Reload=True)
+
+    assert function_factory.call_module("reload_fail") == "v1"
+    assert caplog.text.count("could not be reloaded") == 1
+
+    (tmp_path / "reload_fail.py").write_text(version(333))
+    touch(tmp_path / "reload_fail.py")
+
+    assert function_factory.load_mods(str(tmp_path / "modules.ini"), Reload=True)
+    assert function_factory.call_module("reload_fail") == "v333"
+
+
+def test_removed_module_is_not_found(load_modules):
+    assert load_modules({"reload_kept": version(1), "reload_gone": version(1)})
+    assert load_modules({"reload_kept": version(1)}, Reload=True)
+
+    assert function_factory.call_module("reload_kept") == "v1"
+    assert function_factory.call_module("reload_gone") == ""
+
+
+def test_reload_clears_cached_results(load_modules, tmp_path):
+    assert load_modules(
+        {"reload_cached": version(1)}, "[module:reload_cached]\nCacheTTL=60\n"
+    )
+    assert function_factory.call_module("reload_cached") == "v1"
+
+    (tmp_path / "reload_cached.py").write_text(version(22))
+    touch(tmp_path / "reload_cached.py")
+
+    assert function_factory.load_mods(str(tmp_path / "modules.ini"), Reload=True)
+    assert function_factory.call_module("reload_cached") == "v22"
+
+
+def test_unchanged_limit_keeps_running_calls(load_modules, tmp_path):
+    Options = "[module:reload_limit]\nMaxConcurrent=1\n"
+    assert load_modules({"reload_limit": version(1)}, Options)
+    Semaphore = function_factory.__Modules.Semaphores["reload_limit"]
+
+    assert load_modules({"reload_limit": version(1)}, Options, Reload=True)
+    assert function_factory.__Modules.Semaphores["reload_limit"] is Semaphore
+
+    assert load_modules(
+        {"reload_limit": version(1)}, Options.replace("1", "2"), Reload=True
+    )
+    assert function_factory.__Modules.Semaphores["reload_limit"] is not Semaphore
+
+
+def test_lazy_import_during_reload_goes_to_the_new_registry(load_modules, monkeypatch):
+    assert load_modules({"reload_lazy": version(1)}, "[Import]\nLazy=true\n")
+    Old = function_factory.__Modules
+    ImportLock = function_factory.__ImportLock
+    Results: list = []
+
+    # a reload builds the new registry while holding the import lock
+    with ImportLock:
+        Caller = threading.Thread(
+            target=lambda: Results.append(function_factory.get_module("reload_lazy"))
+        )
+        Caller.start()
+        time.sleep(0.1)
+        New = dataclasses.replace(Old, Mods={}, Paths=dict(Old.Paths))
+        monkeypatch.setattr(function_factory, "__Modules", New)
+
+    Caller.join()
+
+    assert Results[0] is not None
+    assert New.Mods["reload_lazy"] is Results[0]
+    assert "reload_lazy" not in Old.Mods
@@ -0,0 +1,59 @@
+import logging
+
+import pytest
+
+from mini_share_point import data
+
+
+@pytest.fixture(autouse=True)
+def ip_table(monkeypatch, clock, load_settings):
+    monkeypatch.setattr(data, "time", clock)
+    load_settings("[Server]\nIPAddressTTL=60\nIPTableSize=3\n")
+    data.IPTable.clear()
+    yield data.IPTable
+    data.IPTable.clear()
+
+
+def test_new_ip_is_logged_once(caplog):
+    with caplog.at_level(logging.WARNING):
+        data.check_request_ip("10.0.0.1")
+        data.check_request_ip("10.0.0.1")
+
+    assert caplog.text.count("New request from IP: 10.0.0.1") == 1
+
+
+def test_ip_after_ttl_is_a_new_connection(clock, caplog):
+    data.check_request_ip("10.0.0.1")
+    clock.advance(61)
+
+    with caplog.at_level(logging.WARNING):
+        data.check_request_ip("10.0.0.1")
+
+    assert "new connection! IP: 10.0.0.1" in caplog.text
+
+
+def test_expired_ips_are_dropped(ip_table, clock):
+    data.check_request_ip("10.0.0.1")
+    clock.advance(30)
+    data.check_request_ip("10.0.0.2")
+    clock.advance(31)
+    data.check_request_ip("10.0.0.3")
+
+    assert list(ip_table) == ["10.0.0.2", "10.0.0.3"]
+
+
+def test_table_size_drops_oldest(ip_table, clock):
+    for Index in range(5):
+        data.check_request_ip(f"10.0.0.{Index}")
+        clock.advance(1)
+
+    assert list(ip_table) == ["10.0.0.2", "10.0.0.3", "10.0.0.4"]
+
+
+def test_repeated_request_moves_ip_to_the_end(ip_table, clock):
+    for IP in ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.1", "10.0.0.4"]:
+        data.check_request_ip(IP)
+        clock.advance(1)
+
+    assert list(ip_table) == ["10.0.0.3", "10.0.0.1", "10.0.0.4"]
+    assert ip_table["10.0.0.1"] == int(clock.Now - 2)
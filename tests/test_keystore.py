@@ -0,0 +1,120 @@
+import base64
+import logging
+import os
+import sqlite3
+
+import pytest
+
+from mini_share_point import keystore
+
+
+def write_old_layout(Path, Keys: dict[int, bytes], SecretCount: int):
+    """Keyfiles and register as written by append_client before the keystore"""
+    for ClientID, PKBytes in Keys.items():
+        (Path / f"client_{ClientID}.pub").write_text(base64.b64encode(PKBytes).decode())
+
+    (Path / "clients.dev").write_text(
+        "".join(f"secret{Line}\n" for Line in range(1, SecretCount + 1))
+    )
+
+
+def migrate(Path) -> bool:
+    return keystore.open_keystore(
+        str(Path / "clients.db"), str(Path / "clients.dev"), str(Path)
+    )
+
+
+def get_clients(Path) -> dict[int, tuple[bytes, str]]:
+    return {
+        ClientID: (PKBytes, Secret)
+        for ClientID, PKBytes, Secret in keystore.read_clients(str(Path / "clients.db"))
+    }
+
+
+def test_clients_are_added_and_revoked(tmp_path):
+    Keystore = str(tmp_path / "clients.db")
+    Keys = [os.urandom(32) for _ in range(3)]
+
+    Added = keystore.add_clients(Keystore, Keys[:2])
+    ClientID, Secret = keystore.add_client(Keystore, Keys[2])
+
+    assert [ID for ID, _ in Added] == [1, 2] and ClientID == 3
+    assert keystore.read_clients(Keystore)[2] == (3, Keys[2], Secret)
+
+    assert keystore.revoke_client(Keystore, 2)
+    assert not keystore.revoke_client(Keystore, 2)
+    assert [ID for ID, _, _ in keystore.read_clients(Keystore)] == [1, 3]
+
+    # the key of a revoked client stays registered
+    with pytest.raises(sqlite3.IntegrityError):
+        keystore.add_client(Keystore, Keys[1])
+
+    assert keystore.purge_clients(Keystore) == 3
+    assert keystore.read_clients(Keystore) == []
+
+
+def test_failed_add_adds_no_client(tmp_path):
+    Keystore = str(tmp_path / "clients.db")
+    Key = os.urandom(32)
+
+    with pytest.raises(sqlite3.IntegrityError):
+        keystore.add_clients(Keystore, [os.urandom(32), Key, Key])
+
+    with pytest.raises(ValueError):
+        keystore.add_clients(Keystore, [os.urandom(32), b"short"])
+
+    assert keystore.read_clients(Keystore) == []
+
+
+def test_migration_keeps_ids_and_gaps(tmp_path, caplog):
+    Keys = {ID: os.urandom(32) for ID in [1, 3, 4]}
+    write_old_layout(tmp_path, Keys, 5)
+
+    with caplog.at_level(logging.ERROR):
+        assert migrate(tmp_path)
+
+    assert get_clients(tmp_path) == {ID: (Keys[ID], f"secret{ID}") for ID in Keys}
+    assert "register lines 2, 5" in caplog.text
+
+    # new clients do not reuse the IDs of the old layout
+    assert keystore.add_client(str(tmp_path / "clients.db"), os.urandom(32))[0] == 5
+
+
+def test_migration_skips_duplicate_keys(tmp_path, caplog):
+    Key = os.urandom(32)
+    Keys = {1: os.urandom(32), 2: Key, 3: os.urandom(32), 4: Key}
+    write_old_layout(tmp_path, Keys, 4)
+
+    with caplog.at_level(logging.ERROR):
+        assert migrate(tmp_path)
+
+    assert get_clients(tmp_path) == {ID: (Keys[ID], f"secret{ID}") for ID in [1, 2, 3]}
+    assert "Client 4 has the same public key as client 2" in caplog.text
+
+
+def test_migration_binds_overwritten_keyfile(tmp_path):
+    Keys = {ID: os.urandom(32) for ID in range(1, 11)}
+    write_old_layout(tmp_path, Keys, 12)
+
+    assert migrate(tmp_path)
+
+    Clients = get_clients(tmp_path)
+
+    assert Clients[9] == (Keys[9], "secret9")
+    assert Clients[10] == (Keys[10], "secret12")
+
+
+def test_migration_runs_once(tmp_path):
+    write_old_layout(tmp_path, {1: os.urandom(32)}, 1)
+    assert migrate(tmp_path)
+
+    write_old_layout(tmp_path, {2: os.urandom(32)}, 2)
+    assert migrate(tmp_path)
+
+    assert list(get_clients(tmp_path)) == [1]
+    assert [File.name for File in tmp_path.iterdir() if File.suffix == ".tmp"] == []
+
+
+def test_empty_old_layout_creates_empty_keystore(tmp_path):
+    assert migrate(tmp_path)
+    assert get_clients(tmp_path) == {}
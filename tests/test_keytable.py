@@ -0,0 +1,146 @@
+import os
+
+import pytest
+
+from mini_share_point import keytable, util
+
+
+def make_clients(Count: int) -> list[tuple[int, bytes, str]]:
+    return [
+        (ClientID, os.urandom(keytable.KEY_SIZE), f"secret-{ClientID}-ä")
+        for ClientID in range(1, Count + 1)
+    ]
+
+
+def test_pack_open_round_trip():
+    Clients = make_clients(50)
+    Table = keytable.KeyTable(keytable.pack_clients(Clients))
+
+    assert len(Table) == 50
+    assert list(Table.iter_keys()) == [PKBytes for _, PKBytes, _ in Clients]
+
+    for ClientID, PKBytes, Secret in Clients:
+        Index = Table.find_key(PKBytes)
+
+        assert Table.get_key(Index) == PKBytes
+        assert Table.get_id(Index) == ClientID
+        assert Table.get_secret(Index) == Secret
+        assert Table.find_key_id(util.key_fingerprint(PKBytes)) == Index
+
+
+def test_empty_table():
+    Table = keytable.KeyTable(keytable.pack_clients([]))
+
+    assert len(Table) == 0
+    assert Table.find_key(os.urandom(keytable.KEY_SIZE)) == -1
+    assert list(Table.iter_keys()) == []
+
+
+def test_unknown_keys_are_not_found():
+    Table = keytable.KeyTable(keytable.pack_clients(make_clients(10)))
+    Unknown = os.urandom(keytable.KEY_SIZE)
+
+    assert Table.find_key(Unknown) == -1
+    assert Table.find_key_id(util.key_fingerprint(Unknown)) == -1
+
+
+@pytest.mark.parametrize(
+    "KeyID", ["", "xyz", "0", "00ff", "0" * 17, " " + "0" * 15, "0X" + "0" * 14, None]
+)
+def test_malformed_key_ids(KeyID):
+    Table = keytable.KeyTable(keytable.pack_clients(make_clients(10)))
+
+    assert Table.find_key_id(KeyID) == -1
+
+
+def test_key_id_only_in_exact_format():
+    Clients = make_clients(1)
+    Table = keytable.KeyTable(keytable.pack_clients(Clients))
+    KeyID = util.key_fingerprint(Clients[0][1])
+
+    assert Table.find_key_id(KeyID) == 0
+    assert Table.find_key_id("0" + KeyID) == -1
+
+    if KeyID != KeyID.upper():
+        assert Table.find_key_id(KeyID.upper()) == -1
+
+
+def test_truncated_tables_are_rejected():
+    Packed = keytable.pack_clients(make_clients(5))
+
+    for Size in [
+        0,
+        keytable.HEADER.size - 1,
+        keytable.HEADER.size + 1,
+        len(Packed) - 1,
+    ]:
+        with pytest.raises(ValueError):
+            keytable.KeyTable(Packed[:Size])
+
+
+def test_other_formats_are_rejected():
+    Packed = keytable.pack_clients(make_clients(2))
+    Size = len(keytable.MAGIC)
+
+    with pytest.raises(ValueError):
+        keytable.KeyTable(b"XXXX" + Packed[Size:])
+
+    with pytest.raises(ValueError):
+        keytable.KeyTable(
+            Packed[:Size]
+            + (keytable.VERSION + 1).to_bytes(4, "little")
+            + Packed[Size + 4 :]
+        )
+
+
+def test_snapshot_round_trip(tmp_path):
+    Snapshot = str(tmp_path / "clients.snapshot")
+    Signature = os.urandom(16)
+    Clients = make_clients(20)
+
+    keytable.write_snapshot(Snapshot, keytable.pack_clients(Clients, Signature))
+    Table = keytable.open_snapshot(Snapshot, Signature)
+
+    assert Table is not None
+    assert Table.Signature == Signature
+    assert [Table.get_secret(Index) for Index in range(len(Table))] == [
+        Secret for _, _, Secret in Clients
+    ]
+
+
+def test_snapshot_of_other_sources_is_ignored(tmp_path):
+    Snapshot = str(tmp_path / "clients.snapshot")
+    keytable.write_snapshot(Snapshot, keytable.pack_clients(make_clients(3), bytes(16)))
+
+    assert keytable.open_snapshot(Snapshot, os.urandom(16)) is None
+
+
+def test_missing_or_broken_snapshots_are_ignored(tmp_path):
+    Snapshot = str(tmp_path / "clients.snapshot")
+
+    assert keytable.open_snapshot(Snapshot, bytes(16)) is None
+
+    # empty files can not be mapped
+    open(Snapshot, "wb").close()
+    assert keytable.open_snapshot(Snapshot, bytes(16)) is None
+
+    Packed = keytable.pack_clients(make_clients(3), bytes(16))
+
+    with open(Snapshot, "wb") as File:
+        File.write(Packed[:-1])
+
+    assert keytable.open_snapshot(Snapshot, bytes(16)) is None
+
+
+def test_signature_follows_source_files(tmp_path):
+    Source = tmp_path / "clients.db"
+    Files = [str(Source), str(tmp_path / "missing.pub")]
+
+    Missing = keytable.get_signature(Files)
+    Source.write_bytes(b"a")
+    Written = keytable.get_signature(Files)
+    Source.write_bytes(b"ab")
+
+    assert Missing != Written
+    assert keytable.get_signature(Files) != Written
+    assert keytable.get_signature(Files) == keytable.get_signature(Files[::-1])
@@ -0,0 +1,93 @@
+import concurrent.futures
+import logging
+import sys
+
+from mini_share_point import function_factory
+
+WARM_MODULE = """
+import time
+
+Imports = []
+Warmed = []
+Imports.append(1)
+time.sleep(0.1)
+
+def warm_up():
+    Warmed.append(1)
+
+def entry_call():
+    return "ok"
+"""
+
+
+def test_lazy_module_is_imported_on_first_call(load_modules):
+    assert load_modules({"lazy_warm": WARM_MODULE}, "[module:lazy_warm]\nLazy=true\n")
+    assert "lazy_warm" not in sys.modules
+
+    assert function_factory.call_module("lazy_warm") == "ok"
+    assert function_factory.call_module("lazy_warm") == "ok"
+    assert sys.modules["lazy_warm"].Warmed == [1]
+
+
+def test_eager_module_is_warmed_at_load(load_modules):
+    assert load_modules({"eager_warm": WARM_MODULE})
+
+    assert sys.modules["eager_warm"].Warmed == [1]
+
+
+def test_module_option_overrides_the_default(load_modules):
+    assert load_modules(
+        {"lazy_default": WARM_MODULE, "lazy_eager": WARM_MODULE},
+        "[Import]\nLazy=true\n[module:lazy_eager]\nLazy=false\n",
+    )
+
+    assert "lazy_default" not in sys.modules
+    assert "lazy_eager" in sys.modules
+
+
+def test_concurrent_first_calls_import_once(load_modules):
+    assert load_modules({"lazy_once": WARM_MODULE}, "[Import]\nLazy=true\n")
+
+    with concurrent.futures.ThreadPoolExecutor(8) as Pool:
+        Results = list(
+            Pool.map(lambda _: function_factory.call_module("lazy_once"), range(8))
+        )
+
+    assert Results == ["ok"] * 8
+    assert sys.modules["lazy_once"].Imports == [1]
+    assert sys.modules["lazy_once"].Warmed == [1]
+
+
+def test_failed_lazy_import_is_not_retried(load_modules, caplog):
+    assert load_modules(
+        {"lazy_broken": "raise RuntimeError('broken')\n"}, "[Import]\nLazy=true\n"
+    )
+
+    with caplog.at_level(logging.ERROR):
+        assert function_factory.call_module("lazy_broken") == ""
+        assert function_factory.call_module("lazy_broken") == ""
+
+    assert caplog.text.count("could not be initialized") == 1
+
+
+def test_failed_warm_up_is_not_registered(load_modules):
+    assert load_modules(
+        {"eager_broken": "def warm_up():\n    raise RuntimeError('no data')\n"}
+    )
+
+    assert function_factory.call_module("eager_broken") == ""
+    # imported again on the next try
+    assert "eager_broken" not in sys.modules
+
+
+def test_import_report_lists_every_module(load_modules, caplog):
+    with caplog.at_level(logging.INFO):
+        assert load_modules(
+            {"report_eager": WARM_MODULE, "report_lazy": WARM_MODULE},
+            "[module:report_lazy]\nLazy=true\n",
+        )
+
+    Report = next(R.message for R in caplog.records if "Module imports" in R.message)
+
+    assert "report_eager" in Report and "eager" in Report
+    assert "report_lazy" in Report and "lazy" in Report
@@ -0,0 +1,160 @@
+import json
+import os
+
+import pytest
+
+from mini_share_point import metrics
+
+DEAD_PID = 2**22 + 1
+
+
+@pytest.fixture
+def metrics_dir(monkeypatch, tmp_path):
+    """Metrics of this test only, merged through a shared directory"""
+    monkeypatch.setattr(metrics, "__Counters", {})
+    monkeypatch.setattr(metrics, "__Histograms", {})
+    monkeypatch.setattr(metrics, "__Gauges", {})
+    metrics.setup_metrics(True, str(tmp_path), ("10.0.0.0/8", "::1"))
+    yield tmp_path
+    metrics.setup_metrics(False, "")
+
+
+def write_worker(Directory, PID: int, Snapshot: dict):
+    """Metrics file of another worker of this server"""
+    (Directory / f"{os.getppid()}_{PID}.json").write_text(json.dumps(Snapshot))
+
+
+def test_counters_and_histograms_are_rendered(metrics_dir):
+    metrics.inc("msp_throttled_total")
+    metrics.inc("msp_throttled_total", 2)
+    metrics.observe("msp_module_seconds", 0.3, module="a")
+    metrics.observe("msp_module_seconds", 20, module="a")
+
+    Lines = metrics.render().splitlines()
+
+    assert "msp_throttled_total 3" in Lines
+    assert 'msp_module_seconds_bucket{module="a",le="0.25"} 0' in Lines
+    assert 'msp_module_seconds_bucket{module="a",le="0.5"} 1' in Lines
+    assert 'msp_module_seconds_bucket{module="a",le="+Inf"} 2' in Lines
+    assert 'msp_module_seconds_count{module="a"} 2' in Lines
+    assert 'msp_module_seconds_sum{module="a"} 20.3' in Lines
+
+
+def test_workers_are_merged(metrics_dir):
+    metrics.inc("msp_throttled_total")
+    metrics.observe("msp_keys_tried", 1, Bounds=(1, 2))
+    metrics.register_gauge("msp_clients", lambda: 5)
+
+    # a running and a stopped worker
+    for PID in [os.getppid(), DEAD_PID]:
+        write_worker(
+            metrics_dir,
+            PID,
+            {
+                "counters": [["msp_throttled_total", [], 2]],
+                "histograms": [["msp_keys_tried", [], [1, 2], [0, 1, 0], 2.0]],
+                "gauges": [["msp_clients", [], 7]],
+            },
+        )
+
+    Lines = metrics.render().splitlines()
+
+    assert "msp_throttled_total 5" in Lines
+    assert 'msp_keys_tried_bucket{le="1"} 1' in Lines
+    assert 'msp_keys_tried_bucket{le="2"} 3' in Lines
+    assert "msp_keys_tried_sum 5.0" in Lines
+    # gauges are only shown for running workers
+    assert f'msp_clients{{pid="{os.getpid()}"}} 5.0' in Lines
+    assert f'msp_clients{{pid="{os.getppid()}"}} 7' in Lines
+    assert f'pid="{DEAD_PID}"' not in "\n".join(Lines)
+
+
+def test_histograms_with_other_bounds_are_skipped(metrics_dir):
+    metrics.observe("msp_keys_tried", 1, Bounds=(1, 2))
+    write_worker(
+        metrics_dir,
+        DEAD_PID,
+        {
+            "counters": [],
+            "histograms": [["msp_keys_tried", [], [1, 4], [5, 0, 0], 5.0]],
+            "gauges": [],
+        },
+    )
+
+    assert "msp_keys_tried_count 1" in metrics.render().splitlines()
+
+
+def test_flush_writes_the_own_snapshot(metrics_dir):
+    metrics.flush()
+    assert list(metrics_dir.iterdir()) == []
+
+    metrics.inc("msp_throttled_total")
+    metrics.flush()
+
+    Snapshot = json.loads(
+        (metrics_dir / f"{os.getppid()}_{os.getpid()}.json").read_text()
+    )
+
+    assert Snapshot["counters"] == [["msp_throttled_total", [], 1]]
+    # the own file is not merged a second time
+    assert len(metrics.read_snapshots()) == 1
+
+
+def test_files_of_stopped_servers_are_removed(metrics_dir):
+    (metrics_dir / f"{DEAD_PID}_1.json").write_text("{}")
+    (metrics_dir / f"{os.getppid()}_1.json").write_text("{}")
+
+    metrics.setup_metrics(True, str(metrics_dir))
+
+    assert [File.name for File in metrics_dir.iterdir()] == [f"{os.getppid()}_1.json"]
+
+
+def test_render_is_reused_for_the_interval(metrics_dir, monkeypatch, clock):
+    monkeypatch.setattr(metrics, "time", clock)
+    metrics.setup_metrics(True, str(metrics_dir), RenderInterval=5)
+    metrics.inc("msp_throttled_total")
+    Text = metrics.render_cached()
+
+    metrics.inc("msp_throttled_total")
+    clock.advance(4)
+    assert metrics.render_cached() == Text
+
+    clock.advance(2)
+    assert "msp_throttled_total 2" in metrics.render_cached()
+
+
+@pytest.mark.parametrize(
+    "RemoteAddr, Allowed",
+    [
+        ("10.1.2.3", True),
+        ("::1", True),
+        ("::ffff:10.1.2.3", True),
+        ("11.0.0.1", False),
+        ("::2", False),
+        ("", False),
+        ("localhost", False),
+    ],
+)
+def test_scraper_allow_list(metrics_dir, RemoteAddr, Allowed):
+    assert metrics.check_scraper(RemoteAddr) == Allowed
+
+
+def test_metrics_endpoint_is_only_served_to_scrapers(server):
+    Server = server({}, Settings="[Metrics]\nEnabled=true\nAllow=10.0.0.0/8\n")
+
+    Response = Server.App.test_client().get(
+        "/metrics", environ_base={"REMOTE_ADDR": "10.0.0.1"}
+    )
+    Status, Headers, Body = Server.asgi("/metrics", Method="GET", RemoteAddr="10.0.0.1")
+
+    assert Response.status_code == Status == 200
+    assert Response.content_type == Headers["content-type"]
+    assert "# TYPE msp_stage_seconds histogram" in Body.decode()
+
+    # module names and client counts are not shown to other addresses
+    Response = Server.App.test_client().get(
+        "/metrics", environ_base={"REMOTE_ADDR": "127.0.0.1"}
+    )
+
+    assert Response.status_code == 404
+    assert Server.asgi("/metrics", Method="GET")[0] == 404
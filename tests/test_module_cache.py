@@ -0,0 +1,143 @@
+import concurrent.futures
+import sys
+
+import pytest
+
+from mini_share_point import function_factory
+
+COUNTING_MODULE = """
+import time
+
+Calls = []
+
+def entry_call():
+    Calls.append(1)
+    time.sleep(0.2)
+    return f"call {len(Calls)}"
+"""
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    function_factory.clear_results()
+    yield
+    function_factory.clear_results()
+
+
+def test_result_is_cached_for_ttl(load_modules, monkeypatch, clock):
+    monkeypatch.setattr(function_factory, "time", clock)
+    assert load_modules(
+        {"cache_count": COUNTING_MODULE}, "[module:cache_count]\nCacheTTL=10\n"
+    )
+
+    assert function_factory.call_module("cache_count") == "call 1"
+    clock.advance(9)
+    assert function_factory.call_module("cache_count") == "call 1"
+    clock.advance(2)
+    assert function_factory.call_module("cache_count") == "call 2"
+
+
+def test_uncached_module_is_called_every_time(load_modules):
+    assert load_modules({"cache_none": COUNTING_MODULE})
+
+    assert function_factory.call_module("cache_none") == "call 1"
+    assert function_factory.call_module("cache_none") == "call 2"
+
+
+def test_concurrent_misses_call_once(load_modules):
+    assert load_modules(
+        {"cache_flight": COUNTING_MODULE}, "[module:cache_flight]\nCacheTTL=10\n"
+    )
+
+    with concurrent.futures.ThreadPoolExecutor(8) as Pool:
+        Results = list(
+            Pool.map(lambda _: function_factory.call_module("cache_flight"), range(8))
+        )
+
+    assert Results == ["call 1"] * 8
+    assert len(sys.modules["cache_flight"].Calls) == 1
+
+
+def test_errors_reach_all_callers_and_are_not_cached(load_modules):
+    assert load_modules(
+        {"cache_error": """
+            import time
+
+            Calls = []
+
+            def entry_call():
+                Calls.append(1)
+                time.sleep(0.2)
+                raise RuntimeError("module failed")
+            """},
+        "[module:cache_error]\nCacheTTL=10\n",
+    )
+
+    def call(_) -> str:
+        try:
+            return function_factory.call_module("cache_error")
+
+        except RuntimeError as e:
+            return str(e)
+
+    with concurrent.futures.ThreadPoolExecutor(4) as Pool:
+        assert list(Pool.map(call, range(4))) == ["module failed"] * 4
+
+    assert len(sys.modules["cache_error"].Calls) == 1
+    assert call(None) == "module failed"
+    assert len(sys.modules["cache_error"].Calls) == 2
+
+
+def test_results_over_cache_size_are_not_cached(load_modules):
+    assert load_modules(
+        {"cache_big": COUNTING_MODULE.replace('f"call', '"x" * 20 + f"call')},
+        "[module:cache_big]\nCacheTTL=10\n[Cache]\nMaxSize=10\n",
+    )
+
+    assert function_factory.call_module("cache_big").endswith("call 1")
+    assert function_factory.call_module("cache_big").endswith("call 2")
+
+
+def test_least_recently_used_result_is_evicted(load_modules):
+    assert load_modules(
+        {
+            "cache_a": COUNTING_MODULE,
+            "cache_b": COUNTING_MODULE,
+            "cache_c": COUNTING_MODULE,
+        },
+        """
+        [module:cache_a]
+        CacheTTL=10
+        [module:cache_b]
+        CacheTTL=10
+        [module:cache_c]
+        CacheTTL=10
+        [Cache]
+        MaxSize=12
+        """,
+    )
+
+    for Module in ["cache_a", "cache_b", "cache_a", "cache_c"]:
+        function_factory.call_module(Module)
+
+    # b was used least recently when c did not fit next to a and b
+    assert function_factory.call_module("cache_a") == "call 1"
+    assert function_factory.call_module("cache_b") == "call 2"
+
+
+def test_streamed_results_are_not_cached(load_modules):
+    assert load_modules(
+        {"cache_stream": """
+            Calls = []
+
+            def entry_call():
+                Calls.append(1)
+                yield "a"
+                yield "b"
+            """},
+        "[module:cache_stream]\nCacheTTL=10\n",
+    )
+
+    assert list(function_factory.call_module("cache_stream")) == ["a", "b"]
+    assert list(function_factory.call_module("cache_stream")) == ["a", "b"]
+    assert len(sys.modules["cache_stream"].Calls) == 2
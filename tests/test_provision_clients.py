@@ -0,0 +1,154 @@
+import base64
+import json
+import os
+import sqlite3
+import stat
+import subprocess
+import sys
+
+from nacl.public import PrivateKey
+import pytest
+
+# the script imports its neighbours like append_client does
+PackageDir = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "mini_share_point"
+)
+sys.path.insert(0, PackageDir)
+
+import keystore  # noqa: E402
+import provision_clients  # noqa: E402
+
+
+def new_key() -> str:
+    return base64.b64encode(bytes(PrivateKey.generate().public_key)).decode()
+
+
+def provision(tmp_path, Entries: list[dict]) -> list[dict]:
+    return provision_clients.provision_clients(
+        Entries,
+        str(tmp_path / "clients.db"),
+        str(tmp_path / "clients.dev"),
+        str(tmp_path),
+    )
+
+
+def test_csv_with_header_keeps_other_columns():
+    Key = new_key()
+
+    assert provision_clients.read_csv(["name,public_key\n", f"dev1,{Key}\n"]) == [
+        {"name": "dev1", "public_key": Key}
+    ]
+    assert provision_clients.read_csv([f"{Key},ignored\n", "\n"]) == [
+        {"public_key": Key}
+    ]
+
+
+def test_format_is_detected(tmp_path):
+    Key = new_key()
+    (tmp_path / "keys.jsonl").write_text(
+        json.dumps({"public_key": Key, "name": "dev1"}) + "\n\n"
+    )
+    (tmp_path / "keys.csv").write_text(f"public_key\n{Key}\n")
+
+    assert provision_clients.read_clients(str(tmp_path / "keys.jsonl"), "") == [
+        {"public_key": Key, "name": "dev1"}
+    ]
+    assert provision_clients.read_clients(str(tmp_path / "keys.csv"), "") == [
+        {"public_key": Key}
+    ]
+
+    with pytest.raises(ValueError):
+        provision_clients.read_jsonl(["[1, 2]\n"])
+
+
+def test_clients_are_registered_with_their_fields(tmp_path):
+    Keys = [new_key() for _ in range(3)]
+
+    Clients = provision(tmp_path, [{"public_key": Key, "name": Key} for Key in Keys])
+
+    assert [Client["id"] for Client in Clients] == [1, 2, 3]
+    assert all(Client["name"] == Client["public_key"] for Client in Clients)
+    assert keystore.read_clients(str(tmp_path / "clients.db")) == [
+        (Client["id"], base64.b64decode(Client["public_key"]), Client["secret"])
+        for Client in Clients
+    ]
+
+
+@pytest.mark.parametrize(
+    "Entry, Error",
+    [
+        ({"public_key": "abc"}, "Client 2: public key not a base64-string"),
+        ({"public_key": "YWJj"}, "Client 2: public key not 32 bytes"),
+        ({"name": "no key"}, "Client 2: public key not 32 bytes"),
+        ({}, "Client 2: public key is listed twice"),
+    ],
+)
+def test_invalid_input_registers_nothing(tmp_path, Entry, Error):
+    Key = new_key()
+    # an empty entry repeats the first key
+    Entries = [{"public_key": Key}, Entry if Entry != {} else {"public_key": Key}]
+
+    with pytest.raises(ValueError, match=Error):
+        provision(tmp_path, Entries)
+
+    assert not (tmp_path / "clients.db").exists()
+
+
+def test_registered_key_adds_no_client(tmp_path):
+    Key = new_key()
+    provision(tmp_path, [{"public_key": Key}])
+
+    with pytest.raises(sqlite3.IntegrityError):
+        provision(tmp_path, [{"public_key": new_key()}, {"public_key": Key}])
+
+    assert len(keystore.read_clients(str(tmp_path / "clients.db"))) == 1
+
+
+def test_bundle_is_private_and_never_overwritten(tmp_path):
+    Path = str(tmp_path / "bundle.json")
+    Bundle = provision_clients.open_bundle(Path)
+    provision_clients.write_bundle(Bundle, [{"id": 1}], "server")
+    Bundle.close()
+
+    assert stat.S_IMODE(os.stat(Path).st_mode) == 0o600
+
+    with pytest.raises(FileExistsError):
+        provision_clients.open_bundle(Path)
+
+    assert json.loads((tmp_path / "bundle.json").read_text())["clients"] == [{"id": 1}]
+
+
+def test_generated_clients_are_written_to_the_bundle(tmp_path):
+    (tmp_path / "server.pub").write_text("server-key\n")
+    (tmp_path / "config.ini").write_text(
+        f"[Server]\nKeypath={tmp_path}\n"
+        f"[Clients]\nKeypath={tmp_path}\nRegister={tmp_path}/clients.dev\n"
+        f"Keystore={tmp_path}/clients.db\n"
+    )
+
+    def run(*Args: str) -> int:
+        return subprocess.run(
+            [sys.executable, os.path.join(PackageDir, "provision_clients.py"), *Args],
+            env={**os.environ, "MSP_CONFIG_PATH": str(tmp_path / "config.ini")},
+            capture_output=True,
+        ).returncode
+
+    assert run("--generate", "3", "--output", str(tmp_path / "bundle.json")) == 0
+
+    Bundle = json.loads((tmp_path / "bundle.json").read_text())
+    Registered = keystore.read_clients(str(tmp_path / "clients.db"))
+
+    assert Bundle["server_public_key"] == "server-key"
+    assert [
+        (
+            Client["id"],
+            bytes(PrivateKey(base64.b64decode(Client["private_key"])).public_key),
+            Client["secret"],
+        )
+        for Client in Bundle["clients"]
+    ] == Registered
+
+    # an existing bundle is kept, nothing is registered
+    assert run("--generate", "1", "--output", str(tmp_path / "bundle.json")) == 1
+    assert len(keystore.read_clients(str(tmp_path / "clients.db"))) == 3
+    assert json.loads((tmp_path / "bundle.json").read_text()) == Bundle
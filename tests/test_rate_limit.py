@@ -0,0 +1,151 @@
+import logging
+
+import pytest
+
+import mini_share_point
+from mini_share_point import config, data, statestore
+
+RATE_SETTINGS = "[RateLimit]\nRate=2\nBurst=4\nFailCost=3\n[Proxy]\nForwardFor=1\n"
+
+
+@pytest.fixture(params=["memory", "store"])
+def rate_limit(request, monkeypatch, clock, load_settings, tmp_path):
+    """Rate limit with the buckets of this process or of the shared store"""
+    monkeypatch.setattr(data, "time", clock)
+    assert load_settings(RATE_SETTINGS)
+    assert data.setup_rate_limit(
+        str(tmp_path / "rates.db") if request.param == "store" else ""
+    )
+    yield request.param
+    data.setup_rate_limit()
+
+
+def test_burst_is_allowed_then_throttled(rate_limit):
+    for _ in range(4):
+        assert data.check_rate_limit("10.0.0.1") == 0
+
+    assert data.check_rate_limit("10.0.0.1") == 1
+    # other addresses have their own bucket
+    assert data.check_rate_limit("10.0.0.2") == 0
+
+
+def test_tokens_are_refilled_at_the_rate(rate_limit, clock):
+    for _ in range(4):
+        data.check_rate_limit("10.0.0.1")
+
+    clock.advance(0.5)
+    assert data.check_rate_limit("10.0.0.1") == 0
+    assert data.check_rate_limit("10.0.0.1") == 1
+
+    # refills stop at the burst
+    clock.advance(60)
+    assert [data.check_rate_limit("10.0.0.1") for _ in range(5)] == [0, 0, 0, 0, 1]
+
+
+def test_penalty_drains_the_bucket_below_zero(rate_limit):
+    data.penalize_request_ip("10.0.0.1")
+    assert data.check_rate_limit("10.0.0.1") == 0
+
+    data.penalize_request_ip("10.0.0.1")
+    data.penalize_request_ip("10.0.0.1")
+
+    # at most -Burst, 5 tokens missing at 2 per second
+    assert data.check_rate_limit("10.0.0.1") == 3
+
+
+def test_throttled_requests_take_no_tokens(rate_limit, clock):
+    for _ in range(4):
+        data.check_rate_limit("10.0.0.1")
+
+    for _ in range(10):
+        data.check_rate_limit("10.0.0.1")
+
+    clock.advance(0.5)
+    assert data.check_rate_limit("10.0.0.1") == 0
+
+
+def test_rate_zero_disables_the_limit(rate_limit, load_settings):
+    assert load_settings("[RateLimit]\nRate=0\n")
+
+    data.penalize_request_ip("10.0.0.1")
+    assert all(data.check_rate_limit("10.0.0.1") == 0 for _ in range(100))
+    assert data.get_rate_table_size() == 0
+
+
+def test_full_buckets_are_dropped(rate_limit, clock):
+    data.check_rate_limit("10.0.0.1")
+    clock.advance(1)
+    data.check_rate_limit("10.0.0.2")
+
+    if rate_limit == "memory":
+        assert list(data.RateTable) == ["10.0.0.2"]
+
+    else:
+        assert data.get_rate_table_size() == 2
+
+
+def test_shared_store_is_used_by_all_workers(
+    monkeypatch, clock, load_settings, tmp_path
+):
+    monkeypatch.setattr(data, "time", clock)
+    assert load_settings(RATE_SETTINGS)
+    assert data.setup_rate_limit(str(tmp_path / "rates.db"))
+    # a second worker opens its own connection to the same file
+    Worker = statestore.StateStore(str(tmp_path / "rates.db"), data.RATE_SCHEMA)
+
+    try:
+        for _ in range(2):
+            assert data.check_rate_limit("10.0.0.1") == 0
+            assert data.take_shared_rate_tokens(Worker, "10.0.0.1", 1, False) == 0
+
+        assert data.check_rate_limit("10.0.0.1") == 1
+        assert Worker.execute("SELECT tokens FROM rates WHERE ip = '10.0.0.1'") == [
+            (0.0,)
+        ]
+
+    finally:
+        data.setup_rate_limit()
+
+
+def test_throttled_request_gets_retry_after(server):
+    Server = server(
+        {"rate_text": "def entry_call():\n    return 'text'\n"},
+        Settings="[RateLimit]\nRate=1\nBurst=2\n",
+    )
+
+    assert Server.call("rate_text") == (200, "text")
+    assert Server.call("rate_text") == (200, "text")
+
+    Response = Server.request("rate_text")
+
+    assert Response.status_code == 429
+    assert Response.headers["Retry-After"] == "1"
+
+
+def test_failed_authentication_is_penalized(server):
+    Server = server({}, Settings="[RateLimit]\nRate=1\nBurst=2\nFailCost=10\n")
+
+    assert (
+        Server.post("/v2/", b"{", {"Content-Type": "application/json"}).status_code
+        == 401
+    )
+
+    Response = Server.post("/v2/", b"{", {"Content-Type": "application/json"})
+
+    assert Response.status_code == 429
+    assert Response.headers["Retry-After"] == "3"
+
+
+@pytest.mark.parametrize(
+    "Settings, Warned",
+    [
+        (config.Settings(RateLimit=20), True),
+        (config.Settings(RateLimit=20, ForwardFor=1), False),
+        (config.Settings(), False),
+    ],
+)
+def test_rate_limit_without_proxy_setting_is_warned(caplog, Settings, Warned):
+    with caplog.at_level(logging.WARNING):
+        mini_share_point.check_rate_limit_proxy(Settings)
+
+    assert ("ForwardFor is 0" in caplog.text) == Warned
@@ -0,0 +1,111 @@
+import pytest
+
+from mini_share_point import sec_server, statestore
+
+
+@pytest.fixture
+def replay_cache():
+    assert sec_server.setup_replay_cache(100)
+    yield
+    sec_server.setup_replay_cache(0)
+
+
+@pytest.fixture
+def replay_store(tmp_path):
+    Path = str(tmp_path / "replay.db")
+    assert sec_server.setup_replay_cache(100, Path)
+    yield Path
+    sec_server.setup_replay_cache(0)
+
+
+def count_nonces(Store: statestore.StateStore) -> int:
+    return Store.execute("SELECT COUNT(*) FROM nonces")[0][0]
+
+
+def test_nonce_is_only_accepted_once(replay_cache):
+    assert sec_server.add_nonce(b"a", 10)
+    assert not sec_server.add_nonce(b"a", 10)
+    assert sec_server.add_nonce(b"b", 10)
+
+
+def test_nonce_is_kept_for_two_windows(replay_cache):
+    assert sec_server.add_nonce(b"a", 10)
+    assert not sec_server.add_nonce(b"a", 11)
+    assert not sec_server.add_nonce(b"a", 12)
+
+
+def test_expired_buckets_are_dropped(replay_cache):
+    assert sec_server.add_nonce(b"a", 10)
+    assert sec_server.add_nonce(b"a", 13)
+    assert not sec_server.add_nonce(b"a", 13)
+
+
+def test_full_cache_drops_oldest_bucket():
+    sec_server.setup_replay_cache(2)
+
+    try:
+        assert sec_server.add_nonce(b"a", 10)
+        assert sec_server.add_nonce(b"b", 11)
+        assert not sec_server.add_nonce(b"b", 11)
+        # whole bucket 10 is dropped for the next nonce
+        assert sec_server.add_nonce(b"c", 11)
+        assert sec_server.add_nonce(b"a", 11)
+
+    finally:
+        sec_server.setup_replay_cache(0)
+
+
+def test_disabled_cache_accepts_everything():
+    sec_server.setup_replay_cache(0)
+
+    assert sec_server.check_replay(b"a")
+    assert sec_server.check_replay(b"a")
+
+
+def test_check_replay_uses_cache(replay_cache):
+    assert sec_server.check_replay(b"nonce")
+    assert not sec_server.check_replay(b"nonce")
+
+
+def test_shared_nonce_is_seen_by_all_processes(replay_store):
+    Worker1 = statestore.StateStore(replay_store, sec_server.REPLAY_SCHEMA)
+    Worker2 = statestore.StateStore(replay_store, sec_server.REPLAY_SCHEMA)
+
+    assert sec_server.add_shared_nonce(Worker1, b"a", 100)
+    assert not sec_server.add_shared_nonce(Worker2, b"a", 100)
+    assert not sec_server.add_shared_nonce(Worker1, b"a", 101)
+
+
+def test_shared_buckets_expire(replay_store):
+    Store = statestore.StateStore(replay_store, sec_server.REPLAY_SCHEMA)
+
+    assert sec_server.add_shared_nonce(Store, b"a", 200)
+    assert sec_server.add_shared_nonce(Store, b"b", 201)
+    assert not sec_server.add_shared_nonce(Store, b"a", 202)
+    # bucket 200 is older than two windows
+    assert sec_server.add_shared_nonce(Store, b"a", 203)
+    assert count_nonces(Store) == 2
+
+
+def test_full_shared_store_drops_oldest(tmp_path):
+    Path = str(tmp_path / "replay.db")
+    assert sec_server.setup_replay_cache(2, Path)
+    Store = statestore.StateStore(Path, sec_server.REPLAY_SCHEMA)
+
+    try:
+        assert sec_server.add_shared_nonce(Store, b"a", 300)
+        assert sec_server.add_shared_nonce(Store, b"b", 301)
+        assert sec_server.add_shared_nonce(Store, b"c", 302)
+        assert count_nonces(Store) == 2
+        assert sec_server.add_shared_nonce(Store, b"a", 302)
+
+    finally:
+        sec_server.setup_replay_cache(0)
+
+
+def test_check_replay_uses_store(replay_store):
+    Store = statestore.StateStore(replay_store, sec_server.REPLAY_SCHEMA)
+
+    assert sec_server.check_replay(b"nonce")
+    assert not sec_server.check_replay(b"nonce")
+    assert count_nonces(Store) == 1
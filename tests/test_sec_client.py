@@ -0,0 +1,65 @@
+import base64
+import logging
+import os
+
+from mini_share_point import sec_client
+
+
+def write_old_layout(Path, KeyIDs: list[int], SecretCount: int) -> dict[int, bytes]:
+    """Keyfiles and register as written by append_client before the keystore"""
+    Keys: dict[int, bytes] = {}
+
+    for ClientID in KeyIDs:
+        Keys[ClientID] = os.urandom(32)
+        (Path / f"client_{ClientID}.pub").write_text(
+            base64.b64encode(Keys[ClientID]).decode()
+        )
+
+    (Path / "clients.dev").write_text(
+        "".join(f"secret{Line}\n" for Line in range(1, SecretCount + 1))
+    )
+
+    return Keys
+
+
+def test_keyfiles_are_bound_to_their_register_line(tmp_path, caplog):
+    Keys = write_old_layout(tmp_path, [1, 2, 3], 3)
+
+    assert sec_client.load_client_secret(str(tmp_path / "clients.dev"))
+
+    with caplog.at_level(logging.ERROR):
+        Clients = sec_client.read_client_keys(str(tmp_path))
+
+    assert Clients == [(ID, Keys[ID], f"secret{ID}") for ID in [1, 2, 3]]
+    assert caplog.records == []
+
+
+def test_overwritten_keyfile_is_bound_to_last_line(tmp_path, caplog):
+    # every client after the 10th overwrote client_10.pub
+    write_old_layout(tmp_path, list(range(1, 11)), 13)
+
+    assert sec_client.load_client_secret(str(tmp_path / "clients.dev"))
+
+    with caplog.at_level(logging.ERROR):
+        Clients = dict(
+            (ID, Secret) for ID, _, Secret in sec_client.read_client_keys(str(tmp_path))
+        )
+
+    assert Clients[9] == "secret9"
+    assert Clients[10] == "secret13"
+    assert "register lines 10-12" in caplog.text
+
+
+def test_missing_keyfiles_are_reported(tmp_path, caplog):
+    write_old_layout(tmp_path, [1, 4], 5)
+
+    assert sec_client.load_client_secret(str(tmp_path / "clients.dev"))
+
+    with caplog.at_level(logging.ERROR):
+        Clients = sec_client.read_client_keys(str(tmp_path))
+
+    assert [(ID, Secret) for ID, _, Secret in Clients] == [
+        (1, "secret1"),
+        (4, "secret4"),
+    ]
+    assert "register lines 2-3, 5" in caplog.text
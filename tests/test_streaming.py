@@ -0,0 +1,113 @@
+import pytest
+
+import client
+from mini_share_point import function_factory, metrics
+
+STREAM_MODULE = """
+import time
+
+def entry_call():
+    yield "a"
+    time.sleep(0.4)
+    yield b"b"
+"""
+
+
+@pytest.mark.parametrize("Executor", ["inline", "thread", "process"])
+def test_generator_is_streamed_with_every_executor(load_modules, Executor):
+    Name = f"stream_{Executor}"
+    assert load_modules(
+        {Name: STREAM_MODULE}, f"[module:{Name}]\nExecutor={Executor}\n"
+    )
+
+    assert list(function_factory.call_module(Name)) == ["a", b"b"]
+
+
+def test_stream_timeout_covers_all_chunks(load_modules):
+    assert load_modules(
+        {"stream_slow": STREAM_MODULE},
+        "[module:stream_slow]\nExecutor=thread\nTimeout=0.2\n",
+    )
+
+    Chunks = function_factory.call_module("stream_slow")
+
+    assert next(Chunks) == "a"
+
+    with pytest.raises(function_factory.ModuleTimeout):
+        next(Chunks)
+
+
+def test_stream_holds_its_slot_until_the_end(load_modules):
+    assert load_modules(
+        {"stream_limit": STREAM_MODULE},
+        "[module:stream_limit]\nExecutor=thread\nTimeout=0.1\nMaxConcurrent=1\n",
+    )
+
+    Chunks = function_factory.call_module("stream_limit")
+    next(Chunks)
+
+    with pytest.raises(function_factory.ModuleTimeout, match="too many running"):
+        next(function_factory.call_module("stream_limit"))
+
+    Chunks.close()
+
+    assert next(function_factory.call_module("stream_limit")) == "a"
+
+
+def test_stream_runtime_is_recorded_once(load_modules, monkeypatch):
+    Seen: list[tuple[str, float]] = []
+    monkeypatch.setattr(
+        metrics, "observe", lambda Name, Value, **_: Seen.append((Name, Value))
+    )
+    assert load_modules({"stream_timed": STREAM_MODULE})
+
+    list(function_factory.call_module("stream_timed"))
+
+    assert len(Seen) == 1
+    assert Seen[0][0] == "msp_module_seconds" and Seen[0][1] >= 0.4
+
+
+@pytest.mark.parametrize("Binary", [False, True])
+def test_stream_response_is_decrypted_in_order(server, Binary):
+    Server = server(
+        {"stream_inline": STREAM_MODULE, "stream_process": STREAM_MODULE},
+        "[module:stream_process]\nExecutor=process\n",
+    )
+
+    for Name in ["stream_inline", "stream_process"]:
+        assert Server.call(Name, Binary) == (200, "ab")
+
+
+def test_stream_timeout_before_first_chunk_is_answered(server):
+    Server = server(
+        {"stream_late": STREAM_MODULE.replace('yield "a"', "time.sleep(0.4)")},
+        "[module:stream_late]\nExecutor=thread\nTimeout=0.1\n",
+    )
+
+    assert Server.call("stream_late") == (504, "ERROR: module call timed out")
+
+
+def test_stream_timeout_truncates_the_stream(server):
+    Server = server(
+        {"stream_cut": STREAM_MODULE},
+        "[module:stream_cut]\nExecutor=thread\nTimeout=0.2\n",
+    )
+
+    with pytest.raises(client.ClientError, match="truncated"):
+        Server.call("stream_cut")
+
+
+@pytest.mark.parametrize(
+    "Result, Expected",
+    [
+        ('"text"', (200, "text")),
+        ('"text".encode()', (200, "text")),
+        ("None", (500, "ERROR: module call failed")),
+        ('{"a": 1}', (500, "ERROR: module call failed")),
+    ],
+)
+def test_module_results_are_checked(server, Result, Expected):
+    Server = server({"result_value": f"def entry_call():\n    return {Result}\n"})
+
+    assert Server.call("result_value") == Expected
+    assert Server.call("result_value", Binary=True) == Expected
@@ -0,0 +1,434 @@
+"""Benchmark of the auth and dispatch hot path, runs the server without network"""
+
+import argparse
+import base64
+import datetime
+import json
+import logging
+from nacl.public import PrivateKey
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import client
+
+"""Repository root, the server package is imported from there"""
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+"""Benchmark modules by registered name, (python module, source)"""
+MODULES = {
+    "bench_noop": ("bench_noop", 'def entry_call() -> str:\n    return "ok"\n'),
+    "bench_cpu": (
+        "bench_cpu",
+        "import time\n\n\n"
+        "def entry_call() -> str:\n"
+        "    End = time.perf_counter() + 0.001\n"
+        "    while time.perf_counter() < End:\n"
+        "        pass\n"
+        '    return "ok"\n',
+    ),
+    "bench_sleep": (
+        "bench_sleep",
+        "import time\n\n\n"
+        "def entry_call() -> str:\n"
+        "    time.sleep(0.01)\n"
+        '    return "ok"\n',
+    ),
+}
+
+
+def write_environment(BenchDir: str, Args: argparse.Namespace):
+    """Write config, module config, modules and the server key of the benchmark"""
+    for Subdir in ["sec", "log", "modules"]:
+        os.makedirs(f"{BenchDir}/{Subdir}", exist_ok=True)
+
+    with open(f"{BenchDir}/config.ini", "w") as File:
+        File.write(
+            "[Server]\n"
+            f"Keypath={BenchDir}/sec\n"
+            f"KeyCacheSize={Args.key_cache}\n\n"
+            "[Clients]\n"
+            f"Keypath={BenchDir}/sec\n"
+            f"Register={BenchDir}/sec/clients.dev\n"
+            # payloads are prepared before they are sent
+            "RequestTTL=86400\n"
+            "WatchInterval=0\n"
+            "ReplayCacheSize=10000000\n\n"
+            "[RateLimit]\n"
+            "Rate=0\n\n"
+            "[Metrics]\n"
+            f"Enabled={'true' if Args.metrics else 'false'}\n"
+        )
+
+    with open(f"{BenchDir}/modules.ini", "w") as File:
+        File.write("[Modules]\n")
+
+        for ModName, (PyModule, _) in MODULES.items():
+            File.write(f"{ModName}={PyModule}\n")
+
+    for PyModule, Source in MODULES.values():
+        with open(f"{BenchDir}/modules/{PyModule}.py", "w") as File:
+            File.write(Source)
+
+    with open(f"{BenchDir}/sec/server.key", "w") as File:
+        File.write(base64.b64encode(os.urandom(32)).decode("utf-8"))
+
+    open(f"{BenchDir}/sec/clients.dev", "w").close()
+
+
+def write_clients(BenchDir: str, Count: int) -> list[client.KeyStorage]:
+    """Replace the registered clients with new synthetic ones"""
+    for Filename in os.listdir(f"{BenchDir}/sec"):
+        if Filename.startswith("client_"):
+            os.remove(f"{BenchDir}/sec/{Filename}")
+
+    with open(f"{BenchDir}/sec/server.key", "r") as File:
+        ServerPK = PrivateKey(base64.b64decode(File.readline())).public_key
+
+    Stores: list[client.KeyStorage] = []
+
+    with open(f"{BenchDir}/sec/clients.dev", "w") as Register:
+        for ClientID in range(1, Count + 1):
+            ClientSK = PrivateKey.generate()
+            ClientSecret = os.urandom(64).hex()
+
+            with open(f"{BenchDir}/sec/client_{ClientID}.pub", "w") as File:
+                File.write(base64.b64encode(bytes(ClientSK.public_key)).decode("utf-8"))
+
+            Register.write(ClientSecret + "\n")
+            Stores.append(client.KeyStorage(ClientSecret, ClientSK, ServerPK))
+
+    return Stores
+
+
+def percentile(Sorted: list[float], Percent: float) -> float:
+    """Nearest rank percentile of sorted values"""
+    if len(Sorted) == 0:
+        return 0.0
+
+    Rank = max(0, min(len(Sorted) - 1, round(Percent / 100 * len(Sorted)) - 1))
+
+    return Sorted[Rank]
+
+
+def measure(
+    Name: str,
+    Clients: int,
+    Module: str,
+    Prepare: Callable[[], object],
+    Run: Callable[[object], object],
+    Args: argparse.Namespace,
+) -> dict:
+    """Run a scenario until the request count or the time limit is reached"""
+    # payloads are built before, the client side is not measured
+    for _ in range(Args.warmup):
+        Run(Prepare())
+
+    Payloads = [Prepare() for _ in range(Args.requests)]
+    Latencies: list[float] = []
+    Results: dict[str, int] = {}
+    Start = time.perf_counter()
+
+    for Payload in Payloads:
+        RequestStart = time.perf_counter()
+        Result = str(Run(Payload))
+        Latencies.append(time.perf_counter() - RequestStart)
+        Results[Result] = Results.get(Result, 0) + 1
+
+        if time.perf_counter() - Start > Args.max_time:
+            break
+
+    Elapsed = time.perf_counter() - Start
+    Latencies.sort()
+
+    Stats = {
+        "scenario": Name,
+        "clients": Clients,
+        "module": Module,
+        "requests": len(Latencies),
+        "throughput": len(Latencies) / Elapsed,
+        "p50_ms": percentile(Latencies, 50) * 1000,
+        "p99_ms": percentile(Latencies, 99) * 1000,
+        "mean_ms": sum(Latencies) / len(Latencies) * 1000,
+        "results": Results,
+    }
+    logging.info(
+        "%-16s clients=%-6d module=%-12s %9.1f req/s p50 %.3f ms p99 %.3f ms %s",
+        Name,
+        Clients,
+        Module,
+        Stats["throughput"],
+        Stats["p50_ms"],
+        Stats["p99_ms"],
+        Results,
+    )
+
+    return Stats
+
+
+def run_benchmark(Args: argparse.Namespace, BenchDir: str) -> list[dict]:
+    """Run all scenarios for every number of clients"""
+    write_environment(BenchDir, Args)
+    os.environ["MSP_CONFIG_PATH"] = f"{BenchDir}/config.ini"
+    os.environ["MSP_MODCONF_PATH"] = f"{BenchDir}/modules.ini"
+    os.environ["MSP_LOGFILE_PATH"] = f"{BenchDir}/log"
+    os.environ["MSP_LOGLEVEL"] = Args.loglevel
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, f"{BenchDir}/modules")
+
+    # server reads its paths from the environment on import
+    import mini_share_point
+    from mini_share_point import config, sec_client, sec_server
+
+    App = mini_share_point.create_app()
+    TestClient = App.test_client()
+    Results: list[dict] = []
+
+    for Count in Args.clients:
+        Stores = write_clients(BenchDir, Count)
+        Settings = config.get_settings()
+        sec_client.reload_clients(Settings.ClientRegister, Settings.ClientKeypath)
+        sec_server.clear_box_cache()
+        # requests of an unregistered client have to try every key
+        Unknown = client.KeyStorage(
+            os.urandom(64).hex(), PrivateKey.generate(), Stores[0].ServerPK
+        )
+
+        def prepare_valid(Module: str, KeyID: bool = True) -> Callable[[], dict]:
+            def prepare() -> dict:
+                Payload = client.prepare_payload(random.choice(Stores), Module)
+
+                if not KeyID:
+                    Payload.pop("kid")
+
+                return Payload
+
+            return prepare
+
+        def prepare_invalid() -> dict:
+            Payload = client.prepare_payload(Unknown, "bench_noop")
+            Payload.pop("kid")
+            return Payload
+
+        def prepare_envelope(Module: str | list[str]) -> Callable[[], dict]:
+            def prepare() -> dict:
+                if isinstance(Module, str):
+                    return client.prepare_envelope(random.choice(Stores), Module)
+
+                return client.prepare_batch_envelope(random.choice(Stores), Module)
+
+            return prepare
+
+        def prepare_binary(Module: str) -> Callable[[], bytes]:
+            def prepare() -> bytes:
+                return client.prepare_binary_envelope(random.choice(Stores), Module)
+
+            return prepare
+
+        def decrypt(Payload: dict) -> str:
+            return sec_server.decrypt_remote_call(
+                Payload["id"],
+                Payload["check"],
+                Payload["ts"],
+                Payload["entry"],
+                Payload.get("kid", ""),
+            ).ReturnCode.name
+
+        def decrypt_v2(Payload: dict) -> str:
+            return sec_server.decrypt_envelope(
+                Payload["msg"], Payload["kid"]
+            ).ReturnCode.name
+
+        def post(Payload: dict) -> int:
+            return TestClient.post("/v1/", json=Payload).status_code
+
+        def post_v2(Payload: dict) -> int:
+            return TestClient.post("/v2/", json=Payload).status_code
+
+        def post_binary(Payload: bytes) -> int:
+            return TestClient.post(
+                "/v2/",
+                data=Payload,
+                headers={
+                    "Content-Type": "application/x-msp-frame",
+                    "Accept": "application/x-msp-frame",
+                },
+            ).status_code
+
+        Results += [
+            measure(
+                "decrypt_kid", Count, "", prepare_valid("bench_noop"), decrypt, Args
+            ),
+            measure(
+                "decrypt_search",
+                Count,
+                "",
+                prepare_valid("bench_noop", False),
+                decrypt,
+                Args,
+            ),
+            measure("decrypt_invalid", Count, "", prepare_invalid, decrypt, Args),
+            measure(
+                "v1_valid",
+                Count,
+                "bench_noop",
+                prepare_valid("bench_noop"),
+                post,
+                Args,
+            ),
+            measure(
+                "v1_search",
+                Count,
+                "bench_noop",
+                prepare_valid("bench_noop", False),
+                post,
+                Args,
+            ),
+            measure("v1_invalid", Count, "bench_noop", prepare_invalid, post, Args),
+            measure(
+                "decrypt_v2",
+                Count,
+                "",
+                prepare_envelope("bench_noop"),
+                decrypt_v2,
+                Args,
+            ),
+            measure(
+                "v2_json",
+                Count,
+                "bench_noop",
+                prepare_envelope("bench_noop"),
+                post_v2,
+                Args,
+            ),
+            measure(
+                "v2_binary",
+                Count,
+                "bench_noop",
+                prepare_binary("bench_noop"),
+                post_binary,
+                Args,
+            ),
+        ]
+
+        # module costs do not depend on the number of clients
+        if Count == Args.clients[0]:
+            for ModName in MODULES:
+                Results.append(
+                    measure(
+                        "v1_module",
+                        Count,
+                        ModName,
+                        prepare_valid(ModName),
+                        post,
+                        Args,
+                    )
+                )
+
+            # all modules in one request, compared to the sum of the v1 calls
+            Results.append(
+                measure(
+                    "v2_batch",
+                    Count,
+                    ",".join(MODULES),
+                    prepare_envelope(list(MODULES)),
+                    post_v2,
+                    Args,
+                )
+            )
+
+    return Results
+
+
+def get_revision() -> str:
+    """Git revision of the benchmarked tree, empty if unknown"""
+    try:
+        return subprocess.run(
+            ["git", "-C", REPO_DIR, "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare_results(Old: list[dict], New: list[dict]):
+    """Log the changes against the results of an older run"""
+    OldIndex = {(R["scenario"], R["clients"], R["module"]): R for R in Old}
+
+    for Result in New:
+        OldResult = OldIndex.get(
+            (Result["scenario"], Result["clients"], Result["module"])
+        )
+
+        if OldResult is None:
+            continue
+
+        logging.info(
+            "%-16s clients=%-6d module=%-12s %+.1f%% req/s p50 %+.1f%% p99 %+.1f%%",
+            Result["scenario"],
+            Result["clients"],
+            Result["module"],
+            (Result["throughput"] / OldResult["throughput"] - 1) * 100,
+            (Result["p50_ms"] / OldResult["p50_ms"] - 1) * 100,
+            (Result["p99_ms"] / OldResult["p99_ms"] - 1) * 100,
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="[%(asctime)s] %(levelname)s: %(message)s", level="INFO")
+
+    Parser = argparse.ArgumentParser(description=__doc__)
+    Parser.add_argument(
+        "--clients",
+        type=int,
+        nargs="+",
+        default=[1, 100, 1000, 10000],
+        help="numbers of registered clients to benchmark",
+    )
+    Parser.add_argument("--requests", type=int, default=200, help="per scenario")
+    Parser.add_argument("--warmup", type=int, default=20, help="per scenario")
+    Parser.add_argument(
+        "--max-time", type=float, default=10.0, help="seconds per scenario"
+    )
+    Parser.add_argument("--key-cache", type=int, default=8192, help="KeyCacheSize")
+    Parser.add_argument("--metrics", action="store_true", help="enable metrics")
+    Parser.add_argument("--loglevel", default="ERROR", help="server log level")
+    Parser.add_argument("--output", default="", help="result file (JSON)")
+    Parser.add_argument("--compare", default="", help="older result file (JSON)")
+    Args = Parser.parse_args()
+
+    random.seed(0)
+    Started = datetime.datetime.now(datetime.timezone.utc)
+
+    with tempfile.TemporaryDirectory(prefix="msp-bench-") as BenchDir:
+        Results = run_benchmark(Args, BenchDir)
+
+    Report = {
+        "meta": {
+            "date": Started.isoformat(),
+            "revision": get_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(Args),
+        },
+        "results": Results,
+    }
+
+    Output = Args.output or f"benchmark-{Started.strftime('%Y%m%d-%H%M%S')}.json"
+
+    with open(Output, "w") as File:
+        json.dump(Report, File, indent=2)
+
+    logging.info("Results written to: %s", Output)
+
+    if Args.compare != "":
+        with open(Args.compare, "r") as File:
+            compare_results(json.load(File)["results"], Results)
@@ -1,16 +1,25 @@
 """This file implements a simple client for authentication with the Server endpoint"""
 
+import argparse
 import base64
 import binascii
+import concurrent.futures
 import dataclasses
+import hashlib
 import json
 import logging
 from nacl.public import PrivateKey, PublicKey, Box
 from nacl.exceptions import CryptoError
 import os
 import requests
-import sys
+import requests.adapters
+import threading
 import time
+from typing import Iterator
+
+
+class ClientError(Exception):
+    """Request failed or the server response could not be decrypted"""
 
 
 @dataclasses.dataclass
@@ -18,6 +27,23 @@ class KeyStorage:
     ClientSecret: str
     ClientSK: PrivateKey
     ServerPK: PublicKey
+    # shared key and fingerprint are computed once on first use
+    KeyBox: Box | None = dataclasses.field(default=None, repr=False, compare=False)
+    KeyID: str = dataclasses.field(default="", repr=False, compare=False)
+
+    def get_box(self) -> Box:
+        """Box with the precomputed shared key of client and server"""
+        if self.KeyBox is None:
+            self.KeyBox = Box(self.ClientSK, self.ServerPK)
+
+        return self.KeyBox
+
+    def get_key_id(self) -> str:
+        """Fingerprint of the own public key"""
+        if self.KeyID == "":
+            self.KeyID = key_fingerprint(bytes(self.ClientSK.public_key))
+
+        return self.KeyID
 
 
 def check_file_exist(Filepath: str) -> bool:
@@ -30,86 +56,71 @@ def check_file_exist(Filepath: str) -> bool:
         return False
 
 
+def read_keyfile(Keyfile: str, Name: str) -> bytes:
+    """Read a base64 encoded key from a file"""
+    if not check_file_exist(Keyfile):
+        raise ClientError(f"{Name} <{Keyfile}> not found!")
+
+    with open(Keyfile, "r") as File:
+        KeyStr = File.readline()
+
+    try:
+        Keybytes = base64.b64decode(KeyStr)
+
+    except binascii.Error:
+        raise ClientError(f"{Name} <{Keyfile}> malformed!")
+
+    if len(Keybytes) != 32:
+        raise ClientError(f"{Name} <{Keyfile}> malformed!")
+
+    return Keybytes
+
+
 def load_keystore(
     ClientSecret: str, ClientKeyFile: str, ServerPubFile: str
 ) -> KeyStorage:
     """Load all necessary key files for operation"""
-    RetStore = KeyStorage
-
     # client hex secret
     if not check_file_exist(ClientSecret):
-        logging.critical("Client secret file <%s> not found!", ClientSecret)
-        exit(1)
+        raise ClientError(f"Client secret file <{ClientSecret}> not found!")
 
     with open(ClientSecret) as Keyfile:
-        RetStore.ClientSecret = Keyfile.readline()
+        StrSecret = Keyfile.readline()
 
     # client secret key
-    if not check_file_exist(ClientKeyFile):
-        logging.critical("Client private keyfile <%s> not found!", ClientKeyFile)
-        exit(1)
-
-    with open(ClientKeyFile, "r") as Keyfile:
-        KeyStr = Keyfile.readline()
-        Keybytes: bytes
-
-        try:
-            Keybytes = base64.b64decode(KeyStr)
-
-        except binascii.Error:
-            logging.critical("Client private keyfile <%s> malformed!", ClientKeyFile)
-            exit(1)
-
-        if len(Keybytes) != 32:
-            logging.critical("Client private keyfile <%s> malformed!", ClientKeyFile)
-            exit(1)
-
-        RetStore.ClientSK = PrivateKey(Keybytes)
-
+    ClientSK = PrivateKey(read_keyfile(ClientKeyFile, "Client private keyfile"))
     # server public key
-    check_file_exist(ServerPubFile)
-    with open(ServerPubFile, "r") as Keyfile:
-        KeyStr = Keyfile.readline()
-        Keybytes: bytes
-
-        try:
-            Keybytes = base64.b64decode(KeyStr)
-
-        except binascii.Error:
-            logging.critical("Server public keyfile <%s> malformed!", ServerPubFile)
-            exit(1)
+    ServerPK = PublicKey(read_keyfile(ServerPubFile, "Server public keyfile"))
 
-        if len(Keybytes) != 32:
-            logging.critical("Server public keyfile <%s> malformed!", ServerPubFile)
-            exit(1)
+    return KeyStorage(StrSecret, ClientSK, ServerPK)
 
-        RetStore.ServerPK = PublicKey(Keybytes)
 
-    return RetStore
+def key_fingerprint(KeyBytes: bytes) -> str:
+    """Short identifier of a public key, lets the server select the client key"""
+    return hashlib.blake2b(KeyBytes, digest_size=8).hexdigest()
 
 
 def prepare_payload(KeyStore: KeyStorage, RemoteMethod: str) -> dict[str, str]:
     """Generate a JSON-like dictionary to send as request to the server"""
+    # every part gets its own random nonce, the shared key is the same
+    MsgBox = KeyStore.get_box()
+
     # encrypted message
-    MsgBox = Box(KeyStore.ClientSK, KeyStore.ServerPK)
     SecMsgBytes = KeyStore.ClientSecret.encode("utf-8")
     MsgEncrypt = MsgBox.encrypt(SecMsgBytes)
 
     # crc32 encrypted message
-    CRCBox = Box(KeyStore.ClientSK, KeyStore.ServerPK)
     # calculated crc32 from actual key
     SecCRC = binascii.crc32(SecMsgBytes)
-    CRCEncrypt = CRCBox.encrypt(SecCRC.to_bytes((SecCRC.bit_length() + 7) // 8, "big"))
+    CRCEncrypt = MsgBox.encrypt(SecCRC.to_bytes((SecCRC.bit_length() + 7) // 8, "big"))
     # current timestamp
-    TimeBox = Box(KeyStore.ClientSK, KeyStore.ServerPK)
     SecTime = int(time.time())
-    TimeEncrypt = TimeBox.encrypt(
+    TimeEncrypt = MsgBox.encrypt(
         SecTime.to_bytes((SecTime.bit_length() + 7) // 8, "big")
     )
 
     # encrypted remote function call
-    FuncBox = Box(KeyStore.ClientSK, KeyStore.ServerPK)
-    FuncEncrypt = FuncBox.encrypt((RemoteMethod).encode("utf-8"))
+    FuncEncrypt = MsgBox.encrypt((RemoteMethod).encode("utf-8"))
 
     # starting here: anything sent could be dangerous!
     StrEncrypt = base64.urlsafe_b64encode(MsgEncrypt).decode("utf-8")
@@ -117,25 +128,96 @@ def prepare_payload(KeyStore: KeyStorage, RemoteMethod: str) -> dict[str, str]:
     StrTime = base64.urlsafe_b64encode(TimeEncrypt).decode("utf-8")
     StrFunc = base64.urlsafe_b64encode(FuncEncrypt).decode("utf-8")
 
-    Data = {"id": StrEncrypt, "check": StrCRC, "ts": StrTime, "entry": StrFunc}
+    Data = {
+        "id": StrEncrypt,
+        "check": StrCRC,
+        "ts": StrTime,
+        "entry": StrFunc,
+        # fingerprint of own public key
+        "kid": KeyStore.get_key_id(),
+    }
 
     return Data
 
 
+def encrypt_envelope(KeyStore: KeyStorage, RemoteMethod: str | list[str]) -> bytes:
+    """Encrypt the v2 envelope for a single function or a batch of functions"""
+    Envelope = {
+        "secret": KeyStore.ClientSecret,
+        "ts": int(time.time()),
+    }
+
+    if isinstance(RemoteMethod, str):
+        Envelope["entry"] = RemoteMethod
+
+    else:
+        Envelope["entries"] = RemoteMethod
+
+    return bytes(KeyStore.get_box().encrypt(json.dumps(Envelope).encode("utf-8")))
+
+
+def prepare_envelope(KeyStore: KeyStorage, RemoteMethod: str) -> dict[str, str]:
+    """Generate a single envelope request for the v2 endpoint of the server"""
+    EnvelopeEncrypt = encrypt_envelope(KeyStore, RemoteMethod)
+
+    # starting here: anything sent could be dangerous!
+    StrEnvelope = base64.urlsafe_b64encode(EnvelopeEncrypt).decode("utf-8")
+
+    Data = {"msg": StrEnvelope, "kid": KeyStore.get_key_id()}
+
+    return Data
+
+
+def prepare_batch_envelope(
+    KeyStore: KeyStorage, RemoteMethods: list[str]
+) -> dict[str, str]:
+    """Generate a v2 envelope request that calls several functions at once"""
+    EnvelopeEncrypt = encrypt_envelope(KeyStore, RemoteMethods)
+
+    # starting here: anything sent could be dangerous!
+    StrEnvelope = base64.urlsafe_b64encode(EnvelopeEncrypt).decode("utf-8")
+
+    Data = {"msg": StrEnvelope, "kid": KeyStore.get_key_id()}
+
+    return Data
+
+
+def prepare_binary_envelope(
+    KeyStore: KeyStorage, RemoteMethod: str | list[str]
+) -> bytes:
+    """Generate a binary v2 request, saves the base64 and JSON overhead"""
+    EnvelopeEncrypt = encrypt_envelope(KeyStore, RemoteMethod)
+    KeyID = bytes.fromhex(KeyStore.get_key_id())
+
+    # key ID length (1) | key ID | envelope length (4) | envelope
+    return (
+        bytes([len(KeyID)])
+        + KeyID
+        + len(EnvelopeEncrypt).to_bytes(4, "big")
+        + EnvelopeEncrypt
+    )
+
+
+def check_status(Req: requests.Response, URL: str):
+    """Raise ClientError unless the response has an encrypted message"""
+    if Req.status_code == 401:
+        raise ClientError(f"Unauthorized request [401] on {URL}")
+
+    # timed out module calls still return an encrypted error message
+    if Req.status_code == 504:
+        logging.warning("Remote module timed out on %s", URL)
+
+    elif Req.status_code != 200:
+        raise ClientError(f"Request error [{Req.status_code}] on {URL}")
+
+
 def send_auth(URL: str, Payload: dict[str, str]) -> str:
     """Sends the payload to the server and returns the awnser if successful"""
     Req = requests.post(
         URL, data=json.dumps(Payload), headers={"Content-Type": "application/json"}
     )
 
-    if Req.status_code == 401:
-        logging.warning("Unauthorized request made one: %s", URL)
-        return
-
-    elif not Req.status_code == 200:
-        logging.warning("Request error [%d] on %s:", Req.status_code, URL)
-        return
-
+    check_status(Req, URL)
     EncryptResponse = ""
 
     try:
@@ -144,51 +226,403 @@ def send_auth(URL: str, Payload: dict[str, str]) -> str:
         if "value" in JsonReq:
             EncryptResponse = JsonReq["value"]
 
-    except requests.exceptions.JSONDecodeError as e:
-        logging.warning("Could not decode JSON response from server!")
-        print(e)
+    except requests.exceptions.JSONDecodeError:
+        raise ClientError("Could not decode JSON response from server!")
 
     if EncryptResponse == "":
-        logging.critical("Empty response from server!")
-        exit(1)
+        raise ClientError("Empty response from server!")
 
     return EncryptResponse
 
 
+def send_auth_binary(URL: str, Payload: bytes) -> bytes:
+    """Sends a binary payload to the server and returns the binary awnser"""
+    Req = requests.post(
+        URL,
+        data=Payload,
+        headers={
+            "Content-Type": "application/x-msp-frame",
+            "Accept": "application/x-msp-frame",
+        },
+    )
+
+    check_status(Req, URL)
+
+    return Req.content
+
+
+def decrypt_binary_awnser(Data: bytes, KeyStore: KeyStorage) -> str:
+    """Decrypt a binary message frame from the server"""
+    FrameLen = int.from_bytes(Data[:4], "big")
+
+    if len(Data) != FrameLen + 4:
+        raise ClientError("Malformed binary response from server!")
+
+    try:
+        return KeyStore.get_box().decrypt(Data[4:]).decode("utf-8")
+
+    except CryptoError:
+        raise ClientError("Server decryption error!")
+
+
 def decrypt_awnser(Data: str, KeyStore: KeyStorage) -> str:
     """Decrypt the resulting message from the server"""
     RespEncrypt = base64.urlsafe_b64decode(Data)
-    ResponseBox = Box(KeyStore.ClientSK, KeyStore.ServerPK)
     Response = ""
 
     try:
-        ResBytes = ResponseBox.decrypt(RespEncrypt)
+        ResBytes = KeyStore.get_box().decrypt(RespEncrypt)
         Response = ResBytes.decode("utf-8")
 
     except CryptoError:
-        logging.critical("Server decryption error!")
-        exit(1)
+        raise ClientError("Server decryption error!")
 
     return Response
 
 
+def split_frames(Chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Split received binary data into the length prefixed frames"""
+    Buffer = b""
+
+    for Chunk in Chunks:
+        Buffer += Chunk
+
+        while len(Buffer) >= 4:
+            FrameLen = int.from_bytes(Buffer[:4], "big")
+
+            if len(Buffer) < FrameLen + 4:
+                break
+
+            yield Buffer[4 : FrameLen + 4]
+            Buffer = Buffer[FrameLen + 4 :]
+
+
+def decode_lines(Lines: Iterator[bytes]) -> Iterator[bytes]:
+    """Decode the base64 lines of a text stream"""
+    for Line in Lines:
+        if Line == b"":
+            continue
+
+        try:
+            yield base64.urlsafe_b64decode(Line)
+
+        except binascii.Error:
+            raise ClientError("Malformed stream from server!")
+
+
+def send_auth_stream(URL: str, Payload: dict[str, str] | bytes) -> Iterator[bytes]:
+    """Sends a JSON or binary payload and returns the encrypted response frames"""
+    Binary = isinstance(Payload, bytes)
+    Req = requests.post(
+        URL,
+        data=Payload if Binary else json.dumps(Payload),
+        headers=(
+            {
+                "Content-Type": "application/x-msp-frame",
+                "Accept": "application/x-msp-frame",
+            }
+            if Binary
+            else {"Content-Type": "application/json"}
+        ),
+        stream=True,
+    )
+
+    if Req.status_code != 200:
+        raise ClientError(f"Request error [{Req.status_code}] on {URL}")
+
+    ContentType = Req.headers.get("Content-Type", "")
+
+    if ContentType.startswith("application/x-msp-frame-stream"):
+        return split_frames(Req.iter_content(65536))
+
+    if ContentType.startswith("application/x-msp-stream"):
+        return decode_lines(Req.iter_lines())
+
+    # module did not stream -> single message as stream
+    logging.warning("Server response is not a stream!")
+    return iter([])
+
+
+def decrypt_stream(Frames: Iterator[bytes], KeyStore: KeyStorage) -> Iterator[bytes]:
+    """Decrypt a streamed server response chunk by chunk"""
+    ResponseBox = KeyStore.get_box()
+    StreamID = None
+    NextSeq = 0
+
+    for FrameEncrypt in Frames:
+        try:
+            Frame = ResponseBox.decrypt(FrameEncrypt)
+
+        except CryptoError:
+            raise ClientError("Server decryption error!")
+
+        # header: stream ID (16) | sequence number (8) | final flag (1)
+        FrameStreamID = Frame[:16]
+        Seq = int.from_bytes(Frame[16:24], "big")
+        Final = Frame[24] == 1
+
+        if StreamID is None:
+            StreamID = FrameStreamID
+
+        if FrameStreamID != StreamID or Seq != NextSeq:
+            raise ClientError("Server stream out of order!")
+
+        if Final:
+            return
+
+        NextSeq += 1
+        yield Frame[25:]
+
+    raise ClientError("Server stream was truncated!")
+
+
+def decrypt_batch_awnser(Data: str, KeyStore: KeyStorage) -> dict[str, str]:
+    """Decrypt the response of a batch request, results are indexed by function"""
+    return json.loads(decrypt_awnser(Data, KeyStore))
+
+
+class MSPClient:
+    """Client for the v2 endpoint, connections and the shared key are reused"""
+
+    """Responses worth another try, the request did not reach a module"""
+    RETRY_STATUS = [429, 502, 503]
+
+    def __init__(
+        self,
+        URL: str,
+        KeyStore: KeyStorage,
+        Parallel: int = 8,
+        Retries: int = 2,
+        Timeout: float = 10.0,
+        Binary: bool = False,
+    ):
+        self.URL = URL
+        self.KeyStore = KeyStore
+        self.Parallel = max(1, Parallel)
+        self.Retries = max(0, Retries)
+        self.Timeout = Timeout
+        self.Binary = Binary
+        # keep-alive connections, one per parallel call
+        self.Session = requests.Session()
+        Adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.Parallel
+        )
+        self.Session.mount("http://", Adapter)
+        self.Session.mount("https://", Adapter)
+        self.Executor: concurrent.futures.ThreadPoolExecutor | None = None
+        self.ExecutorLock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """Close all connections and stop the worker threads"""
+        if self.Executor is not None:
+            self.Executor.shutdown(wait=True)
+
+        self.Session.close()
+
+    def post(self, RemoteMethod: str | list[str]) -> requests.Response:
+        """Send a request, retried with a new envelope as resent ones are replays"""
+        Attempt = 0
+
+        while True:
+            if self.Binary:
+                Data = prepare_binary_envelope(self.KeyStore, RemoteMethod)
+                Headers = {
+                    "Content-Type": "application/x-msp-frame",
+                    "Accept": "application/x-msp-frame",
+                }
+
+            else:
+                Data = json.dumps(
+                    prepare_envelope(self.KeyStore, RemoteMethod)
+                    if isinstance(RemoteMethod, str)
+                    else prepare_batch_envelope(self.KeyStore, RemoteMethod)
+                )
+                Headers = {"Content-Type": "application/json"}
+
+            try:
+                Req = self.Session.post(
+                    self.URL, data=Data, headers=Headers, timeout=self.Timeout
+                )
+
+            except requests.exceptions.ConnectionError as e:
+                if Attempt >= self.Retries:
+                    raise ClientError(f"Connection to {self.URL} failed: {e}")
+
+                Attempt += 1
+                time.sleep(0.1 * 2**Attempt)
+                continue
+
+            # the module may have run already, timeouts are not retried
+            except requests.exceptions.RequestException as e:
+                raise ClientError(f"Request to {self.URL} failed: {e}")
+
+            if Req.status_code not in self.RETRY_STATUS or Attempt >= self.Retries:
+                return Req
+
+            Attempt += 1
+            Wait = Req.headers.get("Retry-After", "")
+            time.sleep(min(float(Wait), 5.0) if Wait.isdigit() else 0.1 * 2**Attempt)
+
+    def decrypt_response(self, Req: requests.Response) -> str:
+        """Decrypt a single message or a streamed response"""
+        ContentType = Req.headers.get("Content-Type", "")
+
+        if ContentType.startswith("application/x-msp-frame-stream"):
+            Frames = split_frames([Req.content])
+
+        elif ContentType.startswith("application/x-msp-stream"):
+            Frames = decode_lines(Req.content.splitlines())
+
+        elif ContentType.startswith("application/x-msp-frame"):
+            return decrypt_binary_awnser(Req.content, self.KeyStore)
+
+        else:
+            try:
+                return decrypt_awnser(Req.json()["value"], self.KeyStore)
+
+            except (ValueError, KeyError, TypeError):
+                raise ClientError("Could not decode JSON response from server!")
+
+        return b"".join(decrypt_stream(Frames, self.KeyStore)).decode("utf-8")
+
+    def call(self, RemoteMethod: str) -> str:
+        """Call a remote function and return its decrypted result"""
+        Req = self.post(RemoteMethod)
+
+        # timed out module calls still return an encrypted error message
+        if Req.status_code not in [200, 504]:
+            raise ClientError(f"Request error [{Req.status_code}] on {self.URL}")
+
+        return self.decrypt_response(Req)
+
+    def call_batch(self, RemoteMethods: list[str]) -> dict[str, str]:
+        """Call several remote functions with a single request"""
+        Req = self.post(RemoteMethods)
+
+        if Req.status_code != 200:
+            raise ClientError(f"Request error [{Req.status_code}] on {self.URL}")
+
+        return json.loads(self.decrypt_response(Req))
+
+    def get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Thread pool for concurrent calls, created on first use"""
+        with self.ExecutorLock:
+            if self.Executor is None:
+                self.Executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.Parallel, thread_name_prefix="msp-client"
+                )
+
+        return self.Executor
+
+    def submit(self, RemoteMethod: str) -> concurrent.futures.Future:
+        """Call a remote function in the background"""
+        return self.get_executor().submit(self.call, RemoteMethod)
+
+    def call_many(self, RemoteMethods: list[str]) -> list[str | ClientError]:
+        """Call remote functions concurrently, failed calls return their error"""
+        Results: list[str | ClientError] = []
+
+        for Future in [self.submit(Method) for Method in RemoteMethods]:
+            try:
+                Results.append(Future.result())
+
+            except ClientError as e:
+                Results.append(e)
+
+        return Results
+
+
+def run_load(
+    Client: MSPClient, RemoteMethod: str, Rate: float, Duration: float
+) -> dict:
+    """Send requests at a fixed rate and measure their latency"""
+
+    # latency counts from the planned start, a slow server can not hide queued calls
+    def timed_call(Planned: float) -> float:
+        Client.call(RemoteMethod)
+        return time.perf_counter() - Planned
+
+    Futures: list[concurrent.futures.Future] = []
+    Start = time.perf_counter()
+    Planned = Start
+
+    while Planned - Start < Duration:
+        Sleep = Planned - time.perf_counter()
+
+        if Sleep > 0:
+            time.sleep(Sleep)
+
+        Futures.append(Client.get_executor().submit(timed_call, Planned))
+        Planned += 1 / Rate
+
+    Latencies: list[float] = []
+    Errors: dict[str, int] = {}
+
+    for Future in Futures:
+        try:
+            Latencies.append(Future.result())
+
+        except ClientError as e:
+            Errors[str(e)] = Errors.get(str(e), 0) + 1
+
+    Elapsed = time.perf_counter() - Start
+    Latencies.sort()
+
+    def percentile(Percent: float) -> float:
+        if len(Latencies) == 0:
+            return 0.0
+
+        return Latencies[min(len(Latencies) - 1, int(Percent / 100 * len(Latencies)))]
+
+    return {
+        "sent": len(Futures),
+        "ok": len(Latencies),
+        "errors": Errors,
+        "rate": len(Latencies) / Elapsed,
+        "p50_ms": percentile(50) * 1000,
+        "p99_ms": percentile(99) * 1000,
+    }
+
+
 if __name__ == "__main__":
     logging.basicConfig(format="[%(asctime)s] %(levelname)s: %(message)s", level="INFO")
 
-    # Read in URL to connect to
-    if len(sys.argv) != 2:
-        print("Usage:\n\tclient.py <URL>")
+    Parser = argparse.ArgumentParser(description=__doc__)
+    Parser.add_argument("URL", help="v2 endpoint, e.g. http://localhost:8000/v2/")
+    Parser.add_argument("--module", default="time_test", help="remote function")
+    Parser.add_argument("--keys", default=".", help="directory of the keyfiles")
+    Parser.add_argument("--parallel", type=int, default=8, help="concurrent calls")
+    Parser.add_argument("--retries", type=int, default=2)
+    Parser.add_argument("--binary", action="store_true", help="binary requests")
+    Parser.add_argument("--load", type=float, default=0, help="requests per second")
+    Parser.add_argument("--duration", type=float, default=10, help="load seconds")
+    Args = Parser.parse_args()
+
+    try:
+        # load the default keys for the client
+        DefaultStorage = load_keystore(
+            f"{Args.keys}/client.secret",
+            f"{Args.keys}/client.key",
+            f"{Args.keys}/server.pub",
+        )
+
+        with MSPClient(
+            Args.URL, DefaultStorage, Args.parallel, Args.retries, Binary=Args.binary
+        ) as Client:
+            if Args.load > 0:
+                logging.info(
+                    "%s", run_load(Client, Args.module, Args.load, Args.duration)
+                )
+
+            else:
+                logging.info("%s", Client.call(Args.module))
+
+    except ClientError as e:
+        logging.critical("%s", e)
         exit(1)
-    URL = sys.argv[1]
-
-    # BASIC CLIENT AUTH CHAIN
-    # load the default keys for the client
-    DefaultStorage = load_keystore("client.secret", "client.key", "server.pub")
-    # Generate the payload with a given remote function
-    PL = prepare_payload(DefaultStorage, "time_test")
-    # Send request to the server
-    EncryptAwnser = send_auth(URL, PL)
-    # Decrypt the response
-    DecryptAwnser = decrypt_awnser(EncryptAwnser, DefaultStorage)
-
-    logging.info("%s", DecryptAwnser)